@@ -7,26 +7,36 @@ Created on Fri Feb 24 14:36:39 2023
 
 # Third party imports
 import numpy as np
-import matplotlib.pyplot as plt
-import numpy.random as npr
-import scipy.stats as scs
-from scipy.stats import norm 
+from numpy.polynomial.laguerre import lagvander
 import math as math
 
 # Local package imports
 from base import OptionPricingModel
 from base import OPTION_TYPE
+from base import EXECUTOR
+from base import RunningStatistics
+from base import _estimate_from_plain
+from base import simulate_to_tolerance
+from base import simulate_in_parallel
+from kernels import get_kernels
+from instrumentation import stage, instrumented
 
 
 class AmericanPricing(OptionPricingModel):
     """ 
-    Class implementing calculation for European option price using Monte Carlo Simulation.
-    We simulate underlying asset price on expiry date using random stochastic process - Brownian motion.
-    For the simulation generated prices at maturity, we calculate and sum up their payoffs, average them and discount the final value.
-    That value represents option price
+    Class implementing calculation for American option price using Least Squares Monte Carlo (Longstaff-Schwartz).
+    We simulate daily underlying asset prices using random stochastic process - Brownian motion.
+    Going backward from the expiry date, on every day the value of continuing is estimated by regressing discounted future
+    cash flows of in-the-money paths on the current price, and the option is exercised where exercise value is higher.
+    Average of discounted cash flows represents option price
     """
 
-    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations):
+    # Degree of Laguerre polynomials used for continuation value regression
+    REGRESSION_DEGREE = 3
+    # Relative cutoff of singular values of normal equations, directions below it only fit rounding errors
+    REGRESSION_RCOND = 1e-12
+
+    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations, seed=None):
         """
         Initializes variables used in Black-Scholes formula .
         underlying_spot_price: current stock or other underlying spot price
@@ -35,12 +45,10 @@ class AmericanPricing(OptionPricingModel):
         risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
         sigma: volatility of the underlying asset (standard deviation of asset's log returns)
         number_of_simulations: number of potential random underlying price movements 
+        seed: seed (or SeedSequence/Generator) of random number generator, None draws fresh entropy
         """
         # Parameters for Variance Reduction
         self.N = number_of_simulations
-        self.T = days_to_maturity / 365
-        self.r = risk_free_rate
-        self.sigma = sigma 
         # Parameters for Brownian
         self.S_0 = underlying_spot_price
         self.K = strike_price
@@ -48,59 +56,402 @@ class AmericanPricing(OptionPricingModel):
         self.r = risk_free_rate
         self.sigma = sigma 
 
-        # Parameters for simulation
+        # Parameters for simulation: one step per day, rows of simulated paths include the starting point
+        self.days_to_maturity = days_to_maturity
         self.num_of_steps = days_to_maturity +1
-        self.dt = self.T / self.num_of_steps
+        self.dt = self.T / days_to_maturity
         self.df=math.exp(self.r*self.dt*-1)       
+        self.seed = seed
+        self.simulation_results_S = None
 
-    def _calculate_call_option_price(self): 
-        # Initializing price movements for simulation: rows as time index and columns as different random price movements.
-        S = np.zeros((self.num_of_steps, self.N))        
-       # Starting value for all price movements is the current spot price
-        S[0] = self.S_0
-        # cumulative function of standard normal distribution (risk-adjusted probability that the option will be exercised)     
-        for t in range(1, self.num_of_steps):
-            sn = npr.standard_normal((self.num_of_steps + 1,int(self.N/2)))
-            sn = np.concatenate((sn, -sn), axis=1)
+    def simulate_prices(self):
+        """
+        Simulating price movement of underlying prices using Brownian random process.
+        Normal draws are generated once for all time steps, with antithetic pairs and standardized to mean 0 and variance 1.
+        The same path set is used for both call and put price.
+        """
+        with stage('random numbers') as instrumented_stage:
+            rng = np.random.default_rng(self.seed)
+            half = (self.N + 1) // 2
+            sn = rng.standard_normal((self.num_of_steps - 1, half))
+            sn = np.concatenate((sn, -sn), axis=1)[:, :self.N]
             sn = (sn - sn.mean()) / sn.std()
-            # Updating prices for next point in time 
-            S[t] = S[t - 1] * np.exp((self.r - 0.5 * self.sigma ** 2) * self.dt + (self.sigma * np.sqrt(self.dt) * sn[t]))  
-        self.simulation_results_S = S
-        self.h = np.maximum(S - self.K, 0)
-        V = np.copy(self.h)    
-        for t in range(self.num_of_steps -2, 0, -1):
-            reg = np.polyfit(S[t], V[t+1] * self.df, 3)
-            C = np.polyval(reg, S[t])
-            V[t] = np.where(C > self.h[t], V[t+1] * self.df, self.h[t])
-        V[0] = V[1] * self.df
-        C0 = self.df * np.mean(V[0])
-        return C0
+            instrumented_stage.record(iterations=sn.size, nbytes=sn.nbytes)
+
+        with stage('price paths') as instrumented_stage:
+            # Log prices are cumulative sums of increments: rows as time index and columns as different random price movements.
+            log_S = np.empty((self.num_of_steps, self.N))
+            # Starting value for all price movements is the current spot price
+            log_S[0] = np.log(self.S_0)
+            log_S[1:] = (self.r - 0.5 * self.sigma ** 2) * self.dt + self.sigma * np.sqrt(self.dt) * sn
+            np.cumsum(log_S, axis=0, out=log_S)
+            self.simulation_results_S = np.exp(log_S)
+            instrumented_stage.record(iterations=self.num_of_steps, nbytes=2 * log_S.nbytes)
+
+    def _least_squares_monte_carlo(self, strikes, payoff_signs, maturities, progress=None, paired=False):
+        """
+        Longstaff-Schwartz backward induction over simulated paths for many options at once.
+        strikes: strike price of each column
+        payoff_signs: 1.0 for call columns (exercise value max(S_t - K, 0)), -1.0 for put columns (max(K - S_t, 0))
+        maturities: maturities in days, shorter maturities use prefixes of the same paths
+        progress: optional function progress(fraction) called on every day of the backward induction, the induction
+        can be aborted by raising an exception from it
+        paired: if True, maturities holds one maturity per column and each column is priced at its own maturity only,
+        otherwise every column is priced at every maturity
+        Continuation value is regressed only on in-the-money paths using Laguerre polynomials of the standardized price
+        (see _regression_variable).
+        The basis does not depend on the strike, so normal equations of all columns are built from one basis matrix
+        per day and solved together. In-the-money paths do not depend on maturity, so every maturity of a column
+        shares the same regression matrix. Underlying does not pay dividends, so with positive rate calls (and with
+        negative rate puts) are never exercised early and they are valued by their discounted payoff at maturity.
+        With Numba backend every day runs in compiled kernels (see kernels.py) without temporary arrays.
+        Instrumented stages: 'payoffs' at maturity, then on every day 'regression' (exercise values, normal equations and
+        their solution) and 'exercise' (continuation values and exercise decisions).
+        Returns discounted cash flows of every path, array of shape (number_of_simulations, maturities, columns),
+        or (number_of_simulations, columns) if paired.
+        """
+        if self.simulation_results_S is None:
+            self.simulate_prices()
+        S = self.simulation_results_S
+
+        with stage('payoffs') as instrumented_stage:
+            if paired:
+                cash_flows = np.maximum(payoff_signs * (S[maturities].T - strikes), 0) * self.df ** maturities
+            else:
+                cash_flows = np.empty((self.N, maturities.size, strikes.size))
+                for m, days in enumerate(maturities):
+                    cash_flows[:, m] = np.maximum(payoff_signs * (S[days][:, None] - strikes), 0) * self.df ** days
+            instrumented_stage.record(nbytes=cash_flows.nbytes)
+
+        early_exercise = np.flatnonzero(payoff_signs * self.r < 0)
+        if early_exercise.size == 0:
+            return cash_flows
+        strikes, payoff_signs = strikes[early_exercise], payoff_signs[early_exercise]
+
+        # Maturities (of columns, if paired) are processed in ascending order, so options alive after day t form a contiguous block
+        if paired:
+            maturities = maturities[early_exercise]
+            order = np.argsort(maturities, kind='stable')
+            strikes, payoff_signs, sorted_maturities = strikes[order], payoff_signs[order], maturities[order]
+        else:
+            order = np.argsort(maturities, kind='stable')
+            sorted_maturities = maturities[order]
+        shape = (self.N, 1 if paired else maturities.size, strikes.size)
+        # Compiled kernels loop over paths of values shaped (paths, maturities, columns), NumPy code keeps the paths of
+        # every option contiguous in (maturities, columns, paths); by_path is the (paths, maturities, columns) view of both
+        kernels = get_kernels()
+        values = np.zeros(shape) if kernels is not None else np.zeros(shape[1:] + shape[:1])
+        by_path = values if kernels is not None else values.transpose(2, 0, 1)
+        for t in range(sorted_maturities[-1], 0, -1):
+            if progress is not None:
+                progress((sorted_maturities[-1] - t) / sorted_maturities[-1])
+            expiring = np.searchsorted(sorted_maturities, t, side='left')
+            alive = np.searchsorted(sorted_maturities, t, side='right')
+            if not paired:
+                self._backward_step(t, S[t], strikes, payoff_signs, values, expiring, alive, kernels)
+                continue
+
+            # Columns expiring on day t receive their exercise value, columns alive after day t are stepped as options
+            # with a single maturity
+            by_path[:, 0, expiring:alive] = np.maximum(payoff_signs[expiring:alive] * (S[t][:, None] - strikes[expiring:alive]), 0)
+            if alive < strikes.size:
+                alive_values = values[:, :, alive:] if kernels is not None else values[:, alive:]
+                self._backward_step(t, S[t], strikes[alive:], payoff_signs[alive:], alive_values, 0, 0, kernels)
+
+        if paired:
+            cash_flows[:, early_exercise[order]] = by_path[:, 0] * self.df
+        else:
+            cash_flows[:, order[:, None], early_exercise] = by_path * self.df
+        return cash_flows
+
+    def _regression_variable(self, t):
+        """
+        Center and scale of the regression variable x = (S_t - center) / scale of day t. Prices of day t spread over about
+        S_0 * sigma * sqrt(t dt) around S_0, so x is of order one on every day. Polynomials of x span the same space as
+        polynomials of S_t / S_0, but unlike them they are far from collinear on early days, when prices cover a narrow
+        range, so rounding differences of the normal equations (summation order of a backend) stay rounding differences
+        of the prices.
+        """
+        spread = self.S_0 * self.sigma * math.sqrt(t * self.dt)
+        return float(self.S_0), float(spread if spread > 0 else self.S_0)
+
+    def _backward_step(self, t, S_t, strikes, payoff_signs, values, expiring, alive, kernels):
+        """
+        One day t of the backward induction, values are updated in place: options alive after day t (maturities from
+        alive on) are discounted by one day and exercised where exercise value is higher than the regressed continuation
+        value, options expiring on day t (maturities expiring to alive - 1) receive their exercise value.
+        values: array of shape (paths, maturities, columns) for compiled kernels, (maturities, columns, paths) for NumPy code
+        kernels: compiled Kernels, None runs NumPy array code
+        Regression of every column is summed over its own paths only, so prices of a column do not depend on the other
+        columns priced with it (pseudo-inverse cut-off would turn rounding differences into different exercise decisions).
+        """
+        degree = self.REGRESSION_DEGREE
+        maturities = values.shape[1] if kernels is not None else values.shape[0]
+        center, scale = self._regression_variable(t)
+
+        if kernels is not None:
+            # Compiled kernels fuse discounting, payoffs and normal equations into one pass over paths, and exercise into another
+            with stage('regression') as instrumented_stage:
+                exercise_values, itm_counts, gram, projection = kernels.lsm_normal_equations(
+                    S_t, center, scale, strikes, payoff_signs, values, expiring, alive, self.df, degree)
+                active = itm_counts > degree + 1
+                regressed = alive < maturities and active.any()
+                if regressed:
+                    coefficients = (np.linalg.pinv(gram, self.REGRESSION_RCOND)[None] @ projection[..., None])[..., 0]
+                instrumented_stage.record(iterations=1)
+            if regressed:
+                with stage('exercise'):
+                    kernels.lsm_exercise(S_t, center, scale, exercise_values, active, np.ascontiguousarray(coefficients), values, alive)
+            return
+
+        with stage('regression') as instrumented_stage:
+            exercise_values = np.maximum(payoff_signs[:, None] * (S_t - strikes[:, None]), 0)
+
+            # Options expiring later are discounted back to day t, options expiring on day t receive their payoff
+            values[alive:] *= self.df
+            values[expiring:alive] = exercise_values
+            if alive == maturities:
+                return
+
+            # Regression only for columns with enough in-the-money paths
+            itm = exercise_values > 0
+            itm &= itm.sum(axis=1, keepdims=True) > degree + 1
+            if not itm.any():
+                return
+
+            # Normal equations of in-the-money paths: X'X is (columns, basis, basis), X'y is (maturities, columns, basis),
+            # X'y is a stack of one vector-matrix product per option
+            basis = lagvander((S_t - center) / scale, degree)
+            gram = self._in_the_money_gram(S_t, basis, strikes, payoff_signs)
+            future = values[alive:] * itm
+            projection = (future[..., None, :] @ basis)[..., 0, :]
+            # Pseudo-inverse keeps nearly collinear bases (narrow range of in-the-money prices on early days) stable
+            coefficients = (np.linalg.pinv(gram, self.REGRESSION_RCOND)[None] @ projection[..., None])[..., 0]
+            instrumented_stage.record(iterations=1, nbytes=future.nbytes)
+
+        with stage('exercise'):
+            continuation = (basis @ coefficients[..., None])[..., 0]
+            exercise = itm & (exercise_values > continuation)
+            np.copyto(values[alive:], exercise_values, where=exercise)
+
+    def _in_the_money_gram(self, S_t, basis, strikes, payoff_signs):
+        """
+        X'X of regressions on in-the-money paths of every column, array of shape (columns, basis, basis).
+        In-the-money paths of a put (call) are the paths with the lowest (highest) prices, so X'X is a prefix (suffix)
+        sum of basis outer products over paths sorted by price, one cumulative sum per day for all strikes.
+        """
+        by_price = np.argsort(S_t)
+        sorted_S = S_t[by_price]
+        sorted_basis = basis[by_price].T
+        # X'X is symmetric, only products of its upper triangle are summed
+        rows, columns = np.triu_indices(basis.shape[1])
+        products = sorted_basis[rows] * sorted_basis[columns]
+
+        sums = np.empty((rows.size, strikes.size))
+        puts = payoff_signs < 0
+        for itm_columns, reverse, ranks in ((puts, False, np.searchsorted(sorted_S, strikes[puts], side='left')),
+                                            (~puts, True, self.N - np.searchsorted(sorted_S, strikes[~puts], side='right'))):
+            if not itm_columns.any():
+                continue
+            cumulative = np.zeros((rows.size, self.N + 1))
+            np.cumsum(products[:, ::-1] if reverse else products, axis=1, out=cumulative[:, 1:])
+            sums[:, itm_columns] = cumulative[:, ranks]
+
+        gram = np.empty((strikes.size, basis.shape[1], basis.shape[1]))
+        gram[:, rows, columns] = sums.T
+        gram[:, columns, rows] = sums.T
+        return gram
+
+    @instrumented
+    def calculate_option_price_ladder(self, strike_prices=None, days_to_maturity=None, progress=None):
+        """
+        Calculates European and American call and put prices for a vector of strikes and maturities from one simulated path set.
+        strike_prices: scalar or array of strikes, defaults to strike price given in constructor
+        days_to_maturity: scalar or array of maturities in whole days, not longer than maturity given in constructor (default)
+        progress: optional function progress(fraction) called on every day of the backward induction (see _least_squares_monte_carlo)
+        Shorter maturities are evaluated on prefixes of the simulated paths, European prices are discounted
+        terminal payoffs of the same paths, so the early exercise premium is free of simulation noise between the two.
+
+        Returns dictionary of arrays shaped (maturities, strikes) with keys:
+        european_call, american_call, call_premium, european_put, american_put, put_premium
+        Served from pricing_cache when set and seed is an integer.
+        """
+        if strike_prices is None:
+            strike_prices = self.K
+        if days_to_maturity is None:
+            days_to_maturity = self.days_to_maturity
+        strikes = np.asarray(strike_prices, dtype=float)
+        maturities = np.asarray(days_to_maturity)
+        days = np.ravel(maturities).astype(int)
+        if np.any(days < 1) or np.any(days > self.days_to_maturity):
+            raise ValueError(f'Maturities have to be between 1 and {self.days_to_maturity} days')
+        return self._cached_result('calculate_option_price_ladder', (strikes, maturities),
+                                   lambda: self._evaluate_option_price_ladder(strikes, maturities, progress),
+                                   lambda prices: {name: np.asarray(values) for name, values in prices.items()})
+
+    def _evaluate_option_price_ladder(self, strikes, maturities, progress=None):
+        """European and American prices of strikes and maturities (validated arrays), without cache."""
+        K = np.ravel(strikes)
+        days = np.ravel(maturities).astype(int)
+        if self.simulation_results_S is None:
+            self.simulate_prices()
+
+        # Columns: calls for every strike followed by puts for every strike
+        column_strikes = np.concatenate((K, K))
+        payoff_signs = np.repeat([1.0, -1.0], K.size)
+        american = self._least_squares_monte_carlo(column_strikes, payoff_signs, days, progress).mean(axis=0)
+        terminal_values = np.maximum(payoff_signs * (self.simulation_results_S[days][:, :, None] - column_strikes), 0)
+        european = terminal_values.mean(axis=1) * (self.df ** days)[:, None]
+
+        shape = maturities.shape + strikes.shape
+        prices = {}
+        for option, columns in (('call', slice(0, K.size)), ('put', slice(K.size, None))):
+            prices[f'european_{option}'] = european[:, columns].reshape(shape)
+            prices[f'american_{option}'] = american[:, columns].reshape(shape)
+            prices[f'{option}_premium'] = prices[f'american_{option}'] - prices[f'european_{option}']
+        return prices
+
+    @instrumented
+    def calculate_option_price_pairs(self, strike_prices, days_to_maturity, progress=None):
+        """
+        Calculates European and American call and put prices for (strike, maturity) pairs from one simulated path set.
+        Unlike calculate_option_price_ladder, which prices every strike at every maturity, each strike is priced only at
+        its own maturity, so the work grows with the number of pairs instead of strikes x maturities.
+        strike_prices: scalar or array of strikes
+        days_to_maturity: scalar or array of maturities in whole days, broadcast against strike_prices and not longer
+        than maturity given in constructor
+        progress: optional function progress(fraction) called on every day of the backward induction (see _least_squares_monte_carlo)
+
+        Returns dictionary of arrays with the broadcast shape of strike_prices and days_to_maturity, keys as of
+        calculate_option_price_ladder. Served from pricing_cache when set and seed is an integer.
+        """
+        strikes, maturities = np.broadcast_arrays(np.asarray(strike_prices, dtype=float), np.asarray(days_to_maturity))
+        days = np.ravel(maturities).astype(int)
+        if np.any(days < 1) or np.any(days > self.days_to_maturity):
+            raise ValueError(f'Maturities have to be between 1 and {self.days_to_maturity} days')
+        return self._cached_result('calculate_option_price_pairs', (strikes, maturities),
+                                   lambda: self._evaluate_option_price_pairs(strikes, maturities, progress),
+                                   lambda prices: {name: np.asarray(values) for name, values in prices.items()})
+
+    def _evaluate_option_price_pairs(self, strikes, maturities, progress=None):
+        """European and American prices of (strike, maturity) pairs (validated arrays of one shape), without cache."""
+        K = np.ravel(strikes)
+        days = np.ravel(maturities).astype(int)
+        if self.simulation_results_S is None:
+            self.simulate_prices()
+
+        # Columns: calls for every pair followed by puts for every pair
+        column_strikes = np.concatenate((K, K))
+        column_days = np.concatenate((days, days))
+        payoff_signs = np.repeat([1.0, -1.0], K.size)
+        american = self._least_squares_monte_carlo(column_strikes, payoff_signs, column_days, progress, paired=True).mean(axis=0)
+        terminal_values = np.maximum(payoff_signs[:, None] * (self.simulation_results_S[column_days] - column_strikes[:, None]), 0)
+        european = terminal_values.mean(axis=1) * self.df ** column_days
+
+        prices = {}
+        for option, columns in (('call', slice(0, K.size)), ('put', slice(K.size, None))):
+            prices[f'european_{option}'] = european[columns].reshape(strikes.shape)
+            prices[f'american_{option}'] = american[columns].reshape(strikes.shape)
+            prices[f'{option}_premium'] = prices[f'american_{option}'] - prices[f'european_{option}']
+        return prices
+
+    @instrumented
+    def calculate_option_prices(self):
+        """Calculates call and put price from one simulated path set. Returns tuple (call_price, put_price)."""
+        cash_flows = self._least_squares_monte_carlo(np.array([self.K, self.K], dtype=float), np.array([1.0, -1.0]),
+                                                     np.array([self.days_to_maturity]))
+        return tuple(np.mean(cash_flows[:, 0], axis=0))
+
+    def _calculate_call_option_price(self): 
+        """Call option price: exercise values max(S_t - K, 0), continuation values from regression."""
+        return np.mean(self._single_option_cash_flows(1.0))
     
     def _calculate_put_option_price(self): 
-        # Initializing price movements for simulation: rows as time index and columns as different random price movements.
-        S = np.zeros((self.num_of_steps, self.N))        
-       # Starting value for all price movements is the current spot price
-        S[0] = self.S_0
-        # cumulative function of standard normal distribution (risk-adjusted probability that the option will be exercised)     
-        for t in range(1, self.num_of_steps):
-            sn = npr.standard_normal((self.num_of_steps + 1,int(self.N/2)))
-            sn = np.concatenate((sn, -sn), axis=1)
-            sn = (sn - sn.mean()) / sn.std()
-            # Updating prices for next point in time 
-            S[t] = S[t - 1] * np.exp((self.r - 0.5 * self.sigma ** 2) * self.dt + (self.sigma * np.sqrt(self.dt) * sn[t]))  
-        self.simulation_results_S = S
-        self.h = np.maximum(self.K - S, 0)
-        V = np.copy(self.h)    
-        for t in range(self.num_of_steps -2, 0, -1):
-            reg = np.polyfit(S[t], V[t+1] * self.df, 3)
-            C = np.polyval(reg, S[t])
-            V[t] = np.where(C > self.h[t], V[t+1] * self.df, self.h[t])
-        V[0] = V[1] * self.df
-        C0 = self.df * np.mean(V[0])
-        return C0
+        """Put option price: exercise values max(K - S_t, 0), continuation values from regression."""
+        return np.mean(self._single_option_cash_flows(-1.0))
+
+    @staticmethod
+    def _payoff_sign(option_type):
+        """Payoff sign of option type (1.0 for call, -1.0 for put), raises ValueError for unknown option type."""
+        if option_type == OPTION_TYPE.CALL_OPTION.value:
+            return 1.0
+        if option_type == OPTION_TYPE.PUT_OPTION.value:
+            return -1.0
+        raise ValueError('Option type has to be Call Option or Put Option')
+
+    def _single_option_cash_flows(self, payoff_sign, progress=None):
+        """Discounted cash flows of every path for the option given in constructor."""
+        cash_flows = self._least_squares_monte_carlo(np.array([self.K], dtype=float), np.array([payoff_sign]),
+                                                     np.array([self.days_to_maturity]), progress)
+        return cash_flows[:, 0, 0]
+    
+    def calculate_option_price_estimate(self, option_type, confidence_level=0.95, progress=None):
+        """
+        Calculates option price together with standard error and confidence interval of the simulated discounted payoffs.
+        option_type: 'Call Option' or 'Put Option'
+        confidence_level: level of the two-sided confidence interval
+        progress: optional function progress(fraction) called on every day of the backward induction (see _least_squares_monte_carlo)
+
+        Returns MonteCarloEstimate (price, standard_error, confidence_interval, number_of_simulations).
+        Served from pricing_cache when set and seed is an integer.
+        """
+        self._payoff_sign(option_type)
+        return self._cached_result('calculate_option_price_estimate', (option_type, confidence_level),
+                                   lambda: self._evaluate_option_price_estimate(option_type, confidence_level, progress), _estimate_from_plain)
+
+    def _evaluate_option_price_estimate(self, option_type, confidence_level, progress=None):
+        """Option price estimate from discounted payoffs of the simulated paths, without cache."""
+        # Payoffs stay local instead of model state, so threads pricing with one model do not mix them up
+        discounted_payoffs = self._single_option_cash_flows(self._payoff_sign(option_type), progress)
+        return RunningStatistics().update(discounted_payoffs).estimate(confidence_level)
+
+    def calculate_option_price_to_tolerance(self, option_type, absolute_tolerance=None, relative_tolerance=None, time_budget=None,
+                                            batch_size=10000, max_simulations=1000000, confidence_level=0.95):
+        """
+        Prices independent batches of batch_size paths (each with its own exercise policy regression) until the confidence
+        interval of the price is narrow enough. Stops when half width of the interval drops below absolute_tolerance or
+        relative_tolerance * price, when time_budget (seconds) is spent or when max_simulations is reached.
+
+        Returns MonteCarloEstimate of the option price.
+        """
+        payoff_sign = self._payoff_sign(option_type)
+        rng = np.random.default_rng(self.seed)
+
+        def sample_batch(number_of_simulations):
+            batch = AmericanPricing(self.S_0, self.K, self.days_to_maturity, self.r, self.sigma, number_of_simulations, rng)
+            return batch._single_option_cash_flows(payoff_sign)
+
+        return simulate_to_tolerance(sample_batch, absolute_tolerance, relative_tolerance, time_budget,
+                                     batch_size, max_simulations, confidence_level)
+
+    def calculate_option_price_estimates_in_parallel(self, block_size=10000, number_of_workers=None, executor=EXECUTOR.THREAD_POOL.value,
+                                                     confidence_level=0.95):
+        """
+        Prices call and put from number_of_simulations paths split into independent blocks of block_size paths
+        (each with its own exercise policy regression), simulated by a pool of workers.
+        Every block has its own generator spawned from the seed and block statistics are merged in block order,
+        so for an integer seed the prices are bit-identical for any number_of_workers.
+        block_size: number of paths in one block, large enough for a stable regression
+        number_of_workers: number of pool workers, defaults to number of processors
+        executor: 'Thread pool' or 'Process pool'
+
+        Returns tuple (call_estimate, put_estimate) of MonteCarloEstimate.
+        """
+        statistics = simulate_in_parallel(self._sample_block_cash_flows, self.N, block_size, self.seed, number_of_workers, executor)
+        return (statistics[OPTION_TYPE.CALL_OPTION.value].estimate(confidence_level),
+                statistics[OPTION_TYPE.PUT_OPTION.value].estimate(confidence_level))
+
+    def _sample_block_cash_flows(self, rng, number_of_simulations):
+        """Discounted call/put cash flows of an independently simulated and regressed block of paths, keyed by option type."""
+        block = AmericanPricing(self.S_0, self.K, self.days_to_maturity, self.r, self.sigma, number_of_simulations, rng)
+        cash_flows = block._least_squares_monte_carlo(np.array([self.K, self.K], dtype=float), np.array([1.0, -1.0]),
+                                                      np.array([self.days_to_maturity]))
+        return {OPTION_TYPE.CALL_OPTION.value: cash_flows[:, 0, 0], OPTION_TYPE.PUT_OPTION.value: cash_flows[:, 0, 1]}
     
     def plot_simulation_results(self, num_of_movements):
         """Plots specified number of simulated price movements."""
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(12,8))
         plt.plot(self.simulation_results_S[:,0:num_of_movements])
         plt.axhline(self.K, c='k', xmin=0, xmax=self.num_of_steps, label='Strike Price')
@@ -110,6 +461,4 @@ class AmericanPricing(OptionPricingModel):
         plt.title(f'First {num_of_movements}/{self.N} Random Price Movements')
         plt.legend(loc='best')
         plt.show()
-    
-AP = AmericanPricing(146.71, 10, 365, 0.1, 0.2, 10000)
-print(AP._calculate_call_option_price())
\ No newline at end of file
+    
\ No newline at end of file
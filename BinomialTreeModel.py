@@ -5,25 +5,52 @@ Created on Fri Feb 24 14:34:58 2023
 @author: Gilberto
 """
 
+# Standard library imports
+from enum import Enum
+
 # Third party imports
 import numpy as np
-from scipy.stats import norm 
+from scipy.special import gammaln
 
 # Local package imports
 from base import OptionPricingModel
+from base import EXERCISE_STYLE
+from BlackScholesModel import BlackScholesModel
+from kernels import get_kernels
+from instrumentation import stage, instrumented
+
+
+class LATTICE_TYPE(Enum):
+    COX_ROSS_RUBINSTEIN = 'Cox-Ross-Rubinstein'
+    LEISEN_REIMER = 'Leisen-Reimer'
+    BLACK_SCHOLES_SMOOTHED = 'Black-Scholes smoothed'
 
 
 class BinomialTreeModel(OptionPricingModel):
-    """ 
-    Class implementing calculation for European option price using BOPM (Binomial Option Pricing Model).
+    """
+    Class implementing calculation for European and American option price using BOPM (Binomial Option Pricing Model).
     It caclulates option prices in discrete time (lattice based), in specified number of time points between date of valuation and exercise date.
     This pricing model has three steps:
     - Price tree generation
-    - Calculation of option value at each final node 
+    - Calculation of option value at each final node
     - Sequential calculation of the option value at each preceding node
+    Only one layer of the tree is kept in memory. Lattice columns hold different strikes and option types,
+    so single backward sweep prices calls and puts for a whole strike vector.
+    Besides plain Cox-Ross-Rubinstein lattice, faster converging lattices are available:
+    - Leisen-Reimer: up probabilities from Peizer-Pratt inversion of d1/d2, smooth second order convergence (odd steps only)
+    - Black-Scholes smoothed: option values one step before maturity are given by Black-Scholes formula
+    Each of them can be combined with two step-count Richardson extrapolation. CRR error oscillates with the position of
+    the strike between nodes instead of decreasing smoothly with the number of steps, so CRR is not extrapolated.
     """
 
-    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_time_steps):
+    # Lattices whose error is smooth enough in number of steps for Richardson extrapolation
+    EXTRAPOLATED_LATTICES = (LATTICE_TYPE.LEISEN_REIMER.value, LATTICE_TYPE.BLACK_SCHOLES_SMOOTHED.value)
+
+    # Half width of the evaluated band of the American lattice, in standard deviations of the terminal log price
+    TRUNCATION_WIDTH = 10
+
+    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_time_steps, exercise_style=EXERCISE_STYLE.EUROPEAN.value,
+                 lattice_type=LATTICE_TYPE.COX_ROSS_RUBINSTEIN.value, richardson_extrapolation=False):
         """
         Initializes variables used in Black-Scholes formula .
         underlying_spot_price: current stock or other underlying spot price
@@ -32,60 +59,199 @@ class BinomialTreeModel(OptionPricingModel):
         risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
         sigma: volatility of the underlying asset (standard deviation of asset's log returns)
         number_of_time_steps: number of time periods between the valuation date and exercise date
+        exercise_style: 'European' or 'American' (early exercise is checked at every node)
+        lattice_type: 'Cox-Ross-Rubinstein', 'Leisen-Reimer' or 'Black-Scholes smoothed'
+        richardson_extrapolation: combines prices from number_of_time_steps and number_of_time_steps/2 lattices,
+        Leisen-Reimer and Black-Scholes smoothed lattices only
         """
+        if richardson_extrapolation and lattice_type not in self.EXTRAPOLATED_LATTICES:
+            raise ValueError('Richardson extrapolation is available for Leisen-Reimer and Black-Scholes smoothed lattices only')
         self.S = underlying_spot_price
         self.K = strike_price
         self.T = days_to_maturity / 365
         self.r = risk_free_rate
         self.sigma = sigma
         self.number_of_time_steps = number_of_time_steps
+        self.exercise_style = exercise_style
+        self.lattice_type = lattice_type
+        self.richardson_extrapolation = richardson_extrapolation
 
-    def _calculate_call_option_price(self): 
-        """Calculates price for call option according to the Binomial formula."""
-        # Delta t, up and down factors
-        dT = self.T / self.number_of_time_steps                             
-        u = np.exp(self.sigma * np.sqrt(dT))                 
-        d = 1.0 / u                                    
+    @instrumented
+    def calculate_option_prices(self, strike_prices=None):
+        """
+        Calculates call and put prices for a vector of strikes in one backward sweep.
+        strike_prices: scalar or array of strikes, defaults to strike price given in constructor
+
+        Returns tuple (call_prices, put_prices) of arrays with the shape of strike_prices. Served from pricing_cache when set.
+        """
+        if strike_prices is None:
+            strike_prices = self.K
+        strikes = np.asarray(strike_prices, dtype=float)
+        return self._cached_result('calculate_option_prices', (strikes,), lambda: self._evaluate_option_prices(strikes),
+                                   lambda prices: tuple(np.asarray(values) for values in prices))
 
-        # Price vector initialization
-        V = np.zeros(self.number_of_time_steps + 1)                       
+    def _evaluate_option_prices(self, strikes):
+        """Call and put prices for array of strikes, without cache."""
+        K = np.ravel(strikes)
 
-        # Underlying asset prices at different time points
-        S_T = np.array( [(self.S * u**j * d**(self.number_of_time_steps - j)) for j in range(self.number_of_time_steps + 1)])
+        # Columns of the lattice: calls for every strike followed by puts for every strike
+        values = self._backward_induction(np.concatenate((K, K)), np.repeat([1.0, -1.0], K.size))
+        return values[:K.size].reshape(strikes.shape), values[K.size:].reshape(strikes.shape)
 
+    def _backward_induction(self, strikes, payoff_signs):
+        """
+        Calculates option value for all lattice columns at once.
+        strikes: strike price of each column
+        payoff_signs: 1.0 for call columns, -1.0 for put columns (payoff is max(sign * (S - K), 0))
+        With Richardson extrapolation the lattice is evaluated with n and n/2 steps and the leading error term
+        (1/n for Black-Scholes smoothed lattice, 1/n^2 for Leisen-Reimer) is eliminated. Lattices too small to have a coarser lattice
+        of the same parity (n <= 2, Leisen-Reimer n = 1) are not extrapolated, their fine lattice value is returned.
+        """
+        if not self.richardson_extrapolation:
+            return self._lattice_value(self.number_of_time_steps, strikes, payoff_signs)
+
+        # Coarse lattice keeps parity of the fine one, so odd-even oscillation of the underlying CRR nodes does not leak into extrapolation
+        n_fine = self._effective_number_of_steps(self.number_of_time_steps)
+        n_coarse = n_fine // 2 + (n_fine // 2 + n_fine) % 2
+        order = 2 if self.lattice_type == LATTICE_TYPE.LEISEN_REIMER.value else 1
+
+        fine = self._lattice_value(n_fine, strikes, payoff_signs)
+        if n_coarse >= n_fine:
+            return fine
+        coarse = self._lattice_value(n_coarse, strikes, payoff_signs)
+        return (n_fine ** order * fine - n_coarse ** order * coarse) / (n_fine ** order - n_coarse ** order)
+
+    def _effective_number_of_steps(self, n):
+        """Leisen-Reimer lattice is defined for odd number of steps only, even numbers are rounded up."""
+        if self.lattice_type == LATTICE_TYPE.LEISEN_REIMER.value:
+            return n + 1 - n % 2
+        return n
+
+    def _lattice_parameters(self, n, strikes):
+        """
+        Calculates time step, logarithms of up/down factors and risk neutral up probability of the lattice.
+        CRR lattice is shared by all columns, Leisen-Reimer lattice is centered on strike of each column.
+        """
+        dT = self.T / n
         a = np.exp(self.r * dT)      # risk free compounded return
-        p = (a - d) / (u - d)        # risk neutral up probability
-        q = 1.0 - p                  # risk neutral down probability   
 
-        V[:] = np.maximum(S_T - self.K, 0.0)
-    
-        # Overriding option price 
-        for i in range(self.number_of_time_steps - 1, -1, -1):
-            V[:-1] = np.exp(-self.r * dT) * (p * V[1:] + q * V[:-1]) 
+        if self.lattice_type == LATTICE_TYPE.LEISEN_REIMER.value:
+            d1, d2 = BlackScholesModel._calculate_d1_d2(self.S, strikes, self.T, self.r, self.sigma)
+            p = self._peizer_pratt_inversion(d2, n)              # risk neutral up probability
+            u = a * self._peizer_pratt_inversion(d1, n) / p
+            d = (a - p * u) / (1.0 - p)
+        else:
+            u = np.exp(self.sigma * np.sqrt(dT))
+            d = 1.0 / u
+            p = (a - d) / (u - d)        # risk neutral up probability
 
-        return V[0]
+        return dT, np.log(u), np.log(d), p
 
-    def _calculate_put_option_price(self): 
-        """Calculates price for put option according to the Binomial formula."""  
-        # Delta t, up and down factors
-        dT = self.T / self.number_of_time_steps                             
-        u = np.exp(self.sigma * np.sqrt(dT))                 
-        d = 1.0 / u                                    
+    @staticmethod
+    def _peizer_pratt_inversion(z, n):
+        """Peizer-Pratt method 2 approximation of the binomial probability matching N(z) for n steps."""
+        return 0.5 + np.sign(z) * 0.5 * np.sqrt(1.0 - np.exp(-(z / (n + 1 / 3 + 0.1 / (n + 1))) ** 2 * (n + 1 / 6)))
 
-        # Price vector initialization
-        V = np.zeros(self.number_of_time_steps + 1)                       
+    def _lattice_value(self, n, strikes, payoff_signs):
+        """Prices all lattice columns on a tree with n time steps, in instrumented stages 'terminal layer' and 'backward induction'."""
+        n = self._effective_number_of_steps(n)
+        dT, log_u, log_d, p = self._lattice_parameters(n, strikes)
+        discount = np.exp(-self.r * dT)
+        american = self.exercise_style == EXERCISE_STYLE.AMERICAN.value
 
-        # Underlying asset prices at different time points
-        S_T = np.array( [(self.S * u**j * d**(self.number_of_time_steps - j)) for j in range(self.number_of_time_steps + 1)])
+        # Option values are known at maturity, or one step earlier when the last step is smoothed with Black-Scholes formula
+        smoothed = self.lattice_type == LATTICE_TYPE.BLACK_SCHOLES_SMOOTHED.value
+        last_layer = n - 1 if smoothed else n
 
-        a = np.exp(self.r * dT)      # risk free compounded return
-        p = (a - d) / (u - d)        # risk neutral up probability
-        q = 1.0 - p                  # risk neutral down probability   
+        with stage('terminal layer') as instrumented_stage:
+            # Underlying asset prices in closed form: S * u^j * d^(i - j)
+            j = np.arange(last_layer + 1)[:, None]
+            S_last = self.S * np.exp(j * log_u + (last_layer - j) * log_d)
 
-        V[:] = np.maximum(self.K - S_T, 0.0)
-    
-        # Overriding option price 
-        for i in range(self.number_of_time_steps - 1, -1, -1):
-            V[:-1] = np.exp(-self.r * dT) * (p * V[1:] + q * V[:-1]) 
+            if smoothed:
+                call_prices, put_prices = BlackScholesModel.calculate_option_prices(S_last, strikes, dT * 365, self.r, self.sigma)
+                V = np.where(payoff_signs > 0, call_prices, put_prices)
+                if american:
+                    V = np.maximum(V, payoff_signs * (S_last - strikes))
+            else:
+                V = np.maximum(payoff_signs * (S_last - strikes), 0.0)
+
+            # Without early exercise the induction collapses to binomial expectation of known values: O(n) per column.
+            # Weights C(i, j) * p^j * q^(i - j) * discount^i are evaluated in logarithms to avoid overflow.
+            log_weights = (gammaln(last_layer + 1) - gammaln(j + 1) - gammaln(last_layer - j + 1)
+                           + j * np.log(p) + (last_layer - j) * np.log(1.0 - p) + last_layer * np.log(discount))
+            values = np.sum(np.exp(log_weights) * V, axis=0)
+            instrumented_stage.record(nbytes=S_last.nbytes + V.nbytes + log_weights.nbytes)
+
+        if not american:
+            return values
+
+        # Underlying does not pay dividends, so with non-negative rate early exercise of a call is never optimal
+        early_exercise = payoff_signs < 0 if self.r >= 0 else np.ones(payoff_signs.shape, dtype=bool)
+        if early_exercise.any():
+            def columns(x):
+                return x if np.ndim(x) == 0 else x[early_exercise]
+
+            with stage('backward induction') as instrumented_stage:
+                values[early_exercise] = self._american_sweep(V[:, early_exercise], strikes[early_exercise], payoff_signs[early_exercise],
+                                                              columns(log_u), columns(log_d), columns(p), discount)
+                instrumented_stage.record(iterations=last_layer, nbytes=3 * V.itemsize * V.shape[0] * np.count_nonzero(early_exercise))
+        return values
+
+    def _american_sweep(self, V, strikes, payoff_signs, log_u, log_d, p, discount):
+        """
+        Backward induction with early exercise check at every node.
+        V: option values at the last lattice layer, one column per option
+        log_u, log_d, p: lattice parameters, scalars or one value per column
+        discount: one step discount factor
+        Nodes further than TRUNCATION_WIDTH standard deviations from the expected node are reached with
+        negligible probability, so each layer is evaluated only inside that band.
+        Runs in compiled kernel when Numba backend is available (see kernels.py).
+        """
+        last_layer = V.shape[0] - 1
+        half_band = 0.5 * self.TRUNCATION_WIDTH * np.sqrt(last_layer)
+
+        # Compiled kernel fuses the whole layer update into one loop over nodes
+        kernels = get_kernels()
+        if kernels is not None:
+            def columns(x):
+                return np.ascontiguousarray(np.broadcast_to(np.asarray(x, dtype=float), V.shape[1:]))
+
+            return kernels.american_sweep(np.ascontiguousarray(V, dtype=float), float(self.S), columns(strikes), columns(payoff_signs),
+                                          columns(log_u), columns(log_d), columns(p), float(discount), float(half_band))
+
+        p_min, p_max = np.min(p), np.max(p)
+
+        # Discounted probabilities are reused in every step
+        p_discounted = discount * p
+        q_discounted = discount * (1.0 - p)
+
+        # Buffers reused in every step to avoid temporary arrays
+        continuation = np.empty_like(V)
+        exercise = np.empty_like(V)
+
+        # Overriding option price, layer i has i + 1 nodes
+        for i in range(last_layer - 1, -1, -1):
+            lo = max(0, int(np.ceil(i * p_min - half_band)))
+            hi = min(i, int(i * p_max + half_band))
+            nodes = slice(lo, hi + 1)
+
+            np.multiply(V[lo + 1:hi + 2], p_discounted, out=continuation[nodes])
+            V[nodes] *= q_discounted
+            V[nodes] += continuation[nodes]
+
+            # Early exercise check against node prices of the layer
+            j = np.arange(lo, hi + 1)[:, None]
+            np.subtract(self.S * np.exp(j * log_u + (i - j) * log_d), strikes, out=exercise[nodes])
+            exercise[nodes] *= payoff_signs
+            np.maximum(V[nodes], exercise[nodes], out=V[nodes])
+
+        return V[0]
+
+    def _calculate_call_option_price(self):
+        """Calculates price for call option according to the Binomial formula."""
+        return self._backward_induction(np.array([self.K], dtype=float), np.array([1.0]))[0]
 
-        return V[0]
\ No newline at end of file
+    def _calculate_put_option_price(self):
+        """Calculates price for put option according to the Binomial formula."""
+        return self._backward_induction(np.array([self.K], dtype=float), np.array([-1.0]))[0]
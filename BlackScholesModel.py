@@ -7,11 +7,12 @@ Created on Fri Feb 24 14:35:41 2023
 
 # Third party imports
 import numpy as np
-from scipy.stats import norm 
+from scipy.special import ndtr
 
 # Local package imports
 from base import OptionPricingModel
 from base import OPTION_TYPE
+from instrumentation import instrumented
 
 class BlackScholesModel(OptionPricingModel):
     """ 
@@ -39,31 +40,108 @@ class BlackScholesModel(OptionPricingModel):
         self.r = risk_free_rate
         self.sigma = sigma
 
-    def _calculate_call_option_price(self): 
+    @staticmethod
+    def _calculate_d1_d2(S, K, T, r, sigma):
         """
-        Calculates price for call option according to the formula.        
-        Formula: S*N(d1) - PresentValue(K)*N(d2)
+        Calculates d1 and d2 terms of the formula, sharing log-moneyness and sigma*sqrt(T) between them.
+        All parameters can be scalars or numpy arrays broadcastable against each other.
         """
-        # cumulative function of standard normal distribution (risk-adjusted probability that the option will be exercised)     
-        d1 = (np.log(self.S / self.K) + (self.r + 0.5 * self.sigma ** 2) * self.T) / (self.sigma * np.sqrt(self.T))
-        
+        log_moneyness = np.log(S / K)
+        sigma_sqrt_T = sigma * np.sqrt(T)
+
+        # cumulative function of standard normal distribution (risk-adjusted probability that the option will be exercised)
+        d1 = (log_moneyness + (r + 0.5 * sigma ** 2) * T) / sigma_sqrt_T
+
         # cumulative function of standard normal distribution (probability of receiving the stock at expiration of the option)
-        d2 = (np.log(self.S / self.K) + (self.r - 0.5 * self.sigma ** 2) * self.T) / (self.sigma * np.sqrt(self.T))
-        
-        return (self.S * norm.cdf(d1, 0.0, 1.0) - self.K * np.exp(-self.r * self.T) * norm.cdf(d2, 0.0, 1.0))
-    
+        d2 = (log_moneyness + (r - 0.5 * sigma ** 2) * T) / sigma_sqrt_T
+
+        return d1, d2
+
+    @staticmethod
+    def _as_batch_arrays(underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma):
+        """Converts batch parameters to float arrays, with maturity expressed in years."""
+        S = np.asarray(underlying_spot_price, dtype=float)
+        K = np.asarray(strike_price, dtype=float)
+        T = np.asarray(days_to_maturity, dtype=float) / 365
+        r = np.asarray(risk_free_rate, dtype=float)
+        sigma = np.asarray(sigma, dtype=float)
+        return S, K, T, r, sigma
+
+    @staticmethod
+    @instrumented
+    def calculate_option_prices(underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma):
+        """
+        Calculates call and put prices for a whole batch of contracts in one pass.
+        Parameters have the same meaning as in the constructor, but can be numpy arrays broadcastable
+        against each other (e.g. a strike vector against a column of maturities).
+        d1/d2 and the discounted strike are calculated once and shared between call and put.
 
-    def _calculate_put_option_price(self): 
+        Returns tuple (call_prices, put_prices) of arrays with the broadcast shape of the inputs.
         """
-        Calculates price for put option according to the formula.        
+        S, K, T, r, sigma = BlackScholesModel._as_batch_arrays(underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma)
+
+        d1, d2 = BlackScholesModel._calculate_d1_d2(S, K, T, r, sigma)
+        discounted_strike = K * np.exp(-r * T)
+
+        call_prices = S * ndtr(d1) - discounted_strike * ndtr(d2)
+        put_prices = discounted_strike * ndtr(-d2) - S * ndtr(-d1)
+        return call_prices, put_prices
+
+    @staticmethod
+    def calculate_greeks(underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma):
+        """
+        Calculates call/put prices together with analytic Greeks for a whole batch of contracts.
+        Parameters are broadcast exactly as in calculate_option_prices. d1/d2, normal pdf/cdf values
+        and the discounted strike are evaluated once and shared by the prices and every Greek.
+
+        Returns dictionary of arrays with keys:
+        call_price, put_price, call_delta, put_delta, gamma, vega, call_theta, put_theta, call_rho, put_rho
+        Vega and rho are per unit change of sigma/rate (1.0 = 100%), theta is per year (divide by 365 for daily theta).
+        """
+        S, K, T, r, sigma = BlackScholesModel._as_batch_arrays(underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma)
+
+        d1, d2 = BlackScholesModel._calculate_d1_d2(S, K, T, r, sigma)
+        sqrt_T = np.sqrt(T)
+        discounted_strike = K * np.exp(-r * T)
+
+        # Shared normal distribution terms
+        N_d1, N_minus_d1 = ndtr(d1), ndtr(-d1)
+        N_d2, N_minus_d2 = ndtr(d2), ndtr(-d2)
+        pdf_d1 = np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi)
+
+        # Theta term caused by passage of time, common for call and put
+        time_decay = -S * pdf_d1 * sigma / (2 * sqrt_T)
+
+        return {
+            'call_price': S * N_d1 - discounted_strike * N_d2,
+            'put_price': discounted_strike * N_minus_d2 - S * N_minus_d1,
+            'call_delta': N_d1,
+            'put_delta': -N_minus_d1,
+            'gamma': pdf_d1 / (S * sigma * sqrt_T),
+            'vega': S * pdf_d1 * sqrt_T,
+            'call_theta': time_decay - r * discounted_strike * N_d2,
+            'put_theta': time_decay + r * discounted_strike * N_minus_d2,
+            'call_rho': T * discounted_strike * N_d2,
+            'put_rho': -T * discounted_strike * N_minus_d2,
+        }
+
+    def _calculate_call_option_price(self):
+        """
+        Calculates price for call option according to the formula.
+        Formula: S*N(d1) - PresentValue(K)*N(d2)
+        """
+        d1, d2 = self._calculate_d1_d2(self.S, self.K, self.T, self.r, self.sigma)
+
+        return (self.S * ndtr(d1) - self.K * np.exp(-self.r * self.T) * ndtr(d2))
+
+
+    def _calculate_put_option_price(self):
+        """
+        Calculates price for put option according to the formula.
         Formula: PresentValue(K)*N(-d2) - S*N(-d1)
-        """  
-        # cumulative function of standard normal distribution (risk-adjusted probability that the option will be exercised)    
-        d1 = (np.log(self.S / self.K) + (self.r + 0.5 * self.sigma ** 2) * self.T) / (self.sigma * np.sqrt(self.T))
+        """
+        d1, d2 = self._calculate_d1_d2(self.S, self.K, self.T, self.r, self.sigma)
 
-        # cumulative function of standard normal distribution (probability of receiving the stock at expiration of the option)
-        d2 = (np.log(self.S / self.K) + (self.r - 0.5 * self.sigma ** 2) * self.T) / (self.sigma * np.sqrt(self.T))
-        
-        return (self.K * np.exp(-self.r * self.T) * norm.cdf(-d2, 0.0, 1.0) - self.S * norm.cdf(-d1, 0.0, 1.0))
+        return (self.K * np.exp(-self.r * self.T) * ndtr(-d2) - self.S * ndtr(-d1))
 
 
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo pricing of path-dependent (barrier, Asian and lookback) options on a coarse time grid.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+from enum import Enum
+
+# Third party imports
+import numpy as np
+from scipy.special import ndtr
+
+# Local package imports
+from base import OptionPricingModel
+from base import OPTION_TYPE
+from base import EXECUTOR
+from base import simulate_in_parallel
+from instrumentation import stage, instrumented
+
+
+class EXOTIC_PAYOFF(Enum):
+    DOWN_AND_OUT = 'Down-and-out barrier'
+    DOWN_AND_IN = 'Down-and-in barrier'
+    UP_AND_OUT = 'Up-and-out barrier'
+    UP_AND_IN = 'Up-and-in barrier'
+    ARITHMETIC_ASIAN = 'Arithmetic Asian'
+    GEOMETRIC_ASIAN = 'Geometric Asian'
+    FLOATING_LOOKBACK = 'Floating strike lookback'
+    FIXED_LOOKBACK = 'Fixed strike lookback'
+
+
+class ExoticPricing(OptionPricingModel):
+    """
+    Class implementing calculation for path-dependent European option prices using Monte Carlo Simulation.
+    Log prices are sampled exactly on number_of_time_steps equally spaced dates, so a handful of steps is enough
+    instead of one step per day:
+    - Barrier options are monitored continuously. Between two simulated dates the path is a Brownian bridge, which
+      crosses the barrier with probability exp(-2 ln(S_i/B) ln(S_i+1/B) / (sigma^2 dt)); the knock-out payoff is
+      weighted by the probability of surviving every interval (knock-in by its complement, in-out parity).
+      With monitoring_interval_days the barrier is shifted by exp(0.5826 sigma sqrt(interval)) away from spot
+      (Broadie-Glasserman-Kou), which prices discretely monitored barriers.
+    - Asian options average prices on the simulated dates (excluding the valuation date), which are the fixing dates.
+      Arithmetic Asian uses the geometric Asian payoff, whose price is known in closed form, as control variate.
+    - Lookback options are monitored continuously: minimum and maximum of the bridge in every interval are sampled
+      exactly, x0 + x1 -/+ sqrt((x1 - x0)^2 + 2 sigma^2 dt E) over 2 with standard exponential E. Minimum and maximum
+      are sampled independently, every payoff uses only one of them.
+    Blocks of simulations run in a pool of workers (see simulate_in_parallel), prices do not depend on the number of workers.
+    """
+
+    # Continuity correction of discretely monitored barriers, -zeta(1/2)/sqrt(2*pi)
+    DISCRETE_MONITORING_SHIFT = 0.5826
+
+    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations,
+                 exotic_payoff=EXOTIC_PAYOFF.ARITHMETIC_ASIAN.value, barrier=None, number_of_time_steps=12, monitoring_interval_days=None,
+                 brownian_bridge=True, chunk_size=100000, seed=20, number_of_workers=None, executor=EXECUTOR.THREAD_POOL.value):
+        """
+        Initializes variables used in simulation.
+        underlying_spot_price: current stock or other underlying spot price
+        strike_price: strike price for option cotract (not used by floating strike lookback)
+        days_to_maturity: option contract maturity/exercise date
+        risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
+        sigma: volatility of the underlying asset (standard deviation of asset's log returns)
+        number_of_simulations: number of potential random underlying price movements
+        exotic_payoff: EXOTIC_PAYOFF value
+        barrier: barrier level of barrier options
+        number_of_time_steps: number of equally spaced simulated dates, fixing dates of Asian options
+        monitoring_interval_days: days between barrier observations, None monitors barrier continuously
+        brownian_bridge: False monitors barrier and lookback only on simulated dates (for comparison with daily stepping)
+        chunk_size: number of simulations in one block
+        seed: seed of random number generator
+        number_of_workers: number of pool workers, defaults to number of processors
+        executor: 'Thread pool' or 'Process pool'
+        """
+        self.S_0 = underlying_spot_price
+        self.K = strike_price
+        self.T = days_to_maturity / 365
+        self.r = risk_free_rate
+        self.sigma = sigma
+
+        self.exotic_payoff = exotic_payoff
+        self.barrier = barrier
+        if exotic_payoff in self._barrier_payoffs() and barrier is None:
+            raise ValueError(f'{exotic_payoff} option requires barrier')
+        self.monitoring_interval_days = monitoring_interval_days
+        self.brownian_bridge = brownian_bridge
+
+        # Parameters for simulation
+        self.N = number_of_simulations
+        self.num_of_steps = number_of_time_steps
+        self.dt = self.T / self.num_of_steps
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.number_of_workers = number_of_workers
+        self.executor = executor
+
+        # Simulation results
+        self.payoff_statistics = None
+
+    @staticmethod
+    def _barrier_payoffs():
+        return [EXOTIC_PAYOFF.DOWN_AND_OUT.value, EXOTIC_PAYOFF.DOWN_AND_IN.value, EXOTIC_PAYOFF.UP_AND_OUT.value, EXOTIC_PAYOFF.UP_AND_IN.value]
+
+    @instrumented
+    def simulate_prices(self, progress=None):
+        """
+        Simulates paths block by block and keeps running statistics of discounted call/put payoffs.
+        progress: optional function progress(fraction, payoff_statistics) called after every block; simulation can be aborted
+        by raising an exception from it
+        """
+        self.payoff_statistics = simulate_in_parallel(self._sample_discounted_payoffs, self.N, self.chunk_size, self.seed,
+                                                      self.number_of_workers, self.executor, progress)
+
+    def calculate_option_price_estimate(self, option_type, confidence_level=0.95):
+        """
+        Calculates option price together with its standard error and confidence interval, simulating prices if needed.
+        option_type: 'Call Option' or 'Put Option'
+        confidence_level: level of the two-sided confidence interval
+
+        Returns MonteCarloEstimate, variance_reduction_factor is the gain of the control variate of arithmetic Asian options.
+        """
+        if self.payoff_statistics is None:
+            self.simulate_prices()
+        estimate = self.payoff_statistics[option_type].estimate(confidence_level)
+        plain = self.payoff_statistics.get(self._plain_key(option_type))
+        if plain is None:
+            return estimate
+        factor = plain.variance / self.payoff_statistics[option_type].variance if self.payoff_statistics[option_type].variance > 0 else np.inf
+        return estimate._replace(variance_reduction_factor=factor)
+
+    def geometric_asian_price(self, option_type):
+        """
+        Closed form price of geometric Asian option with fixings on the simulated dates t_i = i T/n, i = 1..n:
+        ln G is normal with mean ln S_0 + (r - sigma^2/2) dt (n + 1)/2 and variance sigma^2 dt (n + 1)(2n + 1)/(6n).
+        """
+        n = self.num_of_steps
+        mean = np.log(self.S_0) + (self.r - 0.5 * self.sigma ** 2) * self.dt * (n + 1) / 2
+        deviation = self.sigma * np.sqrt(self.dt * (n + 1) * (2 * n + 1) / (6 * n))
+        forward = np.exp(mean + 0.5 * deviation ** 2)
+        d1 = (mean - np.log(self.K) + deviation ** 2) / deviation
+        d2 = d1 - deviation
+        if option_type == OPTION_TYPE.CALL_OPTION.value:
+            return np.exp(-self.r * self.T) * (forward * ndtr(d1) - self.K * ndtr(d2))
+        return np.exp(-self.r * self.T) * (self.K * ndtr(-d2) - forward * ndtr(-d1))
+
+    def _plain_key(self, option_type):
+        """Statistics key of payoffs without control variate."""
+        return f'{option_type} without control variate'
+
+    def _sample_log_paths(self, rng, number_of_simulations):
+        """Samples log prices on the simulated dates: rows as time index (starting with ln S_0) and columns as simulations."""
+        X = np.empty((self.num_of_steps + 1, number_of_simulations))
+        X[0] = np.log(self.S_0)
+        with stage('random numbers') as instrumented_stage:
+            rng.standard_normal(out=X[1:])
+            instrumented_stage.record(iterations=X[1:].size, nbytes=X.nbytes)
+        X[1:] *= self.sigma * np.sqrt(self.dt)
+        X[1:] += (self.r - 0.5 * self.sigma ** 2) * self.dt
+        np.cumsum(X, axis=0, out=X)
+        return X
+
+    def _sample_discounted_payoffs(self, rng, number_of_simulations):
+        """Discounted call/put payoffs of a block of simulated paths, keyed by option type."""
+        X = self._sample_log_paths(rng, number_of_simulations)
+        discount = np.exp(-self.r * self.T)
+        S_T = np.exp(X[-1])
+
+        if self.exotic_payoff in self._barrier_payoffs():
+            weights = self._survival_probabilities(X)
+            if self.exotic_payoff in [EXOTIC_PAYOFF.DOWN_AND_IN.value, EXOTIC_PAYOFF.UP_AND_IN.value]:
+                weights = 1.0 - weights
+            return {OPTION_TYPE.CALL_OPTION.value: discount * np.maximum(S_T - self.K, 0) * weights,
+                    OPTION_TYPE.PUT_OPTION.value: discount * np.maximum(self.K - S_T, 0) * weights}
+
+        if self.exotic_payoff in [EXOTIC_PAYOFF.ARITHMETIC_ASIAN.value, EXOTIC_PAYOFF.GEOMETRIC_ASIAN.value]:
+            geometric_average = np.exp(X[1:].mean(axis=0))
+            geometric = {OPTION_TYPE.CALL_OPTION.value: discount * np.maximum(geometric_average - self.K, 0),
+                         OPTION_TYPE.PUT_OPTION.value: discount * np.maximum(self.K - geometric_average, 0)}
+            if self.exotic_payoff == EXOTIC_PAYOFF.GEOMETRIC_ASIAN.value:
+                return geometric
+
+            arithmetic_average = np.exp(X[1:]).mean(axis=0)
+            payoffs = {}
+            for option_type, sign in [(OPTION_TYPE.CALL_OPTION.value, 1.0), (OPTION_TYPE.PUT_OPTION.value, -1.0)]:
+                arithmetic = discount * np.maximum(sign * (arithmetic_average - self.K), 0)
+                # Control coefficient 1: arithmetic and geometric payoffs move almost one to one, and a fixed coefficient
+                # keeps the adjusted samples independent, so their statistics can be merged block by block
+                payoffs[option_type] = arithmetic - (geometric[option_type] - self.geometric_asian_price(option_type))
+                payoffs[self._plain_key(option_type)] = arithmetic
+            return payoffs
+
+        minimum, maximum = self._path_extremes(rng, X)
+        if self.exotic_payoff == EXOTIC_PAYOFF.FLOATING_LOOKBACK.value:
+            return {OPTION_TYPE.CALL_OPTION.value: discount * (S_T - minimum),
+                    OPTION_TYPE.PUT_OPTION.value: discount * (maximum - S_T)}
+        return {OPTION_TYPE.CALL_OPTION.value: discount * np.maximum(maximum - self.K, 0),
+                OPTION_TYPE.PUT_OPTION.value: discount * np.maximum(self.K - minimum, 0)}
+
+    def _survival_probabilities(self, X):
+        """Probability of every path not touching the barrier, given its log prices on the simulated dates."""
+        shift = 0.0
+        if self.monitoring_interval_days is not None:
+            shift = self.DISCRETE_MONITORING_SHIFT * self.sigma * np.sqrt(self.monitoring_interval_days / 365)
+
+        # Distance from the barrier in log price, positive on the surviving side; touched barrier is distance 0
+        if self.exotic_payoff in [EXOTIC_PAYOFF.DOWN_AND_OUT.value, EXOTIC_PAYOFF.DOWN_AND_IN.value]:
+            distance = np.maximum(X - (np.log(self.barrier) - shift), 0)
+        else:
+            distance = np.maximum((np.log(self.barrier) + shift) - X, 0)
+
+        if not self.brownian_bridge:
+            return np.all(distance > 0, axis=0).astype(float)
+        crossing = np.exp(-2 * distance[:-1] * distance[1:] / (self.sigma ** 2 * self.dt))
+        return np.prod(1.0 - crossing, axis=0)
+
+    def _path_extremes(self, rng, X):
+        """Returns minimum and maximum prices of every path, of the bridges between simulated dates or of the dates only."""
+        if not self.brownian_bridge:
+            return np.exp(X.min(axis=0)), np.exp(X.max(axis=0))
+        increments = np.diff(X, axis=0)
+        midpoints = X[:-1] + 0.5 * increments
+        spread_min = np.sqrt(increments ** 2 + 2 * self.sigma ** 2 * self.dt * rng.standard_exponential(increments.shape))
+        spread_max = np.sqrt(increments ** 2 + 2 * self.sigma ** 2 * self.dt * rng.standard_exponential(increments.shape))
+        return np.exp((midpoints - 0.5 * spread_min).min(axis=0)), np.exp((midpoints + 0.5 * spread_max).max(axis=0))
+
+    def _calculate_call_option_price(self):
+        """Calculates price for call option, simulating prices if needed."""
+        return self.calculate_option_price_estimate(OPTION_TYPE.CALL_OPTION.value).price
+
+    def _calculate_put_option_price(self):
+        """Calculates price for put option, simulating prices if needed."""
+        return self.calculate_option_price_estimate(OPTION_TYPE.PUT_OPTION.value).price
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Finite-difference (Crank-Nicolson) pricing of European and American options over a whole grid of spot prices.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+from collections import namedtuple
+from enum import Enum
+
+# Third party imports
+import numpy as np
+# scipy.linalg and scipy.interpolate are imported on first solve/interpolation to keep module import cheap
+
+# Local package imports
+from base import OptionPricingModel
+from base import EXERCISE_STYLE
+from instrumentation import stage, instrumented
+
+
+class EARLY_EXERCISE_METHOD(Enum):
+    PENALTY = 'Penalty'
+    PSOR = 'Projected SOR'
+
+
+FiniteDifferenceGrid = namedtuple('FiniteDifferenceGrid', ['spot_prices', 'call_prices', 'put_prices', 'call_delta', 'put_delta',
+                                                           'call_gamma', 'put_gamma'])
+
+
+class FiniteDifferenceModel(OptionPricingModel):
+    """
+    Class implementing option pricing by solving Black-Scholes PDE in log spot price x = ln(S), backward from maturity:
+    V_tau = sigma^2/2 V_xx + (r - sigma^2/2) V_x - r V
+    - Crank-Nicolson time stepping, every step is one tridiagonal (banded) solve for calls and puts together.
+      The first RANNACHER_STEPS steps are replaced by two implicit Euler half steps each, which damps oscillations
+      caused by the payoff kink at the strike (the implicit half step uses the same matrix as Crank-Nicolson step).
+    - American exercise constraint V >= payoff is enforced by penalty iteration or projected SOR in every step.
+    - One solve gives prices, delta and gamma for every spot price on the grid, so after a spot move the option is
+      repriced by interpolation on the grid instead of a new solve.
+    Grid is uniform in log price, spans GRID_WIDTH standard deviations of log price at maturity (at least MIN_GRID_WIDTH)
+    around spot and strike, and has the current spot price on a node.
+    """
+
+    # Half width of the log price grid in standard deviations of log price at maturity
+    GRID_WIDTH = 5.0
+    # Smallest half width of the log price grid, so short maturities can still be repriced after large spot moves
+    MIN_GRID_WIDTH = 0.5
+    # Number of first time steps replaced by two implicit Euler half steps
+    RANNACHER_STEPS = 2
+    # Convergence tolerance of penalty iteration and projected SOR (penalty factor is its inverse)
+    EARLY_EXERCISE_TOLERANCE = 1e-8
+    # Iteration limit of penalty iteration and projected SOR in one time step
+    MAX_ITERATIONS = 500
+    # Over-relaxation factor of projected SOR
+    RELAXATION = 1.2
+
+    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_space_steps=400,
+                 number_of_time_steps=200, exercise_style=EXERCISE_STYLE.EUROPEAN.value, early_exercise_method=EARLY_EXERCISE_METHOD.PENALTY.value):
+        """
+        Initializes variables used in Black-Scholes PDE.
+        underlying_spot_price: current stock or other underlying spot price
+        strike_price: strike price for option cotract
+        days_to_maturity: option contract maturity/exercise date
+        risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
+        sigma: volatility of the underlying asset (standard deviation of asset's log returns)
+        number_of_space_steps: number of log price intervals of the grid
+        number_of_time_steps: number of time steps to maturity
+        exercise_style: 'European' or 'American'
+        early_exercise_method: 'Penalty' or 'Projected SOR', used for American options
+        """
+        self.S = underlying_spot_price
+        self.K = strike_price
+        self.T = days_to_maturity / 365
+        self.r = risk_free_rate
+        self.sigma = sigma
+        self.number_of_space_steps = number_of_space_steps
+        self.number_of_time_steps = number_of_time_steps
+        self.exercise_style = exercise_style
+        self.early_exercise_method = early_exercise_method
+
+        # Solution on the whole grid
+        self.grid_results = None
+
+    @instrumented
+    def solve(self):
+        """
+        Solves the PDE for call and put (columns of every step) on the whole grid, result is kept for repricing.
+        Returns FiniteDifferenceGrid with grid spot prices, option values, deltas and gammas at every grid node.
+        """
+        if self.grid_results is not None:
+            return self.grid_results
+        from scipy.linalg import solve_banded
+
+        x, h = self._log_price_grid()
+        S = np.exp(x)
+        k = self.T / self.number_of_time_steps
+        american = self.exercise_style == EXERCISE_STYLE.AMERICAN.value
+
+        # Discretized operator on node i: a*V[i-1] + b*V[i] + c*V[i+1]
+        alpha = 0.5 * self.sigma ** 2 / h ** 2
+        beta = (self.r - 0.5 * self.sigma ** 2) / (2 * h)
+        a, b, c = alpha - beta, -2 * alpha - self.r, alpha + beta
+
+        # Matrix I - k/2 * L on interior nodes in banded form (upper, main, lower diagonal)
+        size = self.number_of_space_steps - 1
+        banded = np.empty((3, size))
+        banded[0] = -0.5 * k * c
+        banded[1] = 1 - 0.5 * k * b
+        banded[2] = -0.5 * k * a
+
+        # Columns: call, put
+        payoff = np.maximum(np.array([1.0, -1.0]) * (S[:, None] - self.K), 0.0)
+        V = payoff.copy()
+        with stage('time stepping') as instrumented_stage:
+            for n in range(self.number_of_time_steps):
+                if n < self.RANNACHER_STEPS:
+                    # Two implicit Euler half steps: (I - k/2 L) V_new = V_old
+                    for half_step in (1, 2):
+                        V = self._advance(V, V[1:-1].copy(), (n + 0.5 * half_step) * k, banded, 0.5 * k * a, 0.5 * k * c, S, payoff, american, solve_banded)
+                else:
+                    # Crank-Nicolson step: (I - k/2 L) V_new = (I + k/2 L) V_old
+                    rhs = V[1:-1] + 0.5 * k * (a * V[:-2] + b * V[1:-1] + c * V[2:])
+                    V = self._advance(V, rhs, (n + 1) * k, banded, 0.5 * k * a, 0.5 * k * c, S, payoff, american, solve_banded)
+            instrumented_stage.record(iterations=self.number_of_time_steps, nbytes=payoff.nbytes + V.nbytes + banded.nbytes)
+
+        # Greeks from derivatives in log price: delta = V_x / S, gamma = (V_xx - V_x) / S^2
+        V_x = np.gradient(V, h, axis=0, edge_order=2)
+        V_xx = np.empty_like(V)
+        V_xx[1:-1] = (V[2:] - 2 * V[1:-1] + V[:-2]) / h ** 2
+        V_xx[0], V_xx[-1] = V_xx[1], V_xx[-2]
+        delta = V_x / S[:, None]
+        gamma = (V_xx - V_x) / S[:, None] ** 2
+
+        self.grid_results = FiniteDifferenceGrid(S, V[:, 0], V[:, 1], delta[:, 0], delta[:, 1], gamma[:, 0], gamma[:, 1])
+        return self.grid_results
+
+    def calculate_option_prices(self, spot_prices=None):
+        """
+        Calculates call and put prices for spot prices by interpolating the grid solution (solved once).
+        spot_prices: scalar or array of spot prices inside the grid, defaults to spot price given in constructor
+
+        Returns tuple (call_prices, put_prices) of arrays with the shape of spot_prices.
+        """
+        greeks = self.calculate_greeks(spot_prices)
+        return greeks['call_price'], greeks['put_price']
+
+    def calculate_greeks(self, spot_prices=None):
+        """
+        Calculates call/put prices, deltas and gammas for spot prices by cubic interpolation of the grid solution in log price.
+        spot_prices: scalar or array of spot prices inside the grid, defaults to spot price given in constructor
+
+        Returns dictionary of arrays with the shape of spot_prices and keys:
+        call_price, put_price, call_delta, put_delta, call_gamma, put_gamma
+        """
+        from scipy.interpolate import CubicSpline
+
+        grid = self.solve()
+        spots = np.asarray(self.S if spot_prices is None else spot_prices, dtype=float)
+        if np.any(spots < grid.spot_prices[0]) or np.any(spots > grid.spot_prices[-1]):
+            raise ValueError(f'Spot prices have to be between {grid.spot_prices[0]:.4f} and {grid.spot_prices[-1]:.4f}')
+
+        keys = ['call_price', 'put_price', 'call_delta', 'put_delta', 'call_gamma', 'put_gamma']
+        values = np.column_stack([grid.call_prices, grid.put_prices, grid.call_delta, grid.put_delta, grid.call_gamma, grid.put_gamma])
+        interpolated = CubicSpline(np.log(grid.spot_prices), values, axis=0)(np.log(spots))
+        return {key: interpolated[..., column] for column, key in enumerate(keys)}
+
+    def _log_price_grid(self):
+        """Returns nodes of the uniform log price grid, with ln(S) on a node, and the grid step."""
+        width = max(self.GRID_WIDTH * self.sigma * np.sqrt(self.T), self.MIN_GRID_WIDTH)
+        x_spot, x_strike = np.log(self.S), np.log(self.K)
+        x_min, x_max = min(x_spot, x_strike) - width, max(x_spot, x_strike) + width
+        h = (x_max - x_min) / self.number_of_space_steps
+        spot_node = int(round((x_spot - x_min) / h))
+        return x_spot + h * (np.arange(self.number_of_space_steps + 1) - spot_node), h
+
+    def _boundary_values(self, S, tau, american):
+        """Call/put values at the grid edges S (far from the strike) with time tau to maturity, shape (edges, columns)."""
+        discounted_strike = self.K * np.exp(-self.r * tau)
+        call = np.maximum(S - discounted_strike, 0.0)
+        put = np.maximum(discounted_strike - S, 0.0)
+        if american:
+            call, put = np.maximum(call, S - self.K), np.maximum(put, self.K - S)
+        return np.column_stack([call, put])
+
+    def _advance(self, V, rhs, tau, banded, lower_boundary_weight, upper_boundary_weight, S, payoff, american, solve_banded):
+        """
+        Solves one time step for interior nodes and sets boundary values.
+        rhs: right hand side on interior nodes without boundary terms
+        lower_boundary_weight, upper_boundary_weight: coefficients of boundary values in the first and last interior equation
+        """
+        boundary = self._boundary_values(S[[0, -1]], tau, american)
+        rhs[0] += lower_boundary_weight * boundary[0]
+        rhs[-1] += upper_boundary_weight * boundary[1]
+
+        if not american:
+            interior = solve_banded((1, 1), banded, rhs)
+        elif self.early_exercise_method == EARLY_EXERCISE_METHOD.PSOR.value:
+            interior = self._projected_sor(banded, rhs, payoff[1:-1], V[1:-1])
+        else:
+            interior = np.column_stack([self._penalty_iteration(banded, rhs[:, column], payoff[1:-1, column], V[1:-1, column], solve_banded)
+                                        for column in range(V.shape[1])])
+        return np.vstack([boundary[:1], interior, boundary[1:]])
+
+    def _penalty_iteration(self, banded, rhs, payoff, V, solve_banded):
+        """
+        Solves linear complementarity problem of one column: A V >= rhs, V >= payoff, one of them with equality.
+        Nodes below payoff get penalty term 1/tolerance * (payoff - V), iteration stops when the set of penalized nodes repeats.
+        """
+        penalty = 1.0 / self.EARLY_EXERCISE_TOLERANCE
+        penalized = V < payoff
+        with stage('early exercise') as instrumented_stage:
+            for iteration in range(1, self.MAX_ITERATIONS + 1):
+                penalized_banded = banded.copy()
+                penalized_banded[1] += penalty * penalized
+                V = solve_banded((1, 1), penalized_banded, rhs + penalty * penalized * payoff)
+                next_penalized = V < payoff
+                if np.array_equal(next_penalized, penalized):
+                    break
+                penalized = next_penalized
+            instrumented_stage.record(iterations=iteration)
+        return V
+
+    def _projected_sor(self, banded, rhs, payoff, V):
+        """
+        Solves linear complementarity problem of all columns by projected successive over-relaxation.
+        Nodes are updated in red-black order (even nodes, then odd nodes), so every half sweep is one array operation.
+        """
+        upper, diagonal, lower = banded[0, 1:, None], banded[1][:, None], banded[2, :-1, None]
+        V = np.maximum(V, payoff)
+        with stage('early exercise') as instrumented_stage:
+            for iteration in range(1, self.MAX_ITERATIONS + 1):
+                change = 0.0
+                for first in (0, 1):
+                    neighbours = np.zeros_like(V)
+                    neighbours[1:] += lower * V[:-1]
+                    neighbours[:-1] += upper * V[1:]
+                    nodes = slice(first, None, 2)
+                    updated = np.maximum(payoff[nodes], V[nodes] + self.RELAXATION * (rhs[nodes] - neighbours[nodes]
+                                                                                       - diagonal[nodes] * V[nodes]) / diagonal[nodes])
+                    change = max(change, np.max(np.abs(updated - V[nodes])))
+                    V[nodes] = updated
+                if change < self.EARLY_EXERCISE_TOLERANCE:
+                    break
+            instrumented_stage.record(iterations=iteration)
+        return V
+
+    def _calculate_call_option_price(self):
+        """Calculates price for call option at spot price from the grid solution."""
+        return float(self.calculate_option_prices()[0])
+
+    def _calculate_put_option_price(self):
+        """Calculates price for put option at spot price from the grid solution."""
+        return float(self.calculate_option_prices()[1])
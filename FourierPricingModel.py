@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Fourier transform (Carr-Madan FFT) pricing of European options over a whole chain of strikes.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Third party imports
+import numpy as np
+# scipy.interpolate is imported on first transform to keep module import cheap
+
+# Local package imports
+from base import OptionPricingModel
+from instrumentation import stage, instrumented
+
+
+class CharacteristicFunction(ABC):
+    """
+    Interface of models of the underlying priced by FourierPricingModel: characteristic function of log return
+    phi(u) = E[exp(i u ln(S_T / S_0))] under the risk-neutral measure. Stochastic volatility models are added
+    by subclassing and implementing __call__ and parameters.
+    """
+
+    @abstractmethod
+    def __call__(self, u, T, r):
+        """
+        Evaluates characteristic function.
+        u: complex array of arguments
+        T: time to maturity in years
+        r: risk free rate
+        """
+
+    @abstractmethod
+    def parameters(self):
+        """Returns tuple of model parameters, part of the cache key of transforms."""
+
+
+class GeometricBrownianMotion(CharacteristicFunction):
+    """Lognormal underlying of Black-Scholes model."""
+
+    def __init__(self, sigma):
+        """sigma: volatility of the underlying asset (standard deviation of asset's log returns)"""
+        self.sigma = sigma
+
+    def __call__(self, u, T, r):
+        return np.exp(1j * u * (r - 0.5 * self.sigma ** 2) * T - 0.5 * self.sigma ** 2 * u ** 2 * T)
+
+    def parameters(self):
+        return (self.sigma,)
+
+
+class HestonModel(CharacteristicFunction):
+    """
+    Heston stochastic volatility model: dv = kappa (theta - v) dt + xi sqrt(v) dW, correlation rho with the underlying.
+    Characteristic function is evaluated in the form of Albrecher et al. (little Heston trap), which stays on
+    the principal branch of the complex logarithm for long maturities.
+    """
+
+    def __init__(self, initial_variance, mean_reversion, long_run_variance, volatility_of_variance, correlation):
+        """
+        initial_variance: variance of the underlying at valuation date (v0)
+        mean_reversion: speed of mean reversion of the variance (kappa)
+        long_run_variance: level the variance reverts to (theta)
+        volatility_of_variance: volatility of the variance process (xi)
+        correlation: correlation of variance and underlying shocks (rho)
+        """
+        self.initial_variance = initial_variance
+        self.mean_reversion = mean_reversion
+        self.long_run_variance = long_run_variance
+        self.volatility_of_variance = volatility_of_variance
+        self.correlation = correlation
+
+    def __call__(self, u, T, r):
+        kappa, theta, xi, rho = self.mean_reversion, self.long_run_variance, self.volatility_of_variance, self.correlation
+        beta = kappa - 1j * rho * xi * u
+        d = np.sqrt(beta ** 2 + xi ** 2 * (1j * u + u ** 2))
+        g = (beta - d) / (beta + d)
+        decay = np.exp(-d * T)
+        C = 1j * u * r * T + kappa * theta / xi ** 2 * ((beta - d) * T - 2 * np.log((1 - g * decay) / (1 - g)))
+        D = (beta - d) / xi ** 2 * (1 - decay) / (1 - g * decay)
+        return np.exp(C + D * self.initial_variance)
+
+    def parameters(self):
+        return (self.initial_variance, self.mean_reversion, self.long_run_variance, self.volatility_of_variance, self.correlation)
+
+
+class FourierPricingModel(OptionPricingModel):
+    """
+    Class implementing European option pricing by Carr-Madan FFT of the damped call price in log strike:
+    c(k) = exp(-alpha k) / pi * Re integral_0^inf exp(-i v k) psi(v) dv
+    psi(v) = exp(-r T) phi(v - (alpha + 1) i) / (alpha^2 + alpha - v^2 + i (2 alpha + 1) v)
+    - One FFT of FFT_POINTS (or more) Simpson weighted samples of psi gives call prices on the whole log strike grid
+      in O(N log N), requested strikes are priced by cubic interpolation and puts by put-call parity.
+    - Prices are calculated for unit spot price, so one transform serves every spot price. Transforms are cached per
+      characteristic function, its parameters, maturity and rate.
+    - Grid adapts to standard deviation of log return (from the second cumulant of the characteristic function):
+      integration step is at most 1/INTEGRATION_STEPS_PER_STANDARD_DEVIATION of its inverse, so psi is resolved for
+      long maturities and high volatilities, and log strike spacing is at most 1/POINTS_PER_STANDARD_DEVIATION of it,
+      so short maturities get more points.
+    Any model with known characteristic function (CharacteristicFunction) can be priced, GBM is used by default.
+    """
+
+    # Damping exponent alpha of the call price, E[S_T^(alpha + 1)] has to be finite
+    DAMPING = 1.5
+    # Largest integration step in the Fourier variable, log strike grid spans 2 pi / integration step
+    INTEGRATION_STEP = 0.25
+    # Smallest number of integration steps per inverse standard deviation of log return
+    INTEGRATION_STEPS_PER_STANDARD_DEVIATION = 5
+    # Smallest and largest number of FFT points (powers of two)
+    FFT_POINTS = 4096
+    MAX_FFT_POINTS = 2 ** 18
+    # Smallest number of log strike nodes per standard deviation of log return
+    POINTS_PER_STANDARD_DEVIATION = 8
+    # Number of cached transforms, least recently used are evicted first
+    TRANSFORM_CACHE_SIZE = 128
+
+    _transforms = OrderedDict()
+    _transforms_lock = threading.Lock()
+
+    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma=None, characteristic_function=None):
+        """
+        Initializes variables used in Carr-Madan formula.
+        underlying_spot_price: current stock or other underlying spot price
+        strike_price: strike price for option cotract
+        days_to_maturity: option contract maturity/exercise date
+        risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
+        sigma: volatility of the underlying asset (standard deviation of asset's log returns), used by default GBM model
+        characteristic_function: CharacteristicFunction of the model of the underlying, e.g. HestonModel, defaults to
+        GeometricBrownianMotion(sigma)
+        """
+        self.S = underlying_spot_price
+        self.K = strike_price
+        self.T = days_to_maturity / 365
+        self.r = risk_free_rate
+        self.sigma = sigma
+        if characteristic_function is None:
+            if sigma is None:
+                raise ValueError('Either sigma or characteristic function has to be given')
+            characteristic_function = GeometricBrownianMotion(sigma)
+        self.characteristic_function = characteristic_function
+
+    @instrumented
+    def calculate_option_prices(self, strike_prices=None):
+        """
+        Calculates call and put prices for a vector of strikes from one transform.
+        strike_prices: scalar or array of strikes, defaults to strike price given in constructor
+
+        Returns tuple (call_prices, put_prices) of arrays with the shape of strike_prices.
+        """
+        strikes = np.asarray(self.K if strike_prices is None else strike_prices, dtype=float)
+        spline, k_min, k_max = self._transform()
+
+        log_moneyness = np.log(strikes / self.S)
+        if np.any(log_moneyness < k_min) or np.any(log_moneyness > k_max):
+            raise ValueError(f'Strikes have to be between {self.S * np.exp(k_min):.4f} and {self.S * np.exp(k_max):.4f}')
+
+        # Floor at intrinsic value of the forward removes interpolation noise of deep out-of-the-money prices
+        discounted_strikes = strikes * np.exp(-self.r * self.T)
+        call_prices = np.maximum(self.S * spline(log_moneyness), np.maximum(self.S - discounted_strikes, 0.0))
+        put_prices = np.maximum(call_prices - self.S + discounted_strikes, 0.0)
+        return call_prices, put_prices
+
+    @classmethod
+    def clear_transform_cache(cls):
+        """Removes all cached transforms."""
+        with cls._transforms_lock:
+            cls._transforms.clear()
+
+    def _transform(self):
+        """
+        Returns cached (spline, k_min, k_max): cubic spline of call prices for unit spot price in log strike k = ln(K/S)
+        and the range of log strikes where it is used.
+        """
+        N, eta = self._grid_parameters()
+        key = (type(self.characteristic_function).__name__, self.characteristic_function.parameters(), self.T, self.r,
+               N, eta, self.DAMPING)
+        with self._transforms_lock:
+            if key in self._transforms:
+                self._transforms.move_to_end(key)
+                return self._transforms[key]
+
+        from scipy.interpolate import CubicSpline
+
+        with stage('transform') as instrumented_stage:
+            alpha = self.DAMPING
+            v = eta * np.arange(N)
+            log_strike_step = 2 * np.pi / (N * eta)
+            b = 0.5 * N * log_strike_step
+            k = -b + log_strike_step * np.arange(N)
+
+            psi = (np.exp(-self.r * self.T) * self.characteristic_function(v - (alpha + 1) * 1j, self.T, self.r)
+                   / (alpha ** 2 + alpha - v ** 2 + 1j * (2 * alpha + 1) * v))
+            simpson_weights = (3 + (-1) ** (np.arange(N) + 1)) / 3
+            simpson_weights[0] = 1 / 3
+            calls = np.exp(-alpha * k) / np.pi * np.fft.fft(np.exp(1j * b * v) * psi * eta * simpson_weights).real
+            instrumented_stage.record(iterations=N, nbytes=psi.nbytes + calls.nbytes)
+
+        with stage('spline'):
+            # Edges of the grid are affected by aliasing and by the exp(-alpha k) amplification, only the middle half is used
+            middle = slice(N // 4, 3 * N // 4 + 1)
+            transform = (CubicSpline(k[middle], calls[middle]), k[middle][0], k[middle][-1])
+        with self._transforms_lock:
+            self._transforms[key] = transform
+            while len(self._transforms) > self.TRANSFORM_CACHE_SIZE:
+                self._transforms.popitem(last=False)
+        return transform
+
+    def _grid_parameters(self):
+        """Returns number of FFT points (power of two) and integration step adapted to standard deviation of log return."""
+        # Variance of log return is the second cumulant: -d^2/du^2 ln phi(u) at u = 0
+        h = 1e-2
+        log_phi = np.log(self.characteristic_function(np.array([-h, h], dtype=complex), self.T, self.r))
+        standard_deviation = np.sqrt(max(-float(np.real(log_phi.sum())) / h ** 2, 1e-24))
+
+        eta = min(self.INTEGRATION_STEP, 1 / (self.INTEGRATION_STEPS_PER_STANDARD_DEVIATION * standard_deviation))
+        points = 2 * np.pi * self.POINTS_PER_STANDARD_DEVIATION / (eta * standard_deviation)
+        return int(min(max(self.FFT_POINTS, 2 ** int(np.ceil(np.log2(points)))), self.MAX_FFT_POINTS)), eta
+
+    def _pricing_cache_key(self, option_type):
+        """Cache key of the price, including parameters of the characteristic function."""
+        return self.pricing_cache.canonical_key(type(self).__name__, option_type, self.S, self.K, self.T, self.r,
+                                                type(self.characteristic_function).__name__, list(self.characteristic_function.parameters()))
+
+    def _calculate_call_option_price(self):
+        """Calculates price for call option at strike price from the transform."""
+        return float(self.calculate_option_prices()[0])
+
+    def _calculate_put_option_price(self):
+        """Calculates price for put option at strike price from the transform."""
+        return float(self.calculate_option_prices()[1])
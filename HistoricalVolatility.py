@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Historical volatility estimators calculated from daily price history, vectorized across symbols and time.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+from enum import Enum
+
+# Third party imports
+import numpy as np
+
+# Local package imports
+from instrumentation import instrumented
+
+
+class VOLATILITY_ESTIMATOR(Enum):
+    CLOSE_TO_CLOSE = 'Close-to-close'
+    PARKINSON = 'Parkinson'
+    GARMAN_KLASS = 'Garman-Klass'
+    ROGERS_SATCHELL = 'Rogers-Satchell'
+    YANG_ZHANG = 'Yang-Zhang'
+
+
+class HistoricalVolatility:
+    """
+    Class implementing rolling historical volatility estimators for one or many symbols at once.
+    - Prices of all symbols are held in (dates, symbols) arrays, every estimator is computed for all of them in one pass.
+    - Rolling window sums come from one cumulative sum along the time axis, so the cost does not depend on window length.
+    - Windows containing missing bars (symbol not listed yet, gaps in the panel) are NaN.
+    - Estimates are annualized with TRADING_DAYS_PER_YEAR and can be passed as sigma to the pricing models,
+      e.g. BlackScholesModel.calculate_option_prices(spot_prices, strikes, days, rate, volatility.latest().to_numpy()).
+    """
+
+    TRADING_DAYS_PER_YEAR = 252
+
+    def __init__(self, data, symbol=None):
+        """
+        Initializes log price relatives of the price history.
+        data: history with Open/High/Low/Close columns of one symbol (as returned by Ticker.get_historical_data) or panel
+              with (ticker, column) columns of many symbols (as returned by Ticker.get_bulk_historical_data).
+              When 'Adj Close' column is present, all prices are scaled by the adjustment so splits and dividends are not taken for moves.
+        symbol: name of the symbol of single symbol history
+        """
+        if data.columns.nlevels > 1:
+            self.symbols = list(data.columns.get_level_values(0).unique())
+            fields = set(data.columns.get_level_values(1))
+            field = lambda name: data.xs(name, axis=1, level=1).reindex(columns=self.symbols).to_numpy(dtype=float)
+        else:
+            self.symbols = [symbol]
+            fields = set(data.columns)
+            field = lambda name: data[[name]].to_numpy(dtype=float)
+        self.index = data.index
+
+        open_, high, low, close = (field(name) for name in ['Open', 'High', 'Low', 'Close'])
+        if 'Adj Close' in fields:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                adjustment = field('Adj Close') / close
+            open_, high, low, close = open_ * adjustment, high * adjustment, low * adjustment, close * adjustment
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            previous_close = np.vstack([np.full((1, close.shape[1]), np.nan), close[:-1]])
+            self.close_to_close = self._log_ratio(close, previous_close)
+            self.overnight = self._log_ratio(open_, previous_close)
+            self.open_to_close = self._log_ratio(close, open_)
+            self.high = self._log_ratio(high, open_)
+            self.low = self._log_ratio(low, open_)
+
+    @instrumented
+    def rolling(self, estimator=VOLATILITY_ESTIMATOR.YANG_ZHANG.value, window=21):
+        """
+        Calculates annualized volatility estimates over trailing windows.
+        estimator: VOLATILITY_ESTIMATOR value
+        window: number of daily bars in each estimate
+
+        Returns dataframe indexed by date with one column per symbol, NaN until window bars are available.
+        """
+        import pandas as pd
+
+        variance = self._rolling_variance(estimator, window)
+        return pd.DataFrame(np.sqrt(variance * self.TRADING_DAYS_PER_YEAR), index=self.index, columns=self.symbols)
+
+    def latest(self, estimator=VOLATILITY_ESTIMATOR.YANG_ZHANG.value, window=21):
+        """Returns series of the most recent available annualized estimate of every symbol."""
+        return self.rolling(estimator, window).ffill().iloc[-1]
+
+    def latest_all(self, window=21):
+        """Returns dataframe of the most recent estimate of every symbol (rows) by every estimator (columns)."""
+        import pandas as pd
+
+        return pd.DataFrame({estimator.value: self.latest(estimator.value, window) for estimator in VOLATILITY_ESTIMATOR})
+
+    def _rolling_variance(self, estimator, window):
+        """Returns (dates, symbols) array of daily variance estimates of the estimator."""
+        if window < 2:
+            raise ValueError('Window must contain at least 2 bars')
+        u, d, c = self.high, self.low, self.open_to_close
+
+        if estimator == VOLATILITY_ESTIMATOR.CLOSE_TO_CLOSE.value:
+            return self._rolling_sample_variance(self.close_to_close, window)
+        if estimator == VOLATILITY_ESTIMATOR.PARKINSON.value:
+            return self._rolling_mean((u - d) ** 2, window) / (4 * np.log(2))
+        if estimator == VOLATILITY_ESTIMATOR.GARMAN_KLASS.value:
+            return self._rolling_mean(0.5 * (u - d) ** 2 - (2 * np.log(2) - 1) * c ** 2, window)
+        if estimator == VOLATILITY_ESTIMATOR.ROGERS_SATCHELL.value:
+            return self._rolling_mean(u * (u - c) + d * (d - c), window)
+        if estimator == VOLATILITY_ESTIMATOR.YANG_ZHANG.value:
+            # Overnight and open-to-close variances combined with Rogers-Satchell, k minimizes the estimator variance
+            k = 0.34 / (1.34 + (window + 1) / (window - 1))
+            rogers_satchell = self._rolling_mean(u * (u - c) + d * (d - c), window)
+            # Overnight return of the first bar is unknown, windows are aligned so every estimate uses the same bars
+            rogers_satchell[np.isnan(self.overnight)] = np.nan
+            return (self._rolling_sample_variance(self.overnight, window) + k * self._rolling_sample_variance(c, window)
+                    + (1 - k) * rogers_satchell)
+        raise ValueError(f'Unknown volatility estimator {estimator}')
+
+    @staticmethod
+    def _log_ratio(numerator, denominator):
+        """Log of price ratio, NaN for missing or non-positive prices."""
+        ratio = numerator / denominator
+        return np.log(np.where(ratio > 0, ratio, np.nan))
+
+    @staticmethod
+    def _rolling_sum(values, window):
+        """
+        Sums over trailing windows along the time axis: differences of one cumulative sum, O(n) for any window.
+        Windows with any missing value are NaN.
+        """
+        valid = np.isfinite(values)
+        zeros = np.zeros((1,) + values.shape[1:])
+        sums = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0.0), axis=0)])
+        counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+
+        result = np.full(values.shape, np.nan)
+        complete = counts[window:] - counts[:-window] == window
+        result[window - 1:] = np.where(complete, sums[window:] - sums[:-window], np.nan)
+        return result
+
+    @staticmethod
+    def _rolling_mean(values, window):
+        return HistoricalVolatility._rolling_sum(values, window) / window
+
+    @staticmethod
+    def _rolling_sample_variance(values, window):
+        """Sample variance (n - 1 denominator) over trailing windows from rolling sums of values and squared values."""
+        sums = HistoricalVolatility._rolling_sum(values, window)
+        squares = HistoricalVolatility._rolling_sum(values ** 2, window)
+        return np.maximum(squares - sums ** 2 / window, 0.0) / (window - 1)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Implied volatility solver for whole option chains built on top of Black-Scholes model.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+from collections import namedtuple
+
+# Third party imports
+import numpy as np
+from scipy.special import ndtr
+
+# Local package imports
+from base import OPTION_TYPE
+from BlackScholesModel import BlackScholesModel
+from instrumentation import stage, instrumented
+
+
+ImpliedVolatilityResult = namedtuple('ImpliedVolatilityResult', ['sigma', 'iterations', 'converged'])
+
+
+class ImpliedVolatility:
+    """
+    Class implementing vectorized calculation of Black-Scholes implied volatility for arrays of option quotes.
+    All quotes are solved at once:
+    - Put quotes are converted to call quotes using put-call parity.
+    - Initial guess comes from Corrado-Miller rational approximation.
+    - Newton iterations use analytic vega and fall back to bisection whenever the step leaves the bracket
+      known to contain the root, so every quote inside no-arbitrage bounds converges.
+    - Only contracts that have not converged yet are repriced in each iteration (convergence mask).
+    """
+
+    def __init__(self, option_prices, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, option_type=OPTION_TYPE.CALL_OPTION.value):
+        """
+        Initializes market quotes and contract parameters. All parameters can be numpy arrays broadcastable against each other.
+        option_prices: observed market prices of options
+        underlying_spot_price: current stock or other underlying spot price
+        strike_price: strike price for option cotract
+        days_to_maturity: option contract maturity/exercise date
+        risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
+        option_type: 'Call Option'/'Put Option' value or array of such values
+        """
+        option_prices, S, K, T, r, option_type = np.broadcast_arrays(
+            np.asarray(option_prices, dtype=float),
+            np.asarray(underlying_spot_price, dtype=float),
+            np.asarray(strike_price, dtype=float),
+            np.asarray(days_to_maturity, dtype=float) / 365,
+            np.asarray(risk_free_rate, dtype=float),
+            np.asarray(option_type))
+        self.shape = option_prices.shape
+        self.option_prices = option_prices.ravel()
+        self.S = S.ravel()
+        self.K = K.ravel()
+        self.T = T.ravel()
+        self.r = r.ravel()
+        self.is_call = (option_type == OPTION_TYPE.CALL_OPTION.value).ravel()
+
+    @instrumented
+    def solve(self, tolerance=1e-8, max_iterations=100, max_sigma=10.0):
+        """
+        Solves implied volatility for all quotes.
+        tolerance: absolute pricing error at which quote is considered solved
+        max_iterations: maximum number of Newton/bisection iterations
+        max_sigma: upper volatility bound of the search bracket
+
+        Returns ImpliedVolatilityResult with arrays shaped as the broadcast inputs:
+        sigma: implied volatilities (NaN for quotes violating no-arbitrage bounds or not converged)
+        iterations: number of iterations spent on each quote
+        converged: boolean mask of successfully solved quotes
+        """
+        S, K, T, r = self.S, self.K, self.T, self.r
+        discounted_strike = K * np.exp(-r * T)
+
+        # Put-call parity: C = P + S - PV(K)
+        call_prices = np.where(self.is_call, self.option_prices, self.option_prices + S - discounted_strike)
+
+        # Quotes outside of no-arbitrage bounds have no implied volatility
+        valid = (call_prices > np.maximum(S - discounted_strike, 0.0)) & (call_prices < S) & (T > 0)
+
+        sigma = np.full(S.shape, np.nan)
+        iterations = np.zeros(S.shape, dtype=int)
+        converged = np.zeros(S.shape, dtype=bool)
+
+        active = np.flatnonzero(valid)
+        sigma[active] = np.clip(self._initial_guess(call_prices[active], S[active], discounted_strike[active], T[active]), 1e-4, max_sigma)
+        lower = np.zeros(active.size)
+        upper = np.full(active.size, float(max_sigma))
+
+        with stage('newton iterations') as instrumented_stage:
+            for iteration in range(1, max_iterations + 1):
+                if active.size == 0:
+                    break
+                vol = sigma[active]
+                d1, d2 = BlackScholesModel._calculate_d1_d2(S[active], K[active], T[active], r[active], vol)
+                price = S[active] * ndtr(d1) - discounted_strike[active] * ndtr(d2)
+                vega = S[active] * np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi) * np.sqrt(T[active])
+                error = price - call_prices[active]
+                iterations[active] = iteration
+
+                done = np.abs(error) < tolerance
+                converged[active[done]] = True
+
+                # Shrinking bracket which contains the root (price is increasing in sigma)
+                too_high = error > 0
+                upper = np.where(too_high, vol, upper)
+                lower = np.where(too_high, lower, vol)
+
+                # Newton step, replaced with bisection when it leaves the bracket
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    newton = vol - error / vega
+                bisection = 0.5 * (lower + upper)
+                inside = np.isfinite(newton) & (newton > lower) & (newton < upper)
+                sigma[active] = np.where(done, vol, np.where(inside, newton, bisection))
+
+                keep = ~done
+                active, lower, upper = active[keep], lower[keep], upper[keep]
+            # Iterations summed over quotes
+            instrumented_stage.record(iterations=int(iterations.sum()))
+
+        sigma[~converged] = np.nan
+        return ImpliedVolatilityResult(sigma.reshape(self.shape), iterations.reshape(self.shape), converged.reshape(self.shape))
+
+    @staticmethod
+    def _initial_guess(call_prices, S, discounted_strike, T):
+        """
+        Corrado-Miller approximation of implied volatility for call option prices.
+        Formula: sqrt(2pi/T) / (S + X) * (C - (S - X)/2 + sqrt((C - (S - X)/2)^2 - (S - X)^2/pi)), X = PV(K)
+        """
+        half_moneyness = 0.5 * (S - discounted_strike)
+        adjusted_price = call_prices - half_moneyness
+        radicand = np.maximum(adjusted_price ** 2 - (S - discounted_strike) ** 2 / np.pi, 0.0)
+        return np.sqrt(2 * np.pi / T) / (S + discounted_strike) * (adjusted_price + np.sqrt(radicand))
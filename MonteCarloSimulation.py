@@ -5,13 +5,39 @@ Created on Fri Feb 24 14:36:39 2023
 @author: Gilberto
 """
 
+# Standard library imports
+from enum import Enum
+
 # Third party imports
 import numpy as np
-from scipy.stats import norm 
-import matplotlib.pyplot as plt
+from scipy.special import ndtri
 
 # Local package imports
 from base import OptionPricingModel
+from base import OPTION_TYPE
+from base import EXECUTOR
+from base import MonteCarloEstimate
+from base import _estimate_from_plain
+from base import RunningStatistics
+from base import simulate_to_tolerance
+from base import simulate_in_parallel
+from kernels import get_kernels
+from instrumentation import stage, instrumented
+
+
+class SIMULATION_MODE(Enum):
+    FULL_PATHS = 'Full paths'
+    TERMINAL = 'Terminal prices'
+    STREAMING = 'Streaming'
+    PARALLEL = 'Parallel streaming'
+
+
+class VARIANCE_REDUCTION(Enum):
+    NONE = 'None'
+    ANTITHETIC = 'Antithetic variates'
+    CONTROL_VARIATE = 'Control variate'
+    MOMENT_MATCHING = 'Moment matching'
+    SOBOL = 'Scrambled Sobol'
 
 
 class MonteCarloPricing(OptionPricingModel):
@@ -20,9 +46,21 @@ class MonteCarloPricing(OptionPricingModel):
     We simulate underlying asset price on expiry date using random stochastic process - Brownian motion.
     For the simulation generated prices at maturity, we calculate and sum up their payoffs, average them and discount the final value.
     That value represents option price
+    Simulation modes:
+    - Full paths: daily price movements of every simulation are stored (rows as time index, columns as simulations)
+    - Terminal prices: only prices on expiry date are sampled, exactly from lognormal distribution in one draw per simulation
+    - Streaming: terminal prices are sampled in chunks of fixed size and only running mean/variance of payoffs is kept,
+      so memory stays bounded for any number of simulations
+    - Parallel streaming: chunks are simulated by a pool of workers, every chunk with its own generator spawned from
+      the seed, and running statistics are merged in chunk order, so prices do not depend on the number of workers
     """
 
-    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations):
+    # Number of progress reports of full path simulation in compiled kernel, which steps through blocks of days
+    PROGRESS_REPORTS = 100
+
+    def __init__(self, underlying_spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations,
+                 simulation_mode=SIMULATION_MODE.FULL_PATHS.value, chunk_size=100000, seed=20, number_of_workers=None,
+                 executor=EXECUTOR.THREAD_POOL.value):
         """
         Initializes variables used in Black-Scholes formula .
         underlying_spot_price: current stock or other underlying spot price
@@ -31,6 +69,11 @@ class MonteCarloPricing(OptionPricingModel):
         risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
         sigma: volatility of the underlying asset (standard deviation of asset's log returns)
         number_of_simulations: number of potential random underlying price movements 
+        simulation_mode: 'Full paths', 'Terminal prices', 'Streaming' or 'Parallel streaming'
+        chunk_size: number of simulations generated at once in streaming modes
+        seed: seed of random number generator
+        number_of_workers: number of workers in parallel streaming mode, defaults to number of processors
+        executor: 'Thread pool' or 'Process pool' used in parallel streaming mode
         """
         # Parameters for Brownian process
         self.S_0 = underlying_spot_price
@@ -41,38 +84,129 @@ class MonteCarloPricing(OptionPricingModel):
 
         # Parameters for simulation
         self.N = number_of_simulations
+        # One step per day, full paths have num_of_steps + 1 rows: spot price today and prices at the end of every day up to T
         self.num_of_steps = days_to_maturity
         self.dt = self.T / self.num_of_steps
+        self.simulation_mode = simulation_mode
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.number_of_workers = number_of_workers
+        self.executor = executor
 
-    def simulate_prices(self):
+        # Simulation results
+        self.simulation_results_S = None
+        self.simulation_results_S_T = None
+        self.payoff_statistics = None
+
+    @instrumented
+    def simulate_prices(self, num_of_movements=None, progress=None):
         """
         Simulating price movement of underlying prices using Brownian random process.
         Saving random results.
+        num_of_movements: in terminal and streaming modes, number of full price movements simulated additionally for plotting
+        progress: optional function progress(fraction, payoff_statistics) called after every simulated day (full paths)
+        or chunk (streaming modes, with running statistics of payoffs); simulation can be aborted by raising an exception from it
         """
-        np.random.seed(20)
+        if self.simulation_mode == SIMULATION_MODE.TERMINAL.value:
+            rng = np.random.default_rng(self.seed)
+            self.simulation_results_S_T = self._sample_terminal_prices(rng, self.N)
+        elif self.simulation_mode == SIMULATION_MODE.STREAMING.value:
+            self._simulate_streaming(progress)
+        elif self.simulation_mode == SIMULATION_MODE.PARALLEL.value:
+            self.payoff_statistics = simulate_in_parallel(self._sample_discounted_payoffs, self.N, self.chunk_size, self.seed,
+                                                          self.number_of_workers, self.executor, progress)
+        else:
+            self._simulate_paths(progress)
+            return
+
+        if num_of_movements:
+            self.simulation_results_S = self._generate_paths(np.random.default_rng(self.seed), num_of_movements)
+
+    def _simulate_paths(self, progress=None):
+        """Simulates and stores full daily price movements for all simulations."""
         self.simulation_results = None
+        self.simulation_results_S = self._generate_paths(np.random.default_rng(self.seed), self.N, progress)
+        self.simulation_results_S_T = self.simulation_results_S[-1]
 
+    def _generate_paths(self, rng, number_of_paths, progress=None):
+        """Generates daily price movements with random generator rng: rows as time index and columns as different random price movements."""
         # Initializing price movements for simulation: rows as time index and columns as different random price movements.
-        S = np.zeros((self.num_of_steps, self.N))        
+        S = np.zeros((self.num_of_steps + 1, number_of_paths))
         # Starting value for all price movements is the current spot price
         S[0] = self.S_0
+        # Random values to simulate Brownian motion (Gaussian distibution), drawn in the same order as day by day
+        # and stored in place of the prices they turn into, so no temporary arrays are needed
+        with stage('random numbers') as instrumented_stage:
+            rng.standard_normal(out=S[1:])
+            instrumented_stage.record(iterations=S[1:].size, nbytes=S.nbytes)
+        drift = (self.r - 0.5 * self.sigma ** 2) * self.dt
+        volatility = self.sigma * np.sqrt(self.dt)
+
+        with stage('price paths') as instrumented_stage:
+            instrumented_stage.record(iterations=self.num_of_steps)
+            kernels = get_kernels()
+            if kernels is not None:
+                # Compiled kernel steps through blocks of days, progress is reported after each block
+                block = max(1, self.num_of_steps // self.PROGRESS_REPORTS)
+                for start in range(1, self.num_of_steps + 1, block):
+                    stop = min(start + block, self.num_of_steps + 1)
+                    kernels.geometric_brownian_paths(S, drift, volatility, start, stop)
+                    if progress is not None:
+                        progress((stop - 1) / self.num_of_steps, None)
+                return S
+
+            for t in range(1, self.num_of_steps + 1):
+                # Updating prices for next point in time: S[t] = S[t - 1] * exp(drift + volatility * Z)
+                S[t] *= volatility
+                S[t] += drift
+                np.exp(S[t], out=S[t])
+                S[t] *= S[t - 1]
+                if progress is not None:
+                    progress(t / self.num_of_steps, None)
 
-        for t in range(1, self.num_of_steps):
-            # Random values to simulate Brownian motion (Gaussian distibution)
-            Z = np.random.standard_normal(self.N)
-            # Updating prices for next point in time 
-            S[t] = S[t - 1] * np.exp((self.r - 0.5 * self.sigma ** 2) * self.dt + (self.sigma * np.sqrt(self.dt) * Z))
+        return S
 
-        self.simulation_results_S = S
+    def _sample_terminal_prices(self, rng, number_of_prices):
+        """Samples prices on expiry date exactly: S_T = S_0 * exp((r - sigma^2/2)T + sigma*sqrt(T)*Z)."""
+        with stage('random numbers') as instrumented_stage:
+            Z = rng.standard_normal(number_of_prices)
+            instrumented_stage.record(iterations=number_of_prices, nbytes=Z.nbytes)
+        return self._terminal_prices(Z)
+
+    def _terminal_prices(self, Z):
+        """Prices on expiry date for standard normal draws Z."""
+        return self.S_0 * np.exp((self.r - 0.5 * self.sigma ** 2) * self.T + self.sigma * np.sqrt(self.T) * Z)
+
+    def _simulate_streaming(self, progress=None):
+        """Simulates terminal prices in chunks, keeping only running statistics of discounted call/put payoffs."""
+        rng = np.random.default_rng(self.seed)
+        payoff_statistics = {option_type.value: RunningStatistics() for option_type in OPTION_TYPE}
+
+        for start in range(0, self.N, self.chunk_size):
+            payoffs = self._sample_discounted_payoffs(rng, min(self.chunk_size, self.N - start))
+            for option_type, statistics in payoff_statistics.items():
+                statistics.update(payoffs[option_type])
+            if progress is not None:
+                progress(min(start + self.chunk_size, self.N) / self.N, payoff_statistics)
+
+        # Statistics are published only when complete, so an aborted simulation leaves no partial prices
+        self.payoff_statistics = payoff_statistics
+
+    def _sample_discounted_payoffs(self, rng, number_of_simulations):
+        """Discounted call/put payoffs of a chunk of exactly sampled terminal prices, keyed by option type."""
+        S_T = self._sample_terminal_prices(rng, number_of_simulations)
+        return {option_type.value: self._discounted_payoffs(S_T, option_type.value) for option_type in OPTION_TYPE}
 
     def _calculate_call_option_price(self): 
         """
         Call option price calculation. Calculating payoffs for simulated prices at expiry date, summing up, averiging them and discounting.   
         Call option payoff (it's exercised only if the price at expiry date is higher than a strike price): max(S_t - K, 0)
         """
-        if self.simulation_results_S is None:
+        if self.payoff_statistics is not None:
+            return self.payoff_statistics[OPTION_TYPE.CALL_OPTION.value].mean
+        if self.simulation_results_S_T is None:
             return -1
-        return np.exp(-self.r * self.T) * 1 / self.N * np.sum(np.maximum(self.simulation_results_S[-1] - self.K, 0))
+        return np.exp(-self.r * self.T) * 1 / self.N * np.sum(np.maximum(self.simulation_results_S_T - self.K, 0))
     
 
     def _calculate_put_option_price(self): 
@@ -80,13 +214,138 @@ class MonteCarloPricing(OptionPricingModel):
         Put option price calculation. Calculating payoffs for simulated prices at expiry date, summing up, averiging them and discounting.   
         Put option payoff (it's exercised only if the price at expiry date is lower than a strike price): max(K - S_t, 0)
         """
-        if self.simulation_results_S is None:
+        if self.payoff_statistics is not None:
+            return self.payoff_statistics[OPTION_TYPE.PUT_OPTION.value].mean
+        if self.simulation_results_S_T is None:
             return -1
-        return np.exp(-self.r * self.T) * 1 / self.N * np.sum(np.maximum(self.K - self.simulation_results_S[-1], 0))
+        return np.exp(-self.r * self.T) * 1 / self.N * np.sum(np.maximum(self.K - self.simulation_results_S_T, 0))
        
 
+    def _discounted_payoffs(self, S_T, option_type):
+        """Discounted call/put payoffs for prices on expiry date."""
+        if option_type == OPTION_TYPE.CALL_OPTION.value:
+            return np.exp(-self.r * self.T) * np.maximum(S_T - self.K, 0)
+        return np.exp(-self.r * self.T) * np.maximum(self.K - S_T, 0)
+
+    def calculate_option_price_estimate(self, option_type, confidence_level=0.95):
+        """
+        Calculates option price from simulated prices together with its standard error and confidence interval.
+        option_type: 'Call Option' or 'Put Option'
+        confidence_level: level of the two-sided confidence interval
+
+        Returns MonteCarloEstimate (price, standard_error, confidence_interval, number_of_simulations) or None when prices were not simulated.
+        Served from pricing_cache when set, like the price of _calculate_option_price.
+        """
+        return self._cached_result('calculate_option_price_estimate', (option_type, confidence_level),
+                                   lambda: self._evaluate_option_price_estimate(option_type, confidence_level), _estimate_from_plain)
+
+    def _evaluate_option_price_estimate(self, option_type, confidence_level):
+        """Option price estimate from simulated prices, without cache."""
+        if self.payoff_statistics is not None:
+            return self.payoff_statistics[option_type].estimate(confidence_level)
+        if self.simulation_results_S_T is None:
+            return None
+        return RunningStatistics().update(self._discounted_payoffs(self.simulation_results_S_T, option_type)).estimate(confidence_level)
+
+    def calculate_option_price_to_tolerance(self, option_type, absolute_tolerance=None, relative_tolerance=None, time_budget=None,
+                                            batch_size=10000, max_simulations=10000000, confidence_level=0.95):
+        """
+        Simulates batches of exactly sampled terminal prices until the confidence interval of the price is narrow enough.
+        Stops when half width of the interval drops below absolute_tolerance or relative_tolerance * price,
+        when time_budget (seconds) is spent or when max_simulations is reached.
+
+        Returns MonteCarloEstimate of the option price.
+        """
+        rng = np.random.default_rng(self.seed)
+
+        def sample_batch(number_of_simulations):
+            return self._discounted_payoffs(self._sample_terminal_prices(rng, number_of_simulations), option_type)
+
+        return simulate_to_tolerance(sample_batch, absolute_tolerance, relative_tolerance, time_budget,
+                                     batch_size, max_simulations, confidence_level)
+
+    def calculate_option_price_with_variance_reduction(self, option_type, variance_reduction=VARIANCE_REDUCTION.ANTITHETIC.value,
+                                                       confidence_level=0.95, number_of_replications=16):
+        """
+        Prices option from number_of_simulations exactly sampled terminal prices using selected variance reduction technique:
+        - Antithetic variates: every normal draw Z is paired with -Z, estimator averages payoffs of the pair
+        - Control variate: discounted terminal stock price with known mean S_0, optimal coefficient estimated from the sample
+        - Moment matching: normal draws are standardized to sample mean 0 and variance 1
+        - Scrambled Sobol: randomized quasi-random sequence mapped to normals with inverse normal CDF
+        Estimators that are not averages of independent samples (moment matching, Sobol) are replicated number_of_replications
+        times and their standard error comes from the spread of the replications.
+
+        Returns MonteCarloEstimate whose variance_reduction_factor is plain Monte Carlo variance of the mean for the same
+        number of simulations divided by the variance of the estimator. Served from pricing_cache when set.
+        """
+        return self._cached_result('calculate_option_price_with_variance_reduction',
+                                   (option_type, variance_reduction, confidence_level, number_of_replications),
+                                   lambda: self._evaluate_option_price_with_variance_reduction(
+                                       option_type, variance_reduction, confidence_level, number_of_replications),
+                                   _estimate_from_plain)
+
+    def _evaluate_option_price_with_variance_reduction(self, option_type, variance_reduction, confidence_level, number_of_replications):
+        """Option price estimate with variance reduction technique, without cache."""
+        rng = np.random.default_rng(self.seed)
+
+        if variance_reduction == VARIANCE_REDUCTION.ANTITHETIC.value:
+            Z = rng.standard_normal(self.N // 2)
+            payoffs = self._discounted_payoffs(self._terminal_prices(np.concatenate((Z, -Z))), option_type)
+            pair_averages = 0.5 * (payoffs[:Z.size] + payoffs[Z.size:])
+            price = np.mean(pair_averages)
+            estimator_variance = np.var(pair_averages, ddof=1) / pair_averages.size
+
+        elif variance_reduction == VARIANCE_REDUCTION.CONTROL_VARIATE.value:
+            S_T = self._sample_terminal_prices(rng, self.N)
+            payoffs = self._discounted_payoffs(S_T, option_type)
+            control = np.exp(-self.r * self.T) * S_T
+            covariance = np.cov(payoffs, control)
+            beta = covariance[0, 1] / covariance[1, 1]
+            adjusted = payoffs - beta * (control - self.S_0)
+            price = np.mean(adjusted)
+            estimator_variance = np.var(adjusted, ddof=1) / adjusted.size
+
+        elif variance_reduction in (VARIANCE_REDUCTION.MOMENT_MATCHING.value, VARIANCE_REDUCTION.SOBOL.value):
+            replication_size = self.N // number_of_replications
+            if number_of_replications < 2 or replication_size < 2:
+                # Standard error needs 2 replications, moment matching and Sobol need 2 draws per replication
+                raise ValueError(f'{variance_reduction} needs at least 2 replications of at least 2 simulations, '
+                                 f'{self.N} simulations in {number_of_replications} replications given')
+            if variance_reduction == VARIANCE_REDUCTION.SOBOL.value:
+                # Sobol points keep their balance properties only for powers of two
+                replication_size = 2 ** int(np.log2(replication_size))
+                from scipy.stats import qmc
+            payoffs = np.empty((number_of_replications, replication_size))
+            for replication in range(number_of_replications):
+                if variance_reduction == VARIANCE_REDUCTION.SOBOL.value:
+                    sobol = qmc.Sobol(d=1, scramble=True, seed=rng)
+                    Z = ndtri(sobol.random(replication_size)[:, 0])
+                else:
+                    Z = rng.standard_normal(replication_size)
+                    Z = (Z - Z.mean()) / Z.std()
+                payoffs[replication] = self._discounted_payoffs(self._terminal_prices(Z), option_type)
+            replication_means = payoffs.mean(axis=1)
+            price = np.mean(replication_means)
+            estimator_variance = np.var(replication_means, ddof=1) / number_of_replications
+
+        else:
+            payoffs = self._discounted_payoffs(self._sample_terminal_prices(rng, self.N), option_type)
+            price = np.mean(payoffs)
+            estimator_variance = np.var(payoffs, ddof=1) / payoffs.size
+
+        # Plain Monte Carlo variance of the mean for the same number of payoff evaluations
+        plain_variance = np.var(payoffs, ddof=1) / payoffs.size
+        standard_error = float(np.sqrt(estimator_variance))
+        half_width = float(ndtri(0.5 + 0.5 * confidence_level)) * standard_error
+        return MonteCarloEstimate(float(price), standard_error, (float(price) - half_width, float(price) + half_width), payoffs.size,
+                                  float(plain_variance / estimator_variance) if estimator_variance > 0 else np.inf)
+
     def plot_simulation_results(self, num_of_movements):
         """Plots specified number of simulated price movements."""
+        if self.simulation_results_S is None:
+            return
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(12,8))
         plt.plot(self.simulation_results_S[:,0:num_of_movements])
         plt.axhline(self.K, c='k', xmin=0, xmax=self.num_of_steps, label='Strike Price')
@@ -95,4 +354,4 @@ class MonteCarloPricing(OptionPricingModel):
         plt.xlabel('Days in future')
         plt.title(f'First {num_of_movements}/{self.N} Random Price Movements')
         plt.legend(loc='best')
-        plt.show()
\ No newline at end of file
+        plt.show()
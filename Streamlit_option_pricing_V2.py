@@ -6,17 +6,23 @@ Created on Fri Feb 24 14:39:13 2023
 # Standart python imports
 from enum import Enum
 from datetime import datetime, timedelta
+from uuid import uuid4
 
 # Third party imports
 import streamlit as st
 
 # Local package imports
 from BlackScholesModel import BlackScholesModel 
-from MonteCarloSimulation import MonteCarloPricing 
-from BinomialTreeModel import BinomialTreeModel
+from MonteCarloSimulation import MonteCarloPricing, SIMULATION_MODE, VARIANCE_REDUCTION
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
 from AmericanPricing import AmericanPricing
-from ticker import Ticker
+from HistoricalVolatility import HistoricalVolatility, VOLATILITY_ESTIMATOR
+from ticker import Ticker, MarketDataCache, DEFAULT_CACHE_DIRECTORY
+from pricing_cache import PricingCache
+from jobs import JobExecutor, JOB_STATUS
+import instrumentation
 import base
+import os
 import io
 import numpy as np
 import matplotlib.pyplot as plt
@@ -31,10 +37,163 @@ class OPTION_PRICING_MODEL(Enum):
     BINOMIAL = 'Binomial Model'
     AMERICAN = 'American option LSM Model'
 
+# Sigma source using the value of the sigma slider instead of an estimate from price history
+MANUAL_SIGMA = 'Manual'
+
+# On-disk cache of daily bars shared by app restarts and workers, only missing bars are downloaded
+market_data_cache = MarketDataCache()
+
 @st.cache_data
 def get_historical_data(ticker):
     """Getting historical data for speified ticker and caching it with streamlit app."""
-    return Ticker.get_historical_data(ticker)
+    return Ticker.get_historical_data(ticker, market_data_cache)
+
+def fetch_historical_data(ticker):
+    """Historical data of the ticker, instrumentation records of the fetch are kept for the timing panel."""
+    with instrumentation.capture() as runs:
+        data = get_historical_data(ticker)
+    st.session_state['data_fetch_runs'] = runs
+    return data
+
+@st.cache_resource
+def get_pricing_cache():
+    """
+    Pricing cache shared by all sessions and reruns of the app, backed by on-disk store shared by app workers.
+    Serves prices, Monte Carlo and LSM estimates, LSM strike ladders and binomial call/put prices of the pricing jobs.
+    """
+    return PricingCache(directory=os.path.join(DEFAULT_CACHE_DIRECTORY, 'prices'))
+
+base.OptionPricingModel.pricing_cache = get_pricing_cache()
+
+# Instrumentation of every pricing run for all sessions (logged to the 'instrumentation' logger), otherwise it is enabled
+# only while a session shows the timing breakdown
+INSTRUMENTATION_ENABLED = os.environ.get('OPTION_PRICING_INSTRUMENTATION') == '1'
+
+@st.cache_resource
+def get_timing_sessions():
+    """Sessions showing the timing breakdown. Instrumentation is process wide, so it stays enabled while any of them does."""
+    return set()
+
+def update_instrumentation(show_timing_breakdown):
+    """Enables instrumentation when this or another session shows the timing breakdown or it is configured on, disables it otherwise."""
+    sessions = get_timing_sessions()
+    session = st.session_state.setdefault('session_id', str(uuid4()))
+    if show_timing_breakdown:
+        sessions.add(session)
+    else:
+        sessions.discard(session)
+    if INSTRUMENTATION_ENABLED or sessions:
+        if instrumentation.active() is None:
+            instrumentation.enable(instrumentation.Instrumentation(max_records=1000))
+    elif instrumentation.active() is not None:
+        instrumentation.disable()
+
+@st.cache_resource
+def get_job_executor():
+    """Worker pool running pricing jobs of all sessions off the script thread."""
+    return JobExecutor(max_workers=4)
+
+def submit_job(request, function, *args):
+    """Submits function(job, *args) computing request (page with its parameters), superseding previous job of the session."""
+    session = st.session_state.setdefault('session_id', str(uuid4()))
+    get_job_executor().submit(session, request, function, *args)
+
+def session_job(request):
+    """Returns job of the session computing request. Job computing different request is superseded and gets cancelled."""
+    job = get_job_executor().current_job(st.session_state.setdefault('session_id', str(uuid4())))
+    if job is None or job.name != request:
+        if job is not None and not job.done:
+            job.cancel()
+        return None
+    return job
+
+def follow_job(job):
+    """Displays progress and partial results of the job until it finishes. Returns its result, None when it did not complete."""
+    if not job.done and st.button('Cancel calculation'):
+        job.cancel()
+    progress_bar = st.progress(0.0)
+    partial_result = st.empty()
+    while not job.wait(0.2):
+        progress_bar.progress(float(min(job.progress, 1.0)))
+        if job.partial_result is not None:
+            partial_result.write(job.partial_result)
+    progress_bar.empty()
+    partial_result.empty()
+
+    if job.status == JOB_STATUS.FAILED:
+        st.error(f'Calculation failed: {job.error}')
+    elif job.status == JOB_STATUS.CANCELLED:
+        st.warning('Calculation was cancelled')
+    return job.result
+
+# Models hold simulated paths and intermediate results, so every job gets its own model instead of a model shared by
+# sessions. Repeated calculations with identical parameters are served from the pricing cache.
+
+def monte_carlo_job(job, MC, num_of_movements, variance_reduction):
+    """Simulates prices streaming running estimates, then estimates call/put prices."""
+    def report(fraction, payoff_statistics):
+        running = None
+        if payoff_statistics:
+            running = ', '.join(f'{option_type}: {statistics.mean:.4f} ± {statistics.standard_error:.4f}'
+                                for option_type, statistics in payoff_statistics.items())
+        job.report(fraction, f'Running estimates after {fraction:.0%} of simulations: {running}' if running else None)
+
+    MC.simulate_prices(num_of_movements, report)
+    option_types = [option_type.value for option_type in base.OPTION_TYPE]
+    estimates = {option_type: MC.calculate_option_price_estimate(option_type) for option_type in option_types}
+    variance_reduction_estimates = {}
+    if variance_reduction != VARIANCE_REDUCTION.NONE.value:
+        for option_type in option_types:
+            job.report(1.0, f'Pricing {option_type} with {variance_reduction}')
+            variance_reduction_estimates[option_type] = MC.calculate_option_price_with_variance_reduction(option_type, variance_reduction)
+    return estimates, variance_reduction_estimates
+
+def american_job(job, AP, strike_price_list):
+    """Estimates call/put prices and prices the strike ladder from one path set, reporting every day of the backward induction."""
+    def report(start, end, message):
+        return lambda fraction: job.report(start + (end - start) * fraction, message)
+
+    job.report(0.0, 'Simulating price paths and pricing call option')
+    call_estimate = AP.calculate_option_price_estimate('Call Option', progress=report(0.0, 0.4, 'Pricing call option'))
+    job.report(0.4, 'Pricing put option')
+    put_estimate = AP.calculate_option_price_estimate('Put Option', progress=report(0.4, 0.7, 'Pricing put option'))
+    job.report(0.7, 'Pricing strike ladder')
+    ladder = AP.calculate_option_price_ladder(strike_price_list, progress=report(0.7, 1.0, 'Pricing strike ladder'))
+    return call_estimate, put_estimate, ladder
+
+def binomial_job(job, BOPM):
+    """Prices call and put in one backward induction."""
+    job.report(0.0, 'Building lattice')
+    return BOPM.calculate_option_prices()
+
+def timing_panel(runs=()):
+    """Displays time, iterations and allocations of every instrumented stage of the last data fetch and calculation."""
+    runs = list(st.session_state.get('data_fetch_runs', [])) + list(runs)
+    if not show_timing_breakdown or not runs:
+        return
+    import pandas as pd
+
+    table = pd.DataFrame(instrumentation.stage_table(runs)).drop(columns=['thread', 'traced_peak_mb'])
+    with st.expander('Timing breakdown', expanded=True):
+        st.dataframe(table)
+        # Outermost stage of a run contains all its other stages
+        stages = table[table['stage'] != table['run']]
+        if len(stages):
+            st.bar_chart(stages.groupby('stage')['seconds'].sum())
+
+def volatility_inputs():
+    """Widgets selecting where sigma comes from: the sigma slider or a historical estimator over a trailing window."""
+    volatility_estimator = st.selectbox('Sigma source', options=[MANUAL_SIGMA] + [estimator.value for estimator in VOLATILITY_ESTIMATOR])
+    volatility_window = st.slider('Volatility window (trading days)', 5, 252, 21)
+    return volatility_estimator, volatility_window
+
+def estimate_sigma(data, sigma, volatility_estimator, volatility_window):
+    """Returns sigma passed to the pricers: manual value, or the latest historical estimate from fetched price history."""
+    if volatility_estimator == MANUAL_SIGMA:
+        return sigma
+    estimate = HistoricalVolatility(data).latest(volatility_estimator, volatility_window).iloc[0]
+    st.write(f'{volatility_estimator} volatility over the last {volatility_window} trading days: {estimate:.2%}')
+    return estimate
 
 # Ignore the Streamlit warning for using st.pyplot()
 st.set_option('deprecation.showPyplotGlobalUse', False)
@@ -45,6 +204,8 @@ st.title('Option pricing')
 
 # User selected model from sidebar 
 pricing_method = st.sidebar.radio('Please select option pricing method', options=[model.value for model in OPTION_PRICING_MODEL])
+show_timing_breakdown = st.sidebar.checkbox('Show timing breakdown')
+update_instrumentation(show_timing_breakdown)
 
 
 # Displaying specified model
@@ -56,11 +217,12 @@ if pricing_method == OPTION_PRICING_MODEL.BLACK_SCHOLES.value:
     strike_price = st.number_input('Strike price', 10)
     risk_free_rate = st.slider('Risk-free rate (%)', 0, 100, 10)
     sigma = st.slider('Sigma (%)', 0, 100, 20)
+    volatility_estimator, volatility_window = volatility_inputs()
     exercise_date = st.date_input('Exercise date', min_value=datetime.today() + timedelta(days=1), value=datetime.today() + timedelta(days=365))
     
     if st.button(f'Calculate option price for {ticker}'):
         # Getting data for selected ticker
-        data = get_historical_data(ticker)
+        data = fetch_historical_data(ticker)
         st.write(data.tail())
         Ticker.plot_data(data, ticker, 'Close')
         st.pyplot()
@@ -68,17 +230,19 @@ if pricing_method == OPTION_PRICING_MODEL.BLACK_SCHOLES.value:
         # Formating selected model parameters
         spot_price = Ticker.get_last_price(data, 'Close') 
         risk_free_rate = risk_free_rate / 100
-        sigma = sigma / 100
+        sigma = estimate_sigma(data, sigma / 100, volatility_estimator, volatility_window)
         days_to_maturity = (exercise_date - datetime.now().date()).days
 
         # Calculating option price
-        BSM = BlackScholesModel(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma)
-        call_option_price = BSM._calculate_option_price('Call Option')
-        put_option_price = BSM._calculate_option_price('Put Option')
+        with instrumentation.capture() as runs:
+            BSM = BlackScholesModel(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma)
+            call_option_price = BSM._calculate_option_price('Call Option')
+            put_option_price = BSM._calculate_option_price('Put Option')
 
         # Displaying call/put option price
         st.subheader(f'Call option price: {call_option_price}')
         st.subheader(f'Put option price: {put_option_price}')
+        timing_panel(runs)
 
 elif pricing_method == OPTION_PRICING_MODEL.AMERICAN.value:
     # Parameters for Monte Carlo simulation
@@ -86,13 +250,15 @@ elif pricing_method == OPTION_PRICING_MODEL.AMERICAN.value:
     strike_price = st.number_input('Strike price', 10)
     risk_free_rate = st.slider('Risk-free rate (%)', 0, 100, 10)
     sigma = st.slider('Sigma (%)', 0, 100, 20)
+    volatility_estimator, volatility_window = volatility_inputs()
     exercise_date = st.date_input('Exercise date', min_value=datetime.today() + timedelta(days=1), value=datetime.today() + timedelta(days=365))
     number_of_simulations = st.slider('Number of simulations', 10000, 100000, 10000)
-    
+    american_request = (pricing_method, ticker, strike_price, risk_free_rate, sigma, volatility_estimator, volatility_window, exercise_date,
+                        number_of_simulations)
 
     if st.button(f'Calculate option price for {ticker}'):
         # Getting data for selected ticker
-        data = get_historical_data(ticker)
+        data = fetch_historical_data(ticker)
         st.write(data.tail())
         Ticker.plot_data(data, ticker, 'Close')
         st.pyplot()
@@ -100,41 +266,33 @@ elif pricing_method == OPTION_PRICING_MODEL.AMERICAN.value:
         # Formating simulation parameters
         spot_price = Ticker.get_last_price(data, 'Close') 
         risk_free_rate = risk_free_rate / 100
-        sigma = sigma / 100
+        sigma = estimate_sigma(data, sigma / 100, volatility_estimator, volatility_window)
         days_to_maturity = (exercise_date - datetime.now().date()).days
 
-        # ESimulating stock movements
-        AP = AmericanPricing(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations)
+        # Simulating stock movements and pricing in background job
+        AP = AmericanPricing(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations, seed=20)
+        strike_price_list = np.arange(strike_price*.50, strike_price*1.50,strike_price*.20 )
+        submit_job(american_request, american_job, AP, strike_price_list)
         
-        # Calculating call/put option price
-        call_option_price = AP._calculate_option_price('Call Option')
-        put_option_price = AP._calculate_option_price('Put Option')
+    job = session_job(american_request)
+    result = follow_job(job) if job is not None else None
+    if job is not None and job.done:
+        timing_panel(job.runs)
+    if result is not None:
+        call_estimate, put_estimate, ladder = result
 
         # Displaying call/put option price
-        st.subheader(f'Call option price: {call_option_price}')
-        st.subheader(f'Put option price: {put_option_price}')
-        st.subheader('Give option premiuns a few momments to load')
+        st.subheader(f'Call option price: {call_estimate.price}')
+        st.write(f'Standard error: {call_estimate.standard_error:.4f}, 95% confidence interval: [{call_estimate.confidence_interval[0]:.4f}, {call_estimate.confidence_interval[1]:.4f}]')
+        st.subheader(f'Put option price: {put_estimate.price}')
+        st.write(f'Standard error: {put_estimate.standard_error:.4f}, 95% confidence interval: [{put_estimate.confidence_interval[0]:.4f}, {put_estimate.confidence_interval[1]:.4f}]')
         
-        # Visualizing Monte Carlo Simulation
-        euro_res = np.array([])
-        amer_res = np.array([])
-        euro_res_put = np.array([])
-        amer_res_put = np.array([])
+        # European and American prices for the whole strike ladder from one simulated path set
         strike_price_list = np.arange(strike_price*.50, strike_price*1.50,strike_price*.20 )
-
-        for strike_price_range in strike_price_list:
-            AP_range = AmericanPricing(spot_price, strike_price_range, days_to_maturity, risk_free_rate, sigma, number_of_simulations)
-            MC_range = MonteCarloPricing(spot_price, strike_price_range, days_to_maturity, risk_free_rate, sigma, number_of_simulations)
-            MC_range.simulate_prices()
-            euro_res = np.append(euro_res, MC_range._calculate_option_price('Call Option'))
-            amer_res = np.append(amer_res, AP_range._calculate_call_option_price())
-            euro_res_put = np.append(euro_res_put, MC_range._calculate_option_price('Put Option'))
-            amer_res_put = np.append(amer_res_put, AP_range._calculate_put_option_price())
-        
-        euro_res = np.array(euro_res)
-        amer_res = np.array(amer_res)
-        euro_res_put = np.array(euro_res_put)
-        amer_res_put = np.array(amer_res_put)
+        euro_res = ladder['european_call']
+        amer_res = ladder['american_call']
+        euro_res_put = ladder['european_put']
+        amer_res_put = ladder['american_put']
 
         fig, (ax1, ax2) = plt.subplots(2,1, sharex=True, figsize=(10, 6))
         ax1.plot(strike_price_list, euro_res, 'b', label='European Call')
@@ -170,13 +328,18 @@ elif pricing_method == OPTION_PRICING_MODEL.MONTE_CARLO.value:
     strike_price = st.number_input('Strike price', 10)
     risk_free_rate = st.slider('Risk-free rate (%)', 0, 100, 10)
     sigma = st.slider('Sigma (%)', 0, 100, 20)
+    volatility_estimator, volatility_window = volatility_inputs()
     exercise_date = st.date_input('Exercise date', min_value=datetime.today() + timedelta(days=1), value=datetime.today() + timedelta(days=365))
     number_of_simulations = st.slider('Number of simulations', 100, 100000, 10000)
     num_of_movements = st.slider('Number of price movement simulations to be visualized ', 0, int(number_of_simulations/10), 100)
+    simulation_mode = st.selectbox('Simulation mode', options=[mode.value for mode in SIMULATION_MODE])
+    variance_reduction = st.selectbox('Variance reduction', options=[technique.value for technique in VARIANCE_REDUCTION])
+    monte_carlo_request = (pricing_method, ticker, strike_price, risk_free_rate, sigma, volatility_estimator, volatility_window, exercise_date,
+                           number_of_simulations, num_of_movements, simulation_mode, variance_reduction)
 
     if st.button(f'Calculate option price for {ticker}'):
         # Getting data for selected ticker
-        data = get_historical_data(ticker)
+        data = fetch_historical_data(ticker)
         st.write(data.tail())
         Ticker.plot_data(data, ticker, 'Close')
         st.pyplot()
@@ -184,24 +347,38 @@ elif pricing_method == OPTION_PRICING_MODEL.MONTE_CARLO.value:
         # Formating simulation parameters
         spot_price = Ticker.get_last_price(data, 'Close') 
         risk_free_rate = risk_free_rate / 100
-        sigma = sigma / 100
+        sigma = estimate_sigma(data, sigma / 100, volatility_estimator, volatility_window)
         days_to_maturity = (exercise_date - datetime.now().date()).days
 
-        # ESimulating stock movements
-        MC = MonteCarloPricing(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations)
-        MC.simulate_prices()
+        # Simulating stock movements and pricing in background job
+        MC = MonteCarloPricing(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_simulations, simulation_mode)
+        submit_job(monte_carlo_request, monte_carlo_job, MC, num_of_movements, variance_reduction)
+        st.session_state['monte_carlo_model'] = MC
+
+    job = session_job(monte_carlo_request)
+    result = follow_job(job) if job is not None else None
+    if job is not None and job.done:
+        timing_panel(job.runs)
+    if result is not None:
+        estimates, variance_reduction_estimates = result
 
         # Visualizing Monte Carlo Simulation
+        MC = st.session_state['monte_carlo_model']
         MC.plot_simulation_results(num_of_movements)
         st.pyplot()
 
-        # Calculating call/put option price
-        call_option_price = MC._calculate_option_price('Call Option')
-        put_option_price = MC._calculate_option_price('Put Option')
-
         # Displaying call/put option price
-        st.subheader(f'Call option price: {call_option_price}')
-        st.subheader(f'Put option price: {put_option_price}')
+        call_estimate = estimates['Call Option']
+        put_estimate = estimates['Put Option']
+        st.subheader(f'Call option price: {call_estimate.price}')
+        st.write(f'Standard error: {call_estimate.standard_error:.4f}, 95% confidence interval: [{call_estimate.confidence_interval[0]:.4f}, {call_estimate.confidence_interval[1]:.4f}]')
+        st.subheader(f'Put option price: {put_estimate.price}')
+        st.write(f'Standard error: {put_estimate.standard_error:.4f}, 95% confidence interval: [{put_estimate.confidence_interval[0]:.4f}, {put_estimate.confidence_interval[1]:.4f}]')
+
+        # Comparing with selected variance reduction technique
+        for option_type, estimate in variance_reduction_estimates.items():
+            st.write(f'{option_type} price with {variance_reduction}: {estimate.price:.4f} (standard error {estimate.standard_error:.4f}, '
+                     f'variance reduction factor {estimate.variance_reduction_factor:.1f})')
 
 elif pricing_method == OPTION_PRICING_MODEL.BINOMIAL.value:
     # Parameters for Binomial-Tree model
@@ -209,12 +386,21 @@ elif pricing_method == OPTION_PRICING_MODEL.BINOMIAL.value:
     strike_price = st.number_input('Strike price', 10)
     risk_free_rate = st.slider('Risk-free rate (%)', 0, 100, 10)
     sigma = st.slider('Sigma (%)', 0, 100, 20)
+    volatility_estimator, volatility_window = volatility_inputs()
     exercise_date = st.date_input('Exercise date', min_value=datetime.today() + timedelta(days=1), value=datetime.today() + timedelta(days=365))
-    number_of_time_steps = st.slider('Number of time steps', 5000, 100000, 15000)
+    lattice_type = st.selectbox('Lattice', options=[lattice.value for lattice in LATTICE_TYPE])
+    # CRR error oscillates with number of steps, so only Leisen-Reimer and Black-Scholes smoothed lattices are extrapolated
+    richardson_extrapolation = st.checkbox('Richardson extrapolation', disabled=lattice_type not in BinomialTreeModel.EXTRAPOLATED_LATTICES,
+                                           help='Leisen-Reimer and Black-Scholes smoothed lattices only')
+    richardson_extrapolation = richardson_extrapolation and lattice_type in BinomialTreeModel.EXTRAPOLATED_LATTICES
+    number_of_time_steps = st.slider('Number of time steps', 25, 100000, 15000)
+    exercise_style = st.radio('Exercise style', options=[style.value for style in base.EXERCISE_STYLE])
+    binomial_request = (pricing_method, ticker, strike_price, risk_free_rate, sigma, volatility_estimator, volatility_window, exercise_date,
+                        lattice_type, richardson_extrapolation, number_of_time_steps, exercise_style)
 
     if st.button(f'Calculate option price for {ticker}'):
          # Getting data for selected ticker
-        data = get_historical_data(ticker)
+        data = fetch_historical_data(ticker)
         st.write(data.tail())
         Ticker.plot_data(data, ticker, 'Close')
         st.pyplot()
@@ -222,13 +408,20 @@ elif pricing_method == OPTION_PRICING_MODEL.BINOMIAL.value:
         # Formating simulation parameters
         spot_price = Ticker.get_last_price(data, 'Close') 
         risk_free_rate = risk_free_rate / 100
-        sigma = sigma / 100
+        sigma = estimate_sigma(data, sigma / 100, volatility_estimator, volatility_window)
         days_to_maturity = (exercise_date - datetime.now().date()).days
 
-        # Calculating option price
-        BOPM = BinomialTreeModel(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_time_steps)
-        call_option_price = BOPM._calculate_option_price('Call Option')
-        put_option_price = BOPM._calculate_option_price('Put Option')
+        # Calculating option price in background job
+        BOPM = BinomialTreeModel(spot_price, strike_price, days_to_maturity, risk_free_rate, sigma, number_of_time_steps, exercise_style,
+                                 lattice_type, richardson_extrapolation)
+        submit_job(binomial_request, binomial_job, BOPM)
+
+    job = session_job(binomial_request)
+    result = follow_job(job) if job is not None else None
+    if job is not None and job.done:
+        timing_panel(job.runs)
+    if result is not None:
+        call_option_price, put_option_price = result
 
         # Displaying call/put option price
         st.subheader(f'Call option price: {call_option_price}')
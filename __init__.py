@@ -5,8 +5,36 @@ Created on Fri Feb 24 14:37:59 2023
 @author: Gilberto
 """
 
-from BlackScholesModel import BlackScholesModel
-from MonteCarloSimulation import MonteCarloPricing
-from BinomialTreeModel import BinomialTreeModel
-from AmericanPricing import AmericanPricing
-from ticker import Ticker
\ No newline at end of file
+import importlib
+
+# Public names and modules defining them. Modules are imported on first attribute access (PEP 562),
+# so importing the package does not pull in every model and its third party dependencies.
+_LAZY_IMPORTS = {
+    'BlackScholesModel': 'BlackScholesModel',
+    'MonteCarloPricing': 'MonteCarloSimulation',
+    'BinomialTreeModel': 'BinomialTreeModel',
+    'AmericanPricing': 'AmericanPricing',
+    'ExoticPricing': 'ExoticPricing',
+    'FiniteDifferenceModel': 'FiniteDifferenceModel',
+    'FourierPricingModel': 'FourierPricingModel',
+    'Ticker': 'ticker',
+    'ImpliedVolatility': 'ImpliedVolatility',
+    'HistoricalVolatility': 'HistoricalVolatility',
+    'PricingCache': 'pricing_cache',
+    'Portfolio': 'portfolio',
+    'Instrumentation': 'instrumentation',
+}
+
+__all__ = list(_LAZY_IMPORTS)
+
+
+def __getattr__(name):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -5,21 +5,235 @@ Created on Fri Feb 24 14:30:50 2023
 @author: Gilberto
 """
 
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
+from functools import partial
 from abc import ABC, abstractclassmethod
 
+import numpy as np
+from scipy.special import ndtri
+
+from instrumentation import stage
+
 class OPTION_TYPE(Enum):
     CALL_OPTION = 'Call Option'
     PUT_OPTION = 'Put Option'
 
+class EXERCISE_STYLE(Enum):
+    EUROPEAN = 'European'
+    AMERICAN = 'American'
+
+class EXECUTOR(Enum):
+    THREAD_POOL = 'Thread pool'
+    PROCESS_POOL = 'Process pool'
+
+class PRICING_MODEL(Enum):
+    BLACK_SCHOLES = 'Black-Scholes'
+    BINOMIAL = 'Binomial'
+    MONTE_CARLO = 'Monte Carlo'
+    LSM = 'LSM'
+
 class OptionPricingModel():
     """Abstract class defining interface for option pricing models."""
 
+    # PricingCache used by _calculate_option_price and _cached_result, None disables caching
+    pricing_cache = None
+
     def _calculate_option_price(self, option_type):
-        """Calculates call/put option price according to the specified parameter."""
+        """
+        Calculates call/put option price according to the specified parameter, served from pricing_cache when set.
+        Runs as instrumentation stage named by the model class (see instrumentation.py).
+        """
+        with stage(type(self).__name__):
+            key = self._pricing_cache_key(option_type) if self.pricing_cache is not None else None
+            if key is None:
+                return self._evaluate_option_price(option_type)
+            return self.pricing_cache.get_or_calculate(key, lambda: self._evaluate_option_price(option_type))
+
+    def _pricing_cache_key(self, option_type):
+        """
+        Canonical cache key of the price: model class, option type (or entry point and arguments, see _cached_result)
+        and all scalar parameters of the model.
+        Simulation based models are cacheable only with an explicit integer seed, otherwise None is returned.
+        """
+        if hasattr(self, 'seed') and (isinstance(self.seed, bool) or not isinstance(self.seed, (int, np.integer))):
+            return None
+        parameters = sorted((name, value) for name, value in vars(self).items()
+                            if isinstance(value, (int, float, str, np.integer, np.floating)))
+        return self.pricing_cache.canonical_key(type(self).__name__, option_type, parameters)
+
+    def _cached_result(self, entry_point, arguments, calculate, decode=None):
+        """
+        Result of calculate() for model method other than the price of a single option (estimates, price ladders),
+        served from pricing_cache when set and the model is cacheable (see _pricing_cache_key).
+        entry_point: name of the method, arguments: its arguments, both are part of the cache key
+        decode: function rebuilding the result from its plain form kept in the cache (see PricingCache.get_or_calculate)
+        """
+        key = self._pricing_cache_key((entry_point, arguments)) if self.pricing_cache is not None else None
+        if key is None:
+            return calculate()
+        return self.pricing_cache.get_or_calculate(key, calculate, decode)
+
+    def _evaluate_option_price(self, option_type):
+        """Calculates call/put option price according to the specified parameter, without cache."""
         if option_type == OPTION_TYPE.CALL_OPTION.value:
             return self._calculate_call_option_price()
         elif option_type == OPTION_TYPE.PUT_OPTION.value:
             return self._calculate_put_option_price()
         else:
             return -1
+
+MonteCarloEstimate = namedtuple('MonteCarloEstimate', ['price', 'standard_error', 'confidence_interval', 'number_of_simulations', 'variance_reduction_factor'],
+                                defaults=[1.0])
+
+def _estimate_from_plain(plain):
+    """Rebuilds MonteCarloEstimate from its plain form kept in PricingCache."""
+    price, standard_error, confidence_interval, number_of_simulations, variance_reduction_factor = plain
+    return MonteCarloEstimate(price, standard_error, tuple(confidence_interval), number_of_simulations, variance_reduction_factor)
+
+class RunningStatistics():
+    """
+    Running mean and variance of a stream of samples, updated chunk by chunk.
+    Chunks are merged with Chan's parallel formula, so memory does not depend on number of samples.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, samples):
+        """Adds chunk of samples to the statistics."""
+        chunk = RunningStatistics()
+        chunk.count = len(samples)
+        if chunk.count == 0:
+            return self
+        chunk.mean = float(np.mean(samples))
+        chunk.m2 = float(np.sum((samples - chunk.mean) ** 2))
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """Merges statistics of another stream into this one."""
+        count = self.count + other.count
+        if count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance of the stream."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def standard_error(self):
+        """Standard error of the mean of the stream."""
+        return float(np.sqrt(self.variance / self.count)) if self.count > 0 else np.inf
+
+    def estimate(self, confidence_level=0.95):
+        """Returns mean of the stream as MonteCarloEstimate with two-sided confidence interval of specified level."""
+        half_width = float(ndtri(0.5 + 0.5 * confidence_level)) * self.standard_error
+        return MonteCarloEstimate(self.mean, self.standard_error, (self.mean - half_width, self.mean + half_width), self.count)
+
+def simulate_to_tolerance(sample_batch, absolute_tolerance=None, relative_tolerance=None, time_budget=None,
+                          batch_size=10000, max_simulations=10000000, confidence_level=0.95):
+    """
+    Keeps simulating batches of discounted payoffs until requested precision, time budget or simulation limit is reached.
+    sample_batch: function returning array of discounted payoff samples for given number of simulations
+    absolute_tolerance: target half width of the confidence interval
+    relative_tolerance: target half width of the confidence interval relative to the price
+    time_budget: wall-clock limit in seconds
+    batch_size: number of simulations added in each batch
+    max_simulations: hard limit on total number of simulations
+    confidence_level: level of the confidence interval used for the tolerance check
+
+    Returns MonteCarloEstimate of all simulated batches.
+    """
+    start = time.perf_counter()
+    statistics = RunningStatistics()
+    z = ndtri(0.5 + 0.5 * confidence_level)
+
+    with stage('simulation to tolerance') as instrumented_stage:
+        while statistics.count < max_simulations:
+            statistics.update(sample_batch(min(batch_size, max_simulations - statistics.count)))
+            if statistics.count < 2 * batch_size:
+                continue
+
+            half_width = z * statistics.standard_error
+            if absolute_tolerance is not None and half_width <= absolute_tolerance:
+                break
+            if relative_tolerance is not None and half_width <= relative_tolerance * abs(statistics.mean):
+                break
+            if time_budget is not None and time.perf_counter() - start >= time_budget:
+                break
+        instrumented_stage.record(iterations=statistics.count)
+
+    return statistics.estimate(confidence_level)
+
+# Sample function of the current pool worker process, set once by the pool initializer
+_worker_sample_block = None
+
+def _initialize_worker(sample_block):
+    global _worker_sample_block
+    _worker_sample_block = sample_block
+
+def _block_statistics(seed_sequence, number_of_simulations, sample_block=None):
+    """
+    Simulates one block with its own random generator and reduces its samples to RunningStatistics.
+    Instrumented as a run of the worker thread (or process) named 'simulation block'.
+    """
+    sample_block = sample_block or _worker_sample_block
+    with stage('simulation block') as instrumented_stage:
+        samples = sample_block(np.random.default_rng(seed_sequence), number_of_simulations)
+        instrumented_stage.record(iterations=number_of_simulations, nbytes=sum(values.nbytes for values in samples.values()))
+        return {key: RunningStatistics().update(values) for key, values in samples.items()}
+
+def simulate_in_parallel(sample_block, number_of_simulations, block_size=100000, seed=None, number_of_workers=None,
+                         executor=EXECUTOR.THREAD_POOL.value, progress=None):
+    """
+    Simulates number_of_simulations samples in blocks of fixed size distributed over a pool of workers.
+    sample_block: function (generator, number_of_simulations) returning dictionary of sample arrays, e.g. discounted payoffs by option type
+    block_size: number of simulations in one block
+    seed: seed of the SeedSequence from which independent generator of every block is spawned
+    number_of_workers: number of pool workers, defaults to number of processors
+    executor: 'Thread pool' (NumPy releases GIL in random generation and array operations) or 'Process pool'
+    Partition into blocks and random stream of every block depend only on seed and block_size, and partial statistics
+    are merged in block order, so results are bit-identical for any number of workers.
+    With process pool, sample_block has to be picklable (e.g. method of an instance), it is sent once to every worker.
+    progress: optional function progress(fraction, statistics) called after every merged block; raising an exception
+    from it cancels blocks which have not started yet
+
+    Returns dictionary of RunningStatistics with keys of sample_block results.
+    """
+    sizes = [min(block_size, number_of_simulations - start) for start in range(0, number_of_simulations, block_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(sizes))
+    number_of_workers = number_of_workers or os.cpu_count()
+
+    if executor == EXECUTOR.PROCESS_POOL.value:
+        pool = ProcessPoolExecutor(number_of_workers, initializer=_initialize_worker, initargs=(sample_block,))
+        block_statistics = _block_statistics
+    else:
+        pool = ThreadPoolExecutor(number_of_workers)
+        block_statistics = partial(_block_statistics, sample_block=sample_block)
+
+    statistics = {}
+    simulated = 0
+    with stage('parallel simulation') as instrumented_stage:
+        try:
+            # map returns results in submission order, which keeps the merge deterministic
+            for size, partial_statistics in zip(sizes, pool.map(block_statistics, seed_sequences, sizes)):
+                for key, block in partial_statistics.items():
+                    statistics.setdefault(key, RunningStatistics()).merge(block)
+                simulated += size
+                if progress is not None:
+                    progress(simulated / number_of_simulations, statistics)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            instrumented_stage.record(iterations=simulated)
+    return statistics
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line batch pricing of contract files.
+
+Contracts are read in chunks from a CSV or Parquet file with columns symbol, strike, expiry, type, style and model
+(optional columns spot, sigma and rate override market data). Every chunk is priced with the vectorized engines
+(Black-Scholes batch formula, one lattice per strike vector, one simulation per symbol and maturity, one LSM path set
+per symbol priced in bounded blocks of its strike/maturity pairs) and appended to the output file, so memory use depends
+on chunk size only. A first pass over symbol, expiry and model columns finds the longest LSM maturity of every symbol,
+so LSM path sets, and prices, do not depend on chunk size or row order.
+
+Usage: python batch_pricing.py contracts.csv results.parquet [--chunk-size 100000] [--rate 0.05] [--valuation-date 2024-01-31]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import argparse
+import datetime
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from functools import partial
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Local package imports
+from base import OPTION_TYPE, EXERCISE_STYLE, PRICING_MODEL
+from BlackScholesModel import BlackScholesModel
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from MonteCarloSimulation import MonteCarloPricing, SIMULATION_MODE
+from AmericanPricing import AmericanPricing
+from HistoricalVolatility import HistoricalVolatility, VOLATILITY_ESTIMATOR
+from ticker import MarketDataCache, DEFAULT_CACHE_DIRECTORY
+
+
+# Columns every contract file has to contain
+REQUIRED_COLUMNS = ['symbol', 'strike', 'expiry', 'type', 'style', 'model']
+
+# Accepted spellings of model names, compared lowercase without separators
+MODEL_ALIASES = {
+    'blackscholes': PRICING_MODEL.BLACK_SCHOLES, 'blackscholesmodel': PRICING_MODEL.BLACK_SCHOLES, 'bs': PRICING_MODEL.BLACK_SCHOLES,
+    'binomial': PRICING_MODEL.BINOMIAL, 'binomialmodel': PRICING_MODEL.BINOMIAL, 'binomialtree': PRICING_MODEL.BINOMIAL,
+    'montecarlo': PRICING_MODEL.MONTE_CARLO, 'montecarlosimulation': PRICING_MODEL.MONTE_CARLO, 'mc': PRICING_MODEL.MONTE_CARLO,
+    'lsm': PRICING_MODEL.LSM, 'americanoptionlsmmodel': PRICING_MODEL.LSM, 'leastsquaresmontecarlo': PRICING_MODEL.LSM,
+}
+
+ChunkTiming = namedtuple('ChunkTiming', ['chunk', 'contracts', 'seconds', 'contracts_per_second'])
+
+
+def read_contracts(path, chunk_size=100000, columns=None):
+    """
+    Yields dataframes of at most chunk_size contracts from CSV or Parquet file, without loading the whole file.
+    columns: optional list of columns to read (columns missing in the file are skipped), all columns by default
+    """
+    if path.lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        if columns is not None:
+            columns = [column for column in parquet_file.schema_arrow.names if column in columns]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=None if columns is None else lambda column: column in columns)
+
+
+class ResultWriter:
+    """
+    Appends priced chunks to CSV or Parquet file (selected by extension). Parquet chunks are written as row groups
+    with the schema of the first chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(('.parquet', '.pq'))
+        self._writer = None
+        self._schema = None
+        self._header = True
+
+    def write(self, chunk):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(self.path, mode='w' if self._header else 'a', header=self._header, index=False)
+            self._header = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class MarketInputs:
+    """
+    Spot prices and historical volatilities of symbols, taken from the market data cache once per symbol
+    and kept for the whole batch.
+    """
+
+    def __init__(self, cache=None, refresh=True, estimator=VOLATILITY_ESTIMATOR.YANG_ZHANG.value, window=21):
+        """
+        cache: MarketDataCache serving price histories, None requires spot and sigma columns in the contract file
+        refresh: if False, cached histories are used without contacting the data provider
+        estimator: VOLATILITY_ESTIMATOR value used for sigma
+        window: number of daily bars of the volatility estimate
+        """
+        self.cache = cache
+        self.refresh = refresh
+        self.estimator = estimator
+        self.window = window
+        self._inputs = {}
+
+    def get(self, symbol):
+        """Returns tuple (spot_price, sigma) of the symbol, raises exception when its history is not available."""
+        if symbol not in self._inputs:
+            try:
+                if self.cache is None:
+                    raise ValueError('No market data source, spot and sigma columns are required')
+                data = self.cache.get_history(symbol, self.refresh)
+                if len(data) == 0:
+                    raise ValueError(f'No data found for {symbol}')
+                sigma = HistoricalVolatility(data, symbol).latest(self.estimator, self.window).iloc[0]
+                self._inputs[symbol] = (float(data['Close'].iloc[-1]), float(sigma))
+            except Exception as e:
+                self._inputs[symbol] = e
+        if isinstance(self._inputs[symbol], Exception):
+            raise self._inputs[symbol]
+        return self._inputs[symbol]
+
+
+class BatchPricer:
+    """
+    Prices chunks of contracts, grouping them so every engine is called once per vector of strikes:
+    - Black-Scholes: whole chunk in one batch formula call (American calls equal European calls without dividends).
+    - Binomial: one lattice per symbol, maturity and exercise style for all its strikes.
+    - Monte Carlo: one terminal price simulation per symbol and maturity for all its strikes (European only).
+    - LSM: one path set per symbol for all its contracts, European or American, simulated up to the LSM horizon of the
+      symbol (see lsm_horizons). Only (strike, maturity) pairs of the contracts are priced, in blocks whose LSM cash flows
+      (paths x pairs) stay below max_ladder_elements.
+    Contracts which cannot be priced get NaN price and the reason in the error column.
+    """
+
+    def __init__(self, market_inputs, risk_free_rate=0.05, valuation_date=None, number_of_time_steps=500,
+                 lattice_type=LATTICE_TYPE.LEISEN_REIMER.value, number_of_simulations=100000, lsm_simulations=10000, seed=20,
+                 max_ladder_elements=2 ** 22):
+        """
+        market_inputs: MarketInputs supplying spot and sigma not given in the contract file
+        risk_free_rate: rate used when the contract file has no rate column
+        valuation_date: date maturities are counted from, defaults to today
+        number_of_time_steps: steps of binomial lattices
+        lattice_type: LATTICE_TYPE value of binomial lattices
+        number_of_simulations: simulations of Monte Carlo prices
+        lsm_simulations: simulated paths of LSM prices
+        seed: seed of random number generators, used by every simulation
+        max_ladder_elements: largest number of LSM cash flows (paths x strike/maturity pairs) calculated at once
+        """
+        self.market_inputs = market_inputs
+        self.risk_free_rate = risk_free_rate
+        self.valuation_date = pd.Timestamp(valuation_date if valuation_date is not None else datetime.date.today())
+        self.number_of_time_steps = number_of_time_steps
+        self.lattice_type = lattice_type
+        self.number_of_simulations = number_of_simulations
+        self.lsm_simulations = lsm_simulations
+        self.seed = seed
+        self.max_ladder_elements = max_ladder_elements
+
+    def lsm_horizons(self, chunks):
+        """
+        Returns dictionary of the longest LSM maturity in days of every symbol over chunks of contracts (dataframes with
+        at least symbol, expiry and model columns), used as horizon of its LSM path sets by price_chunk.
+        """
+        horizons = {}
+        for chunk in chunks:
+            missing = [column for column in ['symbol', 'expiry', 'model'] if column not in chunk.columns]
+            if missing:
+                raise ValueError(f'Contract file is missing columns {missing}')
+            days = self._days_to_maturity(chunk['expiry'])
+            lsm = (self._model_values(chunk['model']) == PRICING_MODEL.LSM.value) & (days >= 1)
+            for symbol, horizon in days[lsm].groupby(chunk.loc[lsm, 'symbol'].astype(str).str.upper()).max().items():
+                horizons[symbol] = max(horizons.get(symbol, 0), int(horizon))
+        return horizons
+
+    def price_chunk(self, chunk, lsm_horizons=None):
+        """
+        Returns chunk with added columns spot, sigma, rate, days_to_maturity, price and error.
+        lsm_horizons: dictionary of LSM path horizons in days by symbol (see lsm_horizons), symbols missing in it are
+        simulated up to their longest LSM maturity in the chunk, so their prices depend on the other contracts of the chunk
+        """
+        missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+        if missing:
+            raise ValueError(f'Contract file is missing columns {missing}')
+        chunk = chunk.reset_index(drop=True)
+        contracts = self._normalize(chunk)
+        price = np.full(len(chunk), np.nan)
+
+        engines = {PRICING_MODEL.BLACK_SCHOLES.value: self._price_black_scholes, PRICING_MODEL.BINOMIAL.value: self._price_binomial,
+                   PRICING_MODEL.MONTE_CARLO.value: self._price_monte_carlo,
+                   PRICING_MODEL.LSM.value: partial(self._price_lsm, lsm_horizons=lsm_horizons or {})}
+        for model, group in contracts[contracts['error'] == ''].groupby('model', sort=False):
+            price_group = engines[model]
+            for _, subgroup in group.groupby(self._group_columns(model), sort=False):
+                try:
+                    price[subgroup.index] = price_group(subgroup)
+                except Exception as e:
+                    contracts.loc[subgroup.index, 'error'] = str(e)
+
+        unpriced = np.isnan(price) & (contracts['error'] == '')
+        contracts.loc[unpriced, 'error'] = 'Model has no price for this contract'
+        for column in ['spot', 'sigma', 'rate', 'days_to_maturity']:
+            chunk[column] = contracts[column]
+        chunk['price'] = price
+        chunk['error'] = contracts['error']
+        return chunk
+
+    def _normalize(self, chunk):
+        """Returns dataframe of parsed contract parameters with market inputs and error of contracts which cannot be priced."""
+        contracts = pd.DataFrame({'symbol': chunk['symbol'].astype(str).str.upper(),
+                                  'strike': pd.to_numeric(chunk['strike'], errors='coerce')})
+        contracts['error'] = ''
+
+        contracts['days_to_maturity'] = self._days_to_maturity(chunk['expiry'])
+        contracts['type'] = chunk['type'].astype(str).str.strip().str.lower().map(
+            lambda value: OPTION_TYPE.CALL_OPTION.value if value.startswith('c') else OPTION_TYPE.PUT_OPTION.value if value.startswith('p') else None)
+        style = chunk['style'].astype(str).str.strip().str.capitalize()
+        contracts['style'] = style.where(style.isin([exercise_style.value for exercise_style in EXERCISE_STYLE]))
+        contracts['model'] = self._model_values(chunk['model'])
+
+        for column in ['spot', 'sigma', 'rate']:
+            contracts[column] = pd.to_numeric(chunk[column], errors='coerce') if column in chunk.columns else np.nan
+        contracts['rate'] = contracts['rate'].fillna(self.risk_free_rate)
+
+        for column, error in [('strike', 'Invalid strike'), ('days_to_maturity', 'Invalid expiry'), ('type', 'Unknown option type'),
+                              ('style', 'Unknown exercise style'), ('model', 'Unknown model')]:
+            invalid = contracts[column].isna() & (contracts['error'] == '')
+            contracts.loc[invalid, 'error'] = error
+        contracts.loc[(contracts['days_to_maturity'] < 1) & (contracts['error'] == ''), 'error'] = 'Contract expired'
+
+        american = contracts['style'] == EXERCISE_STYLE.AMERICAN.value
+        for model, unsupported, error in [
+                (PRICING_MODEL.BLACK_SCHOLES, american & (contracts['type'] == OPTION_TYPE.PUT_OPTION.value), 'Black-Scholes model has no American put price'),
+                (PRICING_MODEL.MONTE_CARLO, american, 'Monte Carlo model prices European contracts only')]:
+            rows = unsupported & (contracts['model'] == model.value) & (contracts['error'] == '')
+            contracts.loc[rows, 'error'] = f'{error}, use LSM or Binomial model'
+
+        # Market data only for symbols of contracts missing spot or sigma
+        needs_market_data = (contracts['spot'].isna() | contracts['sigma'].isna()) & (contracts['error'] == '')
+        for symbol in contracts.loc[needs_market_data, 'symbol'].unique():
+            rows = needs_market_data & (contracts['symbol'] == symbol)
+            try:
+                spot, sigma = self.market_inputs.get(symbol)
+            except Exception as e:
+                contracts.loc[rows, 'error'] = f'Market data: {e}'
+                continue
+            contracts.loc[rows, 'spot'] = contracts.loc[rows, 'spot'].fillna(spot)
+            contracts.loc[rows, 'sigma'] = contracts.loc[rows, 'sigma'].fillna(sigma)
+
+        contracts['days_to_maturity'] = contracts['days_to_maturity'].fillna(0).astype(int)
+        return contracts
+
+    def _days_to_maturity(self, expiry):
+        """Days from valuation date to expiry dates, NaN for dates which cannot be parsed."""
+        expiry = pd.to_datetime(expiry, errors='coerce')
+        return (expiry.dt.normalize() - self.valuation_date.normalize()).dt.days
+
+    @staticmethod
+    def _model_values(models):
+        """PRICING_MODEL values of model names, None for unknown names."""
+        return models.astype(str).map(lambda value: getattr(MODEL_ALIASES.get(re.sub(r'[^a-z]', '', value.lower())), 'value', None))
+
+    @staticmethod
+    def _group_columns(model):
+        """Columns of contracts sharing one engine call of the model."""
+        if model == PRICING_MODEL.BLACK_SCHOLES.value:
+            return ['model']
+        if model == PRICING_MODEL.BINOMIAL.value:
+            return ['symbol', 'spot', 'sigma', 'rate', 'days_to_maturity', 'style']
+        if model == PRICING_MODEL.MONTE_CARLO.value:
+            return ['symbol', 'spot', 'sigma', 'rate', 'days_to_maturity']
+        return ['symbol', 'spot', 'sigma', 'rate']
+
+    @staticmethod
+    def _select(contracts, call_prices, put_prices):
+        return np.where(contracts['type'] == OPTION_TYPE.CALL_OPTION.value, call_prices, put_prices)
+
+    def _price_black_scholes(self, contracts):
+        call_prices, put_prices = BlackScholesModel.calculate_option_prices(
+            contracts['spot'].to_numpy(), contracts['strike'].to_numpy(), contracts['days_to_maturity'].to_numpy(),
+            contracts['rate'].to_numpy(), contracts['sigma'].to_numpy())
+        return self._select(contracts, call_prices, put_prices)
+
+    def _price_binomial(self, contracts):
+        first = contracts.iloc[0]
+        BOPM = BinomialTreeModel(first['spot'], first['strike'], first['days_to_maturity'], first['rate'], first['sigma'],
+                                 self.number_of_time_steps, first['style'], self.lattice_type)
+        call_prices, put_prices = BOPM.calculate_option_prices(contracts['strike'].to_numpy())
+        return self._select(contracts, call_prices, put_prices)
+
+    def _price_monte_carlo(self, contracts):
+        """
+        Prices contracts of one symbol and maturity from one simulation. Simulated terminal prices S_T are sorted once,
+        so for every strike K: E[max(S_T - K, 0)] = (sum of S_T above K - K * count above K) / N, and put accordingly below K.
+        """
+        first = contracts.iloc[0]
+        MC = MonteCarloPricing(first['spot'], first['strike'], first['days_to_maturity'], first['rate'], first['sigma'],
+                               self.number_of_simulations, SIMULATION_MODE.TERMINAL.value, seed=self.seed)
+        MC.simulate_prices()
+        S_T = np.sort(MC.simulation_results_S_T)
+        cumulative = np.concatenate([[0.0], np.cumsum(S_T)])
+
+        strikes = contracts['strike'].to_numpy()
+        below = np.searchsorted(S_T, strikes)
+        discount = np.exp(-MC.r * MC.T) / S_T.size
+        call_prices = discount * (cumulative[-1] - cumulative[below] - strikes * (S_T.size - below))
+        put_prices = discount * (strikes * below - cumulative[below])
+        return self._select(contracts, call_prices, put_prices)
+
+    def _price_lsm(self, contracts, lsm_horizons):
+        """
+        Prices contracts of one symbol from one path set, simulated up to the horizon of the symbol in lsm_horizons (or
+        the longest maturity of the contracts, if longer or missing). Only (strike, maturity) pairs of the contracts are
+        priced, sorted by maturity in blocks whose LSM cash flows (paths x pairs) stay below max_ladder_elements. Each
+        block is one backward induction over the paths up to its longest maturity.
+        """
+        first = contracts.iloc[0]
+        pairs, pair_index = np.unique(contracts[['days_to_maturity', 'strike']].to_numpy(), axis=0, return_inverse=True)
+        pair_index = pair_index.ravel()
+        maturities, strikes = pairs[:, 0].astype(int), pairs[:, 1]
+        horizon = max(lsm_horizons.get(first['symbol'], 0), int(maturities.max()))
+        AP = AmericanPricing(first['spot'], strikes[0], horizon, first['rate'], first['sigma'], self.lsm_simulations, self.seed)
+
+        keys = ['american_call', 'american_put', 'european_call', 'european_put']
+        prices = {key: np.empty(pairs.shape[0]) for key in keys}
+        # Every pair has a call and a put column
+        block_size = max(1, self.max_ladder_elements // (2 * self.lsm_simulations))
+        for start in range(0, pairs.shape[0], block_size):
+            block = AP.calculate_option_price_pairs(strikes[start:start + block_size], maturities[start:start + block_size])
+            for key in keys:
+                prices[key][start:start + block_size] = block[key]
+
+        american = (contracts['style'] == EXERCISE_STYLE.AMERICAN.value).to_numpy()
+        call = (contracts['type'] == OPTION_TYPE.CALL_OPTION.value).to_numpy()
+        prices = {key: prices[key][pair_index] for key in keys}
+        return np.select([american & call, american & ~call, call],
+                         [prices['american_call'], prices['american_put'], prices['european_call']], prices['european_put'])
+
+
+def run(input_path, output_path, pricer, chunk_size=100000, log=None):
+    """
+    Prices contracts of input file chunk by chunk, appending results to output file. LSM horizons of all symbols are
+    found in a first pass over the symbol, expiry and model columns of the file.
+    log: optional function receiving ChunkTiming of every chunk
+    Returns list of ChunkTiming.
+    """
+    lsm_horizons = pricer.lsm_horizons(read_contracts(input_path, chunk_size, ['symbol', 'expiry', 'model']))
+    timings = []
+    with ResultWriter(output_path) as writer:
+        for number, chunk in enumerate(read_contracts(input_path, chunk_size)):
+            start = time.perf_counter()
+            writer.write(pricer.price_chunk(chunk, lsm_horizons))
+            seconds = time.perf_counter() - start
+            timings.append(ChunkTiming(number, len(chunk), seconds, len(chunk) / seconds if seconds > 0 else float('inf')))
+            if log is not None:
+                log(timings[-1])
+    return timings
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Prices contract file (CSV or Parquet) chunk by chunk.')
+    parser.add_argument('input', help='contract file with columns ' + ', '.join(REQUIRED_COLUMNS) + ' (optional spot, sigma, rate)')
+    parser.add_argument('output', help='result file, .parquet for Parquet, CSV otherwise')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='contracts priced at once')
+    parser.add_argument('--rate', type=float, default=0.05, help='risk-free rate of contracts without rate column')
+    parser.add_argument('--valuation-date', help='date maturities are counted from (YYYY-MM-DD), defaults to today')
+    parser.add_argument('--market-data', default=DEFAULT_CACHE_DIRECTORY, help='market data cache directory')
+    parser.add_argument('--no-refresh', action='store_true', help='use cached market data without contacting the data provider')
+    parser.add_argument('--volatility-estimator', default=VOLATILITY_ESTIMATOR.YANG_ZHANG.value,
+                        choices=[estimator.value for estimator in VOLATILITY_ESTIMATOR])
+    parser.add_argument('--volatility-window', type=int, default=21, help='daily bars of the volatility estimate')
+    parser.add_argument('--steps', type=int, default=500, help='time steps of binomial lattices')
+    parser.add_argument('--lattice', default=LATTICE_TYPE.LEISEN_REIMER.value, choices=[lattice.value for lattice in LATTICE_TYPE])
+    parser.add_argument('--simulations', type=int, default=100000, help='simulations of Monte Carlo prices')
+    parser.add_argument('--lsm-simulations', type=int, default=10000, help='simulated paths of LSM prices')
+    parser.add_argument('--seed', type=int, default=20)
+    parser.add_argument('--max-ladder-elements', type=int, default=2 ** 22,
+                        help='largest number of LSM cash flows (paths x strike/maturity pairs) calculated at once')
+    arguments = parser.parse_args(arguments)
+
+    market_inputs = MarketInputs(MarketDataCache(arguments.market_data), not arguments.no_refresh, arguments.volatility_estimator,
+                                 arguments.volatility_window)
+    pricer = BatchPricer(market_inputs, arguments.rate, arguments.valuation_date, arguments.steps, arguments.lattice,
+                         arguments.simulations, arguments.lsm_simulations, arguments.seed, arguments.max_ladder_elements)
+
+    def log(timing):
+        print(f'chunk {timing.chunk}: {timing.contracts} contracts in {timing.seconds:.3f} s ({timing.contracts_per_second:,.0f} contracts/s)',
+              file=sys.stderr)
+
+    start = time.perf_counter()
+    timings = run(arguments.input, arguments.output, pricer, arguments.chunk_size, log)
+    contracts = sum(timing.contracts for timing in timings)
+    print(f'{contracts} contracts in {len(timings)} chunks, {time.perf_counter() - start:.3f} s -> {os.path.abspath(arguments.output)}',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of batch pricing of contract files, with LSM contracts at scattered strikes and maturities.
+
+LSM contracts of one symbol are priced as a listed-style chain (every strike at every maturity) and as the same number
+of contracts at scattered strikes and maturities, where almost every contract has its own strike and maturity.
+LSM work grows with the number of (strike, maturity) pairs, so both take about the same time. A mixed file of all
+models on several symbols is priced through the CSV reader and writer. Contracts per second of every case are reported.
+A file of scattered LSM contracts is priced with several chunk sizes and in reversed row order.
+Fails (exit code 1) when scattered contracts take more than SCATTERED_SLOWDOWN times as long as the chain, when their
+prices differ from the strike/maturity ladder of the same path set by more than TOLERANCE, or when LSM prices of the
+file depend on chunk size or row order.
+
+Usage: python benchmarks/batch_throughput.py [number_of_mixed_contracts]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import tempfile
+import time
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from batch_pricing import BatchPricer, MarketInputs, run
+from AmericanPricing import AmericanPricing
+from base import PRICING_MODEL
+
+
+VALUATION_DATE = pd.Timestamp('2024-01-02')
+SPOT_PRICES = {'AAA': 100.0, 'BBB': 45.0, 'CCC': 250.0, 'DDD': 12.0}
+SIGMAS = {'AAA': 0.2, 'BBB': 0.35, 'CCC': 0.25, 'DDD': 0.5}
+RISK_FREE_RATE = 0.05
+LSM_SIMULATIONS = 10000
+CHAIN_STRIKES = 20
+CHAIN_MATURITIES = [7, 14, 21, 30, 45, 60, 91, 121, 152, 182, 212, 243, 273, 304, 334, 365]
+MIXED_CONTRACTS = 20000
+MIXED_MODEL_SHARES = {PRICING_MODEL.BLACK_SCHOLES: 0.9, PRICING_MODEL.BINOMIAL: 0.05, PRICING_MODEL.MONTE_CARLO: 0.04,
+                      PRICING_MODEL.LSM: 0.01}
+SAMPLE_SIZE = 20
+CHUNKING_CONTRACTS = 60
+CHUNK_SIZES = [CHUNKING_CONTRACTS, 7]
+SEED = 20
+
+SCATTERED_SLOWDOWN = 3
+TOLERANCE = 1e-9
+
+
+def contracts(symbols, strikes, days, types, styles, models):
+    """Returns contract dataframe with spot and sigma columns, so no market data is needed."""
+    symbols = np.broadcast_to(np.asarray(symbols, dtype=object), np.shape(strikes))
+    return pd.DataFrame({'symbol': symbols, 'strike': strikes, 'expiry': VALUATION_DATE + pd.to_timedelta(days, unit='D'),
+                         'type': types, 'style': styles, 'model': models,
+                         'spot': [SPOT_PRICES[symbol] for symbol in symbols], 'sigma': [SIGMAS[symbol] for symbol in symbols]})
+
+
+def lsm_chain(rng):
+    """American LSM contracts of one symbol: calls and puts of every strike at every maturity."""
+    strikes, days = np.meshgrid(np.linspace(70, 130, CHAIN_STRIKES), CHAIN_MATURITIES)
+    size = strikes.size
+    return contracts('AAA', strikes.ravel(), days.ravel(), rng.choice(['call', 'put'], size), 'American', 'LSM')
+
+
+def lsm_scattered(rng, size):
+    """American LSM contracts of one symbol at random strikes and maturities."""
+    return contracts('AAA', np.round(rng.uniform(70, 130, size), 2), rng.integers(1, max(CHAIN_MATURITIES) + 1, size),
+                     rng.choice(['call', 'put'], size), 'American', 'LSM')
+
+
+def mixed(rng, size):
+    """Contracts of every model on all symbols, models drawn with MIXED_MODEL_SHARES."""
+    models = rng.choice([model.value for model in MIXED_MODEL_SHARES], size, p=list(MIXED_MODEL_SHARES.values()))
+    symbols = rng.choice(list(SPOT_PRICES), size)
+    spots = np.array([SPOT_PRICES[symbol] for symbol in symbols])
+    styles = np.where(models == PRICING_MODEL.MONTE_CARLO.value, 'European', rng.choice(['European', 'American'], size))
+    types = np.where((models == PRICING_MODEL.BLACK_SCHOLES.value) & (styles == 'American'), 'call', rng.choice(['call', 'put'], size))
+    return contracts(symbols, np.round(spots * rng.uniform(0.7, 1.3, size), 2), rng.choice(CHAIN_MATURITIES, size), types, styles, models)
+
+
+def timed(pricer, chunk):
+    """Returns priced chunk, its LSM horizons and its runtime."""
+    start = time.perf_counter()
+    lsm_horizons = pricer.lsm_horizons([chunk])
+    priced = pricer.price_chunk(chunk, lsm_horizons)
+    return priced, lsm_horizons, time.perf_counter() - start
+
+
+def ladder_difference(priced, horizon, sample_size=SAMPLE_SIZE, seed=SEED):
+    """
+    Largest difference of a sample of priced LSM contracts from calculate_option_price_ladder of the path set of
+    their symbol (same seed and horizon).
+    """
+    days = priced['days_to_maturity'].to_numpy()
+    sample = np.random.default_rng(seed).choice(len(priced), min(sample_size, len(priced)), replace=False)
+    AP = AmericanPricing(SPOT_PRICES['AAA'], 100, horizon, RISK_FREE_RATE, SIGMAS['AAA'], LSM_SIMULATIONS, SEED)
+    difference = 0.0
+    for row in sample:
+        ladder = AP.calculate_option_price_ladder(priced['strike'].iloc[row], days[row])
+        option = 'call' if priced['type'].iloc[row] == 'call' else 'put'
+        difference = max(difference, abs(ladder[f'american_{option}'] - priced['price'].iloc[row]))
+    return difference
+
+
+def chunking_difference(pricer, contracts, directory, chunk_sizes=CHUNK_SIZES):
+    """
+    Largest LSM price difference of contracts written to a CSV file and priced with every chunk size, and with the
+    smallest chunk size from the file in reversed row order.
+    """
+    contracts = contracts.assign(contract=np.arange(len(contracts)))
+    prices = []
+    for chunk_size, rows in [(chunk_size, contracts) for chunk_size in chunk_sizes] + [(min(chunk_sizes), contracts[::-1])]:
+        input_path, output_path = os.path.join(directory, 'lsm.csv'), os.path.join(directory, 'lsm_results.csv')
+        rows.to_csv(input_path, index=False)
+        run(input_path, output_path, pricer, chunk_size)
+        prices.append(pd.read_csv(output_path).sort_values('contract')['price'].to_numpy())
+    return max(np.max(np.abs(price - prices[0])) for price in prices)
+
+
+if __name__ == '__main__':
+    number_of_mixed_contracts = int(sys.argv[1]) if len(sys.argv) > 1 else MIXED_CONTRACTS
+    rng = np.random.default_rng(SEED)
+    pricer = BatchPricer(MarketInputs(None), RISK_FREE_RATE, VALUATION_DATE, lsm_simulations=LSM_SIMULATIONS, seed=SEED)
+
+    chain = lsm_chain(rng)
+    _, _, chain_runtime = timed(pricer, chain)
+    scattered, scattered_horizons, scattered_runtime = timed(pricer, lsm_scattered(rng, len(chain)))
+    for name, size, runtime in [('LSM chain', len(chain), chain_runtime), ('LSM scattered', len(scattered), scattered_runtime)]:
+        print(f'{name:<14} {size:>7} contracts  {runtime:8.3f} s  {size / runtime:10,.0f} contracts/s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = os.path.join(directory, 'contracts.csv')
+        mixed(rng, number_of_mixed_contracts).to_csv(input_path, index=False)
+        start = time.perf_counter()
+        timings = run(input_path, os.path.join(directory, 'results.csv'), pricer, chunk_size=max(1, number_of_mixed_contracts // 4))
+        runtime = time.perf_counter() - start
+        print(f'{"mixed file":<14} {number_of_mixed_contracts:>7} contracts  {runtime:8.3f} s  {number_of_mixed_contracts / runtime:10,.0f} contracts/s'
+              f'  ({len(timings)} chunks)')
+        chunking = chunking_difference(pricer, lsm_scattered(rng, CHUNKING_CONTRACTS), directory)
+    print(f'largest LSM price difference between chunk sizes {CHUNK_SIZES} and reversed rows: {chunking:.2e}')
+
+    errors = scattered['error'] != ''
+    difference = ladder_difference(scattered, scattered_horizons['AAA'])
+    slowdown = scattered_runtime / chain_runtime
+    print(f'scattered / chain runtime {slowdown:.2f}, largest difference from ladder prices {difference:.2e}, '
+          f'{errors.sum()} contracts not priced')
+    ok = slowdown <= SCATTERED_SLOWDOWN and difference <= TOLERANCE and chunking == 0 and not errors.any()
+    print('ok' if ok else 'FAIL')
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Error-vs-steps report of BinomialTreeModel lattices against Black-Scholes closed form. Richardson extrapolation is
+reported for the lattices of BinomialTreeModel.EXTRAPOLATED_LATTICES, CRR rejects it.
+Fails (exit code 1) when Richardson extrapolated prices of 1 and 2 step lattices are not finite, when 1 step prices,
+which have no coarser lattice to extrapolate with, differ from prices without extrapolation, when extrapolation
+makes the error of a lattice larger at any number of steps, or when CRR lattice accepts Richardson extrapolation.
+
+Usage: python benchmarks/binomial_convergence.py
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import itertools
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from BlackScholesModel import BlackScholesModel
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from base import EXERCISE_STYLE
+
+
+SPOT_PRICE = 100
+STRIKE_PRICES = np.linspace(70, 130, 13)
+DAYS_TO_MATURITY = 365
+RISK_FREE_RATE = 0.05
+SIGMA = 0.2
+NUMBER_OF_TIME_STEPS = [25, 51, 101, 201, 401, 801, 1601, 3201, 15000]
+SMALLEST_NUMBER_OF_TIME_STEPS = [1, 2]
+
+
+def richardson_configurations():
+    """Yields (lattice_type, richardson_extrapolation) of every lattice, with extrapolation where it is available."""
+    for lattice_type in LATTICE_TYPE:
+        yield lattice_type, False
+        if lattice_type.value in BinomialTreeModel.EXTRAPOLATED_LATTICES:
+            yield lattice_type, True
+
+
+def convergence_report(number_of_time_steps=NUMBER_OF_TIME_STEPS, strike_prices=STRIKE_PRICES):
+    """
+    Prices European calls/puts for a strike ladder with every lattice configuration and number of steps.
+    Error is the largest absolute deviation from Black-Scholes price over the ladder. Runtime is measured
+    for the same ladder priced as American options, which requires full backward induction.
+    """
+    call_prices, put_prices = BlackScholesModel.calculate_option_prices(SPOT_PRICE, strike_prices, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA)
+    rows = []
+    for lattice_type, richardson_extrapolation in richardson_configurations():
+        for steps in number_of_time_steps:
+            european = BinomialTreeModel(SPOT_PRICE, SPOT_PRICE, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, steps,
+                                         EXERCISE_STYLE.EUROPEAN.value, lattice_type.value, richardson_extrapolation)
+            call_lattice, put_lattice = european.calculate_option_prices(strike_prices)
+
+            american = BinomialTreeModel(SPOT_PRICE, SPOT_PRICE, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, steps,
+                                         EXERCISE_STYLE.AMERICAN.value, lattice_type.value, richardson_extrapolation)
+            start = time.perf_counter()
+            american.calculate_option_prices(strike_prices)
+            american_runtime = time.perf_counter() - start
+
+            rows.append({
+                'lattice': lattice_type.value,
+                'richardson': richardson_extrapolation,
+                'steps': steps,
+                'max_call_error': np.max(np.abs(call_lattice - call_prices)),
+                'max_put_error': np.max(np.abs(put_lattice - put_prices)),
+                'american_runtime_s': american_runtime,
+            })
+    return pd.DataFrame(rows)
+
+
+def smallest_step_count_failures(number_of_time_steps=SMALLEST_NUMBER_OF_TIME_STEPS, strike_prices=STRIKE_PRICES):
+    """
+    Returns list of (lattice, exercise style, steps) whose Richardson extrapolated prices are not finite, or differ
+    from prices of the same lattice without extrapolation for the smallest step count.
+    """
+    failures = []
+    extrapolated_lattices = [lattice_type for lattice_type, richardson_extrapolation in richardson_configurations() if richardson_extrapolation]
+    for lattice_type, exercise_style, steps in itertools.product(extrapolated_lattices, EXERCISE_STYLE, number_of_time_steps):
+        prices = [BinomialTreeModel(SPOT_PRICE, SPOT_PRICE, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, steps, exercise_style.value,
+                                    lattice_type.value, richardson_extrapolation).calculate_option_prices(strike_prices)
+                  for richardson_extrapolation in [False, True]]
+        plain, extrapolated = np.array(prices[0]), np.array(prices[1])
+        if not np.all(np.isfinite(extrapolated)) or (steps == min(number_of_time_steps) and not np.array_equal(plain, extrapolated)):
+            failures.append((lattice_type.value, exercise_style.value, steps))
+    return failures
+
+
+def extrapolation_regressions(report):
+    """Returns list of (lattice, steps) whose largest call or put error is larger with Richardson extrapolation than without."""
+    errors = report.set_index(['lattice', 'steps', 'richardson'])[['max_call_error', 'max_put_error']].max(axis=1).unstack()
+    errors = errors.dropna()
+    return list(errors.index[errors[True] > errors[False]])
+
+
+def crr_extrapolation_rejected():
+    """Returns True if CRR lattice with Richardson extrapolation raises ValueError."""
+    try:
+        BinomialTreeModel(SPOT_PRICE, SPOT_PRICE, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, 101, EXERCISE_STYLE.EUROPEAN.value,
+                          LATTICE_TYPE.COX_ROSS_RUBINSTEIN.value, True)
+    except ValueError:
+        return True
+    return False
+
+
+if __name__ == '__main__':
+    report = convergence_report()
+    with pd.option_context('display.max_rows', None, 'display.width', 120):
+        print(report.to_string(index=False, float_format=lambda x: f'{x:.3e}'))
+
+    # Smallest number of steps reaching accuracy of 15000 step CRR lattice
+    target = report[(report['lattice'] == LATTICE_TYPE.COX_ROSS_RUBINSTEIN.value) & ~report['richardson'] & (report['steps'] == 15000)]['max_call_error'].iloc[0]
+    print(f'\nSteps needed to match 15000-step CRR error ({target:.3e}):')
+    for (lattice, richardson), group in report.groupby(['lattice', 'richardson']):
+        matching = group[group['max_call_error'] <= target]
+        if len(matching) == 0:
+            print(f'{lattice:<24} richardson={str(richardson):<5} not reached')
+            continue
+        first = matching.iloc[0]
+        print(f'{lattice:<24} richardson={str(richardson):<5} steps={first["steps"]}  american ladder runtime={first["american_runtime_s"]:.4f}s')
+
+    failures = smallest_step_count_failures()
+    for lattice, exercise_style, steps in failures:
+        print(f'FAIL {lattice} {exercise_style} steps={steps}: Richardson extrapolation is not finite or differs from plain lattice')
+    print(f'\nRichardson extrapolation of {SMALLEST_NUMBER_OF_TIME_STEPS} step lattices: {"FAIL" if failures else "ok"}')
+    regressions = extrapolation_regressions(report)
+    for lattice, steps in regressions:
+        print(f'FAIL {lattice} steps={steps}: Richardson extrapolation increases the error')
+    print(f'Richardson extrapolation reduces the error of every extrapolated lattice: {"FAIL" if regressions else "ok"}')
+    rejected = crr_extrapolation_rejected()
+    print(f'Richardson extrapolation of CRR lattice rejected: {"ok" if rejected else "FAIL"}')
+    sys.exit(1 if failures or regressions or not rejected else 0)
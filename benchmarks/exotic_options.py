@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and cost of coarse-step path-dependent Monte Carlo against daily stepping.
+
+Continuously monitored barrier and floating strike lookback options have closed form prices (Reiner-Rubinstein,
+Goldman-Sosin-Gatto), geometric Asian options too. Every contract is priced:
+- on COARSE_STEPS dates with Brownian bridge correction (ExoticPricing default),
+- with one step per day and monitoring on the simulated days only, as daily stepping of MonteCarloPricing would.
+Reports price error in standard errors, runtime and speedup, together with the variance reduction of the
+geometric control variate of arithmetic Asian options. Fails (exit code 1) when a coarse-step price is further than
+MAX_STANDARD_ERRORS standard errors from the closed form.
+
+Usage: python benchmarks/exotic_options.py [number_of_simulations]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+from scipy.special import ndtr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from ExoticPricing import ExoticPricing, EXOTIC_PAYOFF
+from BlackScholesModel import BlackScholesModel
+from base import OPTION_TYPE
+
+
+SPOT_PRICE = 100
+STRIKE_PRICE = 100
+DAYS_TO_MATURITY = [365, 1095]
+RISK_FREE_RATE = 0.05
+SIGMA = 0.2
+DOWN_BARRIER = 90
+UP_BARRIER = 110
+COARSE_STEPS = 8
+NUMBER_OF_SIMULATIONS = 200000
+SEED = 20
+
+MAX_STANDARD_ERRORS = 4
+
+
+def barrier_parameters(days, barrier):
+    """Returns (T, lambda, y, (B/S)^(2 lambda)) terms shared by barrier formulas."""
+    T = days / 365
+    lam = (RISK_FREE_RATE + 0.5 * SIGMA ** 2) / SIGMA ** 2
+    y = np.log(barrier ** 2 / (SPOT_PRICE * STRIKE_PRICE)) / (SIGMA * np.sqrt(T)) + lam * SIGMA * np.sqrt(T)
+    return T, lam, y, (barrier / SPOT_PRICE) ** (2 * lam)
+
+
+def down_and_in_call(days, barrier):
+    """Closed form down-and-in call with barrier below strike."""
+    T, lam, y, power = barrier_parameters(days, barrier)
+    return (SPOT_PRICE * power * ndtr(y) - STRIKE_PRICE * np.exp(-RISK_FREE_RATE * T) * power * (SPOT_PRICE / barrier) ** 2
+            * ndtr(y - SIGMA * np.sqrt(T)))
+
+
+def up_and_in_put(days, barrier):
+    """Closed form up-and-in put with barrier above strike."""
+    T, lam, y, power = barrier_parameters(days, barrier)
+    return (-SPOT_PRICE * power * ndtr(-y) + STRIKE_PRICE * np.exp(-RISK_FREE_RATE * T) * power * (SPOT_PRICE / barrier) ** 2
+            * ndtr(-y + SIGMA * np.sqrt(T)))
+
+
+def floating_lookback(days):
+    """Closed form floating strike lookback call and put started today (running minimum and maximum equal to spot)."""
+    T = days / 365
+    r, sigma, sqrt_T = RISK_FREE_RATE, SIGMA, np.sqrt(days / 365)
+    ratio = sigma ** 2 / (2 * r)
+    a1 = (r + 0.5 * sigma ** 2) * sqrt_T / sigma
+    a2, a3 = a1 - sigma * sqrt_T, (-r + 0.5 * sigma ** 2) * sqrt_T / sigma
+    call = SPOT_PRICE * ndtr(a1) - SPOT_PRICE * ratio * ndtr(-a1) - SPOT_PRICE * np.exp(-r * T) * (ndtr(a2) - ratio * ndtr(-a3))
+    b1 = (-r + 0.5 * sigma ** 2) * sqrt_T / sigma
+    b2, b3 = b1 - sigma * sqrt_T, (r - 0.5 * sigma ** 2) * sqrt_T / sigma
+    put = SPOT_PRICE * np.exp(-r * T) * (ndtr(b1) - ratio * ndtr(-b3)) + SPOT_PRICE * ratio * ndtr(-b2) - SPOT_PRICE * ndtr(b2)
+    return call, put
+
+
+def contracts(days):
+    """Yields (name, exotic_payoff, barrier, option_type, reference price or None) for a maturity."""
+    call, put = BlackScholesModel.calculate_option_prices(SPOT_PRICE, STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA)
+    down_in = down_and_in_call(days, DOWN_BARRIER)
+    up_in = up_and_in_put(days, UP_BARRIER)
+    lookback_call, lookback_put = floating_lookback(days)
+    geometric = ExoticPricing(SPOT_PRICE, STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA, 1, EXOTIC_PAYOFF.GEOMETRIC_ASIAN.value,
+                              number_of_time_steps=COARSE_STEPS)
+
+    yield 'Down-and-out call', EXOTIC_PAYOFF.DOWN_AND_OUT.value, DOWN_BARRIER, OPTION_TYPE.CALL_OPTION.value, call - down_in
+    yield 'Down-and-in call', EXOTIC_PAYOFF.DOWN_AND_IN.value, DOWN_BARRIER, OPTION_TYPE.CALL_OPTION.value, down_in
+    yield 'Up-and-out put', EXOTIC_PAYOFF.UP_AND_OUT.value, UP_BARRIER, OPTION_TYPE.PUT_OPTION.value, put - up_in
+    yield 'Up-and-in put', EXOTIC_PAYOFF.UP_AND_IN.value, UP_BARRIER, OPTION_TYPE.PUT_OPTION.value, up_in
+    yield 'Floating lookback call', EXOTIC_PAYOFF.FLOATING_LOOKBACK.value, None, OPTION_TYPE.CALL_OPTION.value, lookback_call
+    yield 'Floating lookback put', EXOTIC_PAYOFF.FLOATING_LOOKBACK.value, None, OPTION_TYPE.PUT_OPTION.value, lookback_put
+    yield 'Geometric Asian call', EXOTIC_PAYOFF.GEOMETRIC_ASIAN.value, None, OPTION_TYPE.CALL_OPTION.value, geometric.geometric_asian_price(OPTION_TYPE.CALL_OPTION.value)
+    yield 'Arithmetic Asian call', EXOTIC_PAYOFF.ARITHMETIC_ASIAN.value, None, OPTION_TYPE.CALL_OPTION.value, None
+
+
+def price(days, exotic_payoff, barrier, option_type, number_of_simulations, steps, brownian_bridge):
+    """Returns MonteCarloEstimate and runtime in seconds."""
+    start = time.perf_counter()
+    model = ExoticPricing(SPOT_PRICE, STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA, number_of_simulations, exotic_payoff, barrier,
+                          steps, brownian_bridge=brownian_bridge, chunk_size=20000, seed=SEED)
+    estimate = model.calculate_option_price_estimate(option_type)
+    return estimate, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    number_of_simulations = int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER_OF_SIMULATIONS
+
+    failed = False
+    for days in DAYS_TO_MATURITY:
+        for name, exotic_payoff, barrier, option_type, reference in contracts(days):
+            coarse, coarse_runtime = price(days, exotic_payoff, barrier, option_type, number_of_simulations, COARSE_STEPS, True)
+            if exotic_payoff in [EXOTIC_PAYOFF.ARITHMETIC_ASIAN.value, EXOTIC_PAYOFF.GEOMETRIC_ASIAN.value]:
+                # Fixing dates are part of Asian contract, daily stepping would price a different contract
+                print(f'{name:<24} days={days:<5} {COARSE_STEPS} steps: price={coarse.price:8.4f} +- {coarse.standard_error:.4f}  '
+                      f'runtime={coarse_runtime:6.2f} s  variance reduction={coarse.variance_reduction_factor:7.1f}'
+                      + (f'  error={(coarse.price - reference) / coarse.standard_error:+5.1f} se' if reference is not None else ''))
+                if reference is not None:
+                    failed |= abs(coarse.price - reference) > MAX_STANDARD_ERRORS * coarse.standard_error
+                continue
+
+            daily, daily_runtime = price(days, exotic_payoff, barrier, option_type, number_of_simulations, days, False)
+            ok = abs(coarse.price - reference) <= MAX_STANDARD_ERRORS * coarse.standard_error
+            failed |= not ok
+            print(f'{name:<24} days={days:<5} closed form={reference:8.4f}  '
+                  f'{COARSE_STEPS} steps + bridge: error={(coarse.price - reference) / coarse.standard_error:+5.1f} se runtime={coarse_runtime:6.2f} s  '
+                  f'daily steps: error={(daily.price - reference) / daily.standard_error:+6.1f} se runtime={daily_runtime:6.2f} s  '
+                  f'speedup={daily_runtime / coarse_runtime:6.1f}  {"ok" if ok else "FAIL"}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-check of the finite-difference engine against Black-Scholes formula and binomial lattice over a range of spot prices.
+
+For every maturity one PDE solve per exercise style is repriced by interpolation at all SPOT_PRICES:
+- European prices, deltas and gammas are compared to BlackScholesModel.calculate_greeks,
+- American prices (both early exercise methods) to a Richardson extrapolated Leisen-Reimer lattice built for every spot.
+Reports largest errors and runtimes, and fails (exit code 1) when an error exceeds its tolerance.
+
+Usage: python benchmarks/finite_difference_accuracy.py [number_of_space_steps] [number_of_time_steps]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from FiniteDifferenceModel import FiniteDifferenceModel, EARLY_EXERCISE_METHOD
+from BlackScholesModel import BlackScholesModel
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from base import EXERCISE_STYLE
+
+
+SPOT_PRICES = np.linspace(70, 130, 25)
+STRIKE_PRICE = 100
+DAYS_TO_MATURITY = [30, 182, 365, 730]
+RISK_FREE_RATE = 0.05
+SIGMA = 0.2
+REFERENCE_STEPS = 2001
+
+# Largest accepted absolute errors with the default grid
+TOLERANCES = {'price': 5e-3, 'delta': 1e-3, 'gamma': 1e-3}
+
+
+def timed(function):
+    """Returns result of function and its runtime in seconds."""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def european_errors(days, space_steps, time_steps):
+    """Returns record of largest price, delta and gamma errors against Black-Scholes formula."""
+    FDM = FiniteDifferenceModel(SPOT_PRICES[12], STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA, space_steps, time_steps)
+    greeks, runtime = timed(lambda: FDM.calculate_greeks(SPOT_PRICES))
+    reference = BlackScholesModel.calculate_greeks(SPOT_PRICES, STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA)
+    return {'case': 'European', 'days': days, 'runtime_s': runtime, 'reference_runtime_s': None,
+            'price': max(np.max(np.abs(greeks[f'{option}_price'] - reference[f'{option}_price'])) for option in ['call', 'put']),
+            'delta': max(np.max(np.abs(greeks[f'{option}_delta'] - reference[f'{option}_delta'])) for option in ['call', 'put']),
+            'gamma': max(np.max(np.abs(greeks[f'{option}_gamma'] - reference['gamma'])) for option in ['call', 'put'])}
+
+
+def american_errors(days, space_steps, time_steps, early_exercise_method):
+    """Returns record of largest price error against binomial lattices, which need one tree per spot price."""
+    FDM = FiniteDifferenceModel(SPOT_PRICES[12], STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA, space_steps, time_steps,
+                                EXERCISE_STYLE.AMERICAN.value, early_exercise_method)
+    (call_prices, put_prices), runtime = timed(lambda: FDM.calculate_option_prices(SPOT_PRICES))
+
+    def lattice_prices():
+        prices = [BinomialTreeModel(spot, STRIKE_PRICE, days, RISK_FREE_RATE, SIGMA, REFERENCE_STEPS, EXERCISE_STYLE.AMERICAN.value,
+                                    LATTICE_TYPE.LEISEN_REIMER.value, richardson_extrapolation=True).calculate_option_prices()
+                  for spot in SPOT_PRICES]
+        return np.array(prices).T
+    (reference_calls, reference_puts), reference_runtime = timed(lattice_prices)
+    return {'case': f'American ({early_exercise_method})', 'days': days, 'runtime_s': runtime, 'reference_runtime_s': reference_runtime,
+            'price': max(np.max(np.abs(call_prices - reference_calls)), np.max(np.abs(put_prices - reference_puts))),
+            'delta': None, 'gamma': None}
+
+
+if __name__ == '__main__':
+    space_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    time_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    # Warm-up, scipy modules are imported on first solve
+    FiniteDifferenceModel(STRIKE_PRICE, STRIKE_PRICE, DAYS_TO_MATURITY[0], RISK_FREE_RATE, SIGMA).calculate_option_prices()
+
+    records = []
+    for days in DAYS_TO_MATURITY:
+        records.append(european_errors(days, space_steps, time_steps))
+        for method in EARLY_EXERCISE_METHOD:
+            records.append(american_errors(days, space_steps, time_steps, method.value))
+
+    failed = False
+    for record in records:
+        errors = '  '.join(f'{measure}={record[measure]:.2e}' for measure in TOLERANCES if record[measure] is not None)
+        ok = all(record[measure] is None or record[measure] <= tolerance for measure, tolerance in TOLERANCES.items())
+        failed |= not ok
+        reference = f"  lattices={record['reference_runtime_s']:7.3f} s" if record['reference_runtime_s'] is not None else ''
+        print(f"{record['case']:<26} days={record['days']:<4} solve={record['runtime_s']:7.3f} s{reference}  {errors}  {'ok' if ok else 'FAIL'}")
+    sys.exit(1 if failed else 0)
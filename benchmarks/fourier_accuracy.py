@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-check of the Carr-Madan FFT engine over whole strike chains.
+
+- GBM chains of CHAIN_SIZE strikes for every maturity and volatility are compared to Black-Scholes formula,
+  with runtime of the first (transform) and repeated (cached transform) pricing of the chain.
+- Heston chains are compared to Lewis formula integrated by scipy.integrate.quad with the same characteristic
+  function, and Heston with vanishing volatility of variance to Black-Scholes formula.
+Reports largest errors and runtimes, and fails (exit code 1) when an error exceeds its tolerance.
+
+Usage: python benchmarks/fourier_accuracy.py [chain_size]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+from scipy.integrate import quad
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from FourierPricingModel import FourierPricingModel, HestonModel
+from BlackScholesModel import BlackScholesModel
+
+
+SPOT_PRICE = 100
+RISK_FREE_RATE = 0.05
+DAYS_TO_MATURITY = [1, 7, 30, 182, 365, 1825]
+SIGMAS = [0.05, 0.2, 0.8]
+MONEYNESS_RANGE = (0.5, 1.5)                   # strike / spot
+CHAIN_SIZE = 1000
+HESTON_STRIKES = [60, 80, 90, 100, 110, 120, 150]
+HESTON_MODELS = {
+    'Heston (skewed)': HestonModel(0.0175, 1.5768, 0.0398, 0.5751, -0.5711),
+    'Heston (vol of variance)': HestonModel(0.04, 2.0, 0.09, 1.0, -0.3),
+}
+
+# Largest accepted absolute price error
+TOLERANCE = 1e-5
+
+
+def timed(function):
+    """Returns result of function and its runtime in seconds."""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def lewis_call_prices(characteristic_function, strikes, days):
+    """Returns call prices from Lewis formula C = S - sqrt(S K) exp(-r T) / pi * integral Re[exp(-i u k) phi(u - i/2)] / (u^2 + 1/4) du."""
+    T = days / 365
+    prices = []
+    for K in strikes:
+        k = np.log(K / SPOT_PRICE)
+        integrand = lambda u: (np.exp(-1j * u * k) * characteristic_function(np.array(u - 0.5j), T, RISK_FREE_RATE)).real / (u ** 2 + 0.25)
+        integral = quad(integrand, 0, np.inf, limit=1000, epsabs=1e-12)[0]
+        prices.append(SPOT_PRICE - np.sqrt(SPOT_PRICE * K) * np.exp(-RISK_FREE_RATE * T) / np.pi * integral)
+    return np.array(prices)
+
+
+def gbm_record(days, sigma, chain_size):
+    """Returns record of largest error against Black-Scholes formula over the chain and runtimes."""
+    strikes = SPOT_PRICE * np.linspace(*MONEYNESS_RANGE, chain_size)
+    FPM = FourierPricingModel(SPOT_PRICE, SPOT_PRICE, days, RISK_FREE_RATE, sigma)
+    FourierPricingModel.clear_transform_cache()
+    (call_prices, put_prices), runtime = timed(lambda: FPM.calculate_option_prices(strikes))
+    _, cached_runtime = timed(lambda: FPM.calculate_option_prices(strikes))
+    reference_calls, reference_puts = BlackScholesModel.calculate_option_prices(SPOT_PRICE, strikes, days, RISK_FREE_RATE, sigma)
+    return {'case': f'GBM sigma={sigma:.2f}', 'days': days, 'points': FPM._grid_parameters()[0], 'runtime_s': runtime,
+            'cached_runtime_s': cached_runtime,
+            'error': max(np.max(np.abs(call_prices - reference_calls)), np.max(np.abs(put_prices - reference_puts)))}
+
+
+def heston_records():
+    """Returns records of Heston chains against Lewis formula and of degenerate Heston against Black-Scholes formula."""
+    records = []
+    strikes = np.array(HESTON_STRIKES, dtype=float)
+    for name, model in HESTON_MODELS.items():
+        for days in [30, 365, 1825]:
+            FPM = FourierPricingModel(SPOT_PRICE, SPOT_PRICE, days, RISK_FREE_RATE, characteristic_function=model)
+            (call_prices, _), runtime = timed(lambda: FPM.calculate_option_prices(strikes))
+            error = np.max(np.abs(call_prices - lewis_call_prices(model, strikes, days)))
+            records.append({'case': name, 'days': days, 'points': FPM._grid_parameters()[0], 'runtime_s': runtime,
+                            'cached_runtime_s': None, 'error': error})
+
+    # Constant variance: xi -> 0 with v0 = theta is GBM with sigma = sqrt(theta), uncorrelated so the difference is O(xi^2)
+    degenerate = HestonModel(0.04, 2.0, 0.04, 1e-4, 0.0)
+    FPM = FourierPricingModel(SPOT_PRICE, SPOT_PRICE, 365, RISK_FREE_RATE, characteristic_function=degenerate)
+    (call_prices, _), runtime = timed(lambda: FPM.calculate_option_prices(strikes))
+    reference_calls, _ = BlackScholesModel.calculate_option_prices(SPOT_PRICE, strikes, 365, RISK_FREE_RATE, 0.2)
+    records.append({'case': 'Heston (constant variance)', 'days': 365, 'points': FPM._grid_parameters()[0], 'runtime_s': runtime,
+                    'cached_runtime_s': None, 'error': np.max(np.abs(call_prices - reference_calls))})
+    return records
+
+
+if __name__ == '__main__':
+    chain_size = int(sys.argv[1]) if len(sys.argv) > 1 else CHAIN_SIZE
+
+    # Warm-up, scipy modules are imported on first transform
+    FourierPricingModel(SPOT_PRICE, SPOT_PRICE, 365, RISK_FREE_RATE, 0.2).calculate_option_prices()
+
+    records = [gbm_record(days, sigma, chain_size) for days in DAYS_TO_MATURITY for sigma in SIGMAS] + heston_records()
+
+    failed = False
+    for record in records:
+        ok = record['error'] <= TOLERANCE
+        failed |= not ok
+        cached = f"  cached={record['cached_runtime_s'] * 1e3:7.3f} ms" if record['cached_runtime_s'] is not None else ''
+        print(f"{record['case']:<28} days={record['days']:<5} points={record['points']:<7} transform={record['runtime_s'] * 1e3:7.2f} ms{cached}  "
+              f"error={record['error']:.2e}  {'ok' if ok else 'FAIL'}")
+    sys.exit(1 if failed else 0)
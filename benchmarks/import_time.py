@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmark of the numeric modules.
+
+Every module is imported in fresh interpreters, alternating with imports of the numpy/scipy baseline so that
+both see the same machine load. The benchmark fails (exit code 1) when a module pulls in heavy plotting/data
+fetching dependencies at import time, or when the median of its import times exceeds the median of the
+baseline measured alongside it by more than IMPORT_OVERHEAD_BUDGET plus the interquartile range of those baseline
+times, the timing noise of the run.
+
+Usage: python benchmarks/import_time.py
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Numeric modules used by batch workers
+MODULES = ['base', 'BlackScholesModel', 'BinomialTreeModel', 'MonteCarloSimulation', 'AmericanPricing', 'ExoticPricing', 'FiniteDifferenceModel', 'FourierPricingModel', 'ImpliedVolatility', 'HistoricalVolatility', 'ticker', 'pricing_cache', 'jobs', 'kernels', 'portfolio', 'instrumentation']
+
+# Dependencies which must only be imported on first use
+DEFERRED_MODULES = ['matplotlib', 'yfinance', 'pandas_datareader', 'requests_cache', 'scipy.stats', 'streamlit', 'pyarrow', 'numba']
+
+# Third party modules every numeric module needs anyway
+BASELINE_IMPORT = 'import numpy, scipy.special'
+
+# Allowed import time on top of the baseline, in seconds
+IMPORT_OVERHEAD_BUDGET = 0.05
+
+REPEATS = 7
+
+MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [name for name in {deferred!r} if name in sys.modules]}}))
+'''
+
+
+def measure_import(statement):
+    """Runs import statement in a fresh interpreter, returns its time and list of deferred modules it loaded."""
+    output = subprocess.run([sys.executable, '-c', MEASURE.format(statement=statement, deferred=DEFERRED_MODULES)],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['loaded']
+
+
+def measure_module(module, repeats=REPEATS):
+    """
+    Imports module and the baseline alternately repeats times each, returns median import time of the module, median
+    and interquartile range of import times of the baseline and list of deferred modules the module loaded.
+    """
+    module_times, baseline_times = [], []
+    for _ in range(repeats):
+        baseline_times.append(measure_import(BASELINE_IMPORT)[0])
+        seconds, loaded = measure_import(f'import {module}')
+        module_times.append(seconds)
+    quartiles = statistics.quantiles(baseline_times, n=4)
+    return statistics.median(module_times), quartiles[1], quartiles[2] - quartiles[0], loaded
+
+
+def run_benchmark():
+    """Returns list of result records, one per module."""
+    records = []
+    for module in MODULES:
+        seconds, baseline, noise, loaded = measure_module(module)
+        overhead = max(seconds - baseline, 0.0)
+        allowed = IMPORT_OVERHEAD_BUDGET + noise
+        records.append({'module': module, 'seconds': seconds, 'baseline': baseline, 'overhead': overhead, 'allowed': allowed,
+                        'loaded': loaded, 'passed': not loaded and overhead <= allowed})
+    return records
+
+
+if __name__ == '__main__':
+    records = run_benchmark()
+    for record in records:
+        status = 'ok' if record['passed'] else 'FAIL'
+        loaded = f"  eagerly loads: {', '.join(record['loaded'])}" if record['loaded'] else ''
+        print(f"{record['module']:<32} {record['seconds'] * 1000:8.1f} ms  baseline {record['baseline'] * 1000:8.1f} ms  "
+              f"(+{record['overhead'] * 1000:6.1f} ms of {record['allowed'] * 1000:6.1f} ms)  {status}{loaded}")
+    if '--json' in sys.argv:
+        print(json.dumps(records, indent=2))
+    sys.exit(0 if all(record['passed'] for record in records) else 1)
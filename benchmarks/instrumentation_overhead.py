@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Overhead of the instrumentation layer on pricing runs.
+
+Cost of one disabled and one enabled stage is measured in a tight loop. Every model is then priced with
+instrumentation disabled, enabled, enabled with tracemalloc and enabled with cProfile, and the stage breakdown of the
+enabled run is printed. Overhead of disabled instrumentation is the number of stages entered by the run times the
+cost of a disabled stage, relative to the runtime of the model. Fails (exit code 1) when it exceeds MAX_DISABLED_OVERHEAD.
+
+Usage: python benchmarks/instrumentation_overhead.py [repeats]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+import instrumentation
+from instrumentation import Instrumentation, stage, stage_table
+from AmericanPricing import AmericanPricing
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from BlackScholesModel import BlackScholesModel
+from FiniteDifferenceModel import FiniteDifferenceModel
+from MonteCarloSimulation import MonteCarloPricing
+
+
+REPEATS = 3
+STAGE_LOOPS = 200000
+MAX_DISABLED_OVERHEAD = 0.01
+
+MODELS = {
+    'Black-Scholes batch (100000 quotes)': lambda: BlackScholesModel.calculate_option_prices(
+        100.0, np.linspace(50, 150, 100000), 365, 0.05, 0.2),
+    'Binomial American (2001 steps)': lambda: BinomialTreeModel(
+        100, 100, 365, 0.05, 0.2, 2001, 'American', LATTICE_TYPE.LEISEN_REIMER.value).calculate_option_prices(),
+    'Monte Carlo full paths (10000 x 365)': lambda: MonteCarloPricing(100, 100, 365, 0.05, 0.2, 10000).simulate_prices(),
+    'LSM (10000 x 365)': lambda: AmericanPricing(100, 100, 365, 0.05, 0.2, 10000, seed=20).calculate_option_prices(),
+    'Crank-Nicolson American (400 x 200)': lambda: FiniteDifferenceModel(100, 100, 365, 0.05, 0.2, exercise_style='American').solve(),
+}
+
+
+def stage_cost():
+    """Returns seconds of one entered and exited stage in the current instrumentation state."""
+    start = time.perf_counter()
+    for _ in range(STAGE_LOOPS):
+        with stage('loop') as instrumented_stage:
+            instrumented_stage.record(iterations=1)
+    return (time.perf_counter() - start) / STAGE_LOOPS
+
+
+def best_runtime(function, repeats):
+    """Returns the shortest runtime of function in seconds."""
+    runtimes = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        runtimes.append(time.perf_counter() - start)
+    return min(runtimes)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else REPEATS
+
+    instrumentation.disable()
+    disabled_cost = stage_cost()
+    instrumentation.enable(Instrumentation(max_records=10))
+    enabled_cost = stage_cost()
+    instrumentation.disable()
+    print(f'stage cost: disabled {disabled_cost * 1e9:.0f} ns, enabled {enabled_cost * 1e6:.2f} us')
+
+    failed = False
+    for name, price in MODELS.items():
+        price()                                   # Warm-up
+        instrumentation.disable()
+        disabled = best_runtime(price, repeats)
+
+        recorder = instrumentation.enable(Instrumentation(max_records=repeats))
+        enabled = best_runtime(price, repeats)
+        run = recorder.records[-1]
+        instrumentation.enable(Instrumentation(max_records=1, trace_memory=True))
+        traced = best_runtime(price, 1)
+        instrumentation.enable(Instrumentation(max_records=1, profile=True))
+        profiled = best_runtime(price, 1)
+        instrumentation.disable()
+
+        stages = sum(record.calls for record in run.stages)
+        overhead = stages * disabled_cost / disabled
+        ok = overhead <= MAX_DISABLED_OVERHEAD
+        failed |= not ok
+        print(f'{name:<38} disabled={disabled:8.4f} s  enabled={enabled / disabled:5.2f}x  tracemalloc={traced / disabled:5.2f}x  '
+              f'cProfile={profiled / disabled:5.2f}x  stages={stages:<6} disabled overhead={overhead:.1e}  {"ok" if ok else "FAIL"}')
+        for row in stage_table([run]):
+            print(f"    {row['stage']:<80} {row['seconds'] * 1e3:9.3f} ms {row['share']:7.1%}  calls={row['calls']:<6} "
+                  f"iterations={row['iterations']:<9} allocated={row['allocated_mb']:8.2f} MB")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Parity and speed of kernel backends of the hot loops.
+
+Prices American binomial lattices, full path Monte Carlo and LSM ladders with the NumPy backend and
+with the kernel backends, reports runtimes and the largest price difference against NumPy, and fails
+(exit code 1) when a difference exceeds the tolerance of the case. Numba kernels are compiled by a
+warm-up run before timing. Kernel logic is always checked interpreted (Python backend) on smaller problems,
+which says nothing about compiled code: without Numba the Numba parity check is reported as SKIPPED, and
+fails instead with --require-numba.
+
+Usage: python benchmarks/kernel_parity.py [--quick] [--require-numba]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import argparse
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+import kernels
+from kernels import KERNEL_BACKEND
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from MonteCarloSimulation import MonteCarloPricing, SIMULATION_MODE
+from AmericanPricing import AmericanPricing
+from base import EXERCISE_STYLE
+
+
+SPOT_PRICE = 100
+STRIKES = np.array([80.0, 90.0, 100.0, 110.0, 120.0])
+DAYS_TO_MATURITY = 365
+RISK_FREE_RATE = 0.05
+SIGMA = 0.2
+SEED = 20
+REPEATS = 3
+
+# Problem sizes: compiled and NumPy backends, interpreted kernels
+SIZES = {'binomial_steps': 20000, 'monte_carlo_simulations': 100000, 'lsm_simulations': 20000}
+PYTHON_SIZES = {'binomial_steps': 300, 'monte_carlo_simulations': 200, 'lsm_simulations': 200}
+
+# Largest accepted price difference against NumPy backend. LSM exercise decisions of paths whose exercise and
+# continuation values are equal to rounding can differ, which moves the price by a fraction of one path payoff.
+TOLERANCES = {'Binomial': 1e-9, 'Monte Carlo': 1e-9, 'LSM': 1e-6}
+
+
+def cases(sizes):
+    """Yields (model, name, pricer), pricer() returns array of prices."""
+    for lattice_type in [LATTICE_TYPE.COX_ROSS_RUBINSTEIN, LATTICE_TYPE.LEISEN_REIMER]:
+        def binomial(lattice_type=lattice_type.value):
+            BOPM = BinomialTreeModel(SPOT_PRICE, 100, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, sizes['binomial_steps'],
+                                     EXERCISE_STYLE.AMERICAN.value, lattice_type)
+            return np.concatenate(BOPM.calculate_option_prices(STRIKES))
+        yield 'Binomial', f'Binomial {lattice_type.value}', binomial
+
+    def monte_carlo():
+        MC = MonteCarloPricing(SPOT_PRICE, 100, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, sizes['monte_carlo_simulations'],
+                               SIMULATION_MODE.FULL_PATHS.value, seed=SEED)
+        MC.simulate_prices()
+        return np.array([MC._calculate_option_price('Call Option'), MC._calculate_option_price('Put Option')])
+    yield 'Monte Carlo', 'Monte Carlo full paths', monte_carlo
+
+    for risk_free_rate in [RISK_FREE_RATE, -0.01]:
+        def least_squares_monte_carlo(risk_free_rate=risk_free_rate):
+            AP = AmericanPricing(SPOT_PRICE, 100, DAYS_TO_MATURITY, risk_free_rate, SIGMA, sizes['lsm_simulations'], SEED)
+            ladder = AP.calculate_option_price_ladder(STRIKES, [30, 182, DAYS_TO_MATURITY])
+            return np.concatenate([ladder['american_call'].ravel(), ladder['american_put'].ravel()])
+        yield 'LSM', f'LSM ladder (rate {risk_free_rate:+.2f})', least_squares_monte_carlo
+
+
+def measure(pricer, backend, repeats):
+    """Returns prices and best runtime of pricer with the backend."""
+    kernels.set_backend(backend)
+    try:
+        prices = pricer()        # warm-up, compiles Numba kernels
+        runtimes = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            pricer()
+            runtimes.append(time.perf_counter() - start)
+    finally:
+        kernels.set_backend(None)
+    return prices, min(runtimes)
+
+
+def parity_report(quick=False):
+    """Returns list of result records, one per case and kernel backend."""
+    backends = [(KERNEL_BACKEND.PYTHON.value, PYTHON_SIZES, 1)]
+    if kernels.numba_available():
+        backends.insert(0, (KERNEL_BACKEND.NUMBA.value, PYTHON_SIZES if quick else SIZES, REPEATS))
+
+    records = []
+    for backend, sizes, repeats in backends:
+        for model, name, pricer in cases(sizes):
+            reference, reference_runtime = measure(pricer, KERNEL_BACKEND.NUMPY.value, repeats)
+            prices, runtime = measure(pricer, backend, repeats)
+            difference = float(np.max(np.abs(prices - reference)))
+            records.append({'case': name, 'backend': backend, 'numpy_s': reference_runtime, 'kernel_s': runtime,
+                            'speedup': reference_runtime / runtime, 'difference': difference, 'ok': difference <= TOLERANCES[model]})
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parity and speed of kernel backends.')
+    parser.add_argument('--quick', action='store_true', help='small problems only')
+    parser.add_argument('--require-numba', action='store_true', help='fail instead of skipping Numba parity when Numba is not installed')
+    arguments = parser.parse_args()
+
+    records = parity_report(arguments.quick)
+    for record in records:
+        status = 'ok' if record['ok'] else 'FAIL (prices differ from NumPy backend)'
+        print(f"{record['case']:<32} {record['backend']:<7} numpy={record['numpy_s']:8.3f} s  kernel={record['kernel_s']:8.3f} s  "
+              f"speedup={record['speedup']:6.2f}  difference={record['difference']:.2e}  {status}")
+
+    ok = {backend: all(record['ok'] for record in records if record['backend'] == backend) for backend in {record['backend'] for record in records}}
+    print(f"\nKernel logic (interpreted Python backend against NumPy): {'ok' if ok[KERNEL_BACKEND.PYTHON.value] else 'FAIL'}")
+    if kernels.numba_available():
+        print(f"Numba parity (compiled kernels against NumPy): {'ok' if ok[KERNEL_BACKEND.NUMBA.value] else 'FAIL'}")
+    elif arguments.require_numba:
+        print('Numba parity (compiled kernels against NumPy): FAIL, Numba is not installed')
+        ok[KERNEL_BACKEND.NUMBA.value] = False
+    else:
+        print('Numba parity (compiled kernels against NumPy): SKIPPED, Numba is not installed, compiled kernels were not checked')
+    sys.exit(0 if all(ok.values()) else 1)
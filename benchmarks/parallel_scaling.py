@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling of parallel Monte Carlo pricing with the number of workers.
+
+Prices the same European and American options with thread and process pools of growing size,
+reports runtime and speedup against one worker, and fails (exit code 1) when prices are not
+bit-identical across worker counts.
+
+Usage: python benchmarks/parallel_scaling.py [max_workers]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from MonteCarloSimulation import MonteCarloPricing, SIMULATION_MODE
+from AmericanPricing import AmericanPricing
+from base import EXECUTOR, OPTION_TYPE
+
+
+SPOT_PRICE = 100
+STRIKE_PRICE = 100
+DAYS_TO_MATURITY = 365
+RISK_FREE_RATE = 0.05
+SIGMA = 0.2
+SEED = 20
+
+EUROPEAN_SIMULATIONS = 20000000
+EUROPEAN_CHUNK_SIZE = 250000
+AMERICAN_SIMULATIONS = 320000
+AMERICAN_BLOCK_SIZE = 20000
+
+
+def price_european(number_of_workers, executor):
+    """Returns (call, put) prices of parallel streaming Monte Carlo."""
+    MC = MonteCarloPricing(SPOT_PRICE, STRIKE_PRICE, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, EUROPEAN_SIMULATIONS,
+                           SIMULATION_MODE.PARALLEL.value, EUROPEAN_CHUNK_SIZE, SEED, number_of_workers, executor)
+    MC.simulate_prices()
+    return MC._calculate_option_price(OPTION_TYPE.CALL_OPTION.value), MC._calculate_option_price(OPTION_TYPE.PUT_OPTION.value)
+
+
+def price_american(number_of_workers, executor):
+    """Returns (call, put) prices of parallel Least Squares Monte Carlo."""
+    AP = AmericanPricing(SPOT_PRICE, STRIKE_PRICE, DAYS_TO_MATURITY, RISK_FREE_RATE, SIGMA, AMERICAN_SIMULATIONS, SEED)
+    call_estimate, put_estimate = AP.calculate_option_price_estimates_in_parallel(AMERICAN_BLOCK_SIZE, number_of_workers, executor)
+    return call_estimate.price, put_estimate.price
+
+
+def scaling_report(max_workers):
+    """Returns list of result records, one per engine, executor and number of workers."""
+    worker_counts = sorted({1, max_workers} | {2 ** i for i in range(1, max_workers.bit_length()) if 2 ** i <= max_workers})
+    records = []
+    for engine, price in [('European', price_european), ('American LSM', price_american)]:
+        for executor in EXECUTOR:
+            reference = None
+            for number_of_workers in worker_counts:
+                start = time.perf_counter()
+                prices = price(number_of_workers, executor.value)
+                runtime = time.perf_counter() - start
+                if reference is None:
+                    reference = (prices, runtime)
+                records.append({'engine': engine, 'executor': executor.value, 'workers': number_of_workers, 'runtime_s': runtime,
+                                'speedup': reference[1] / runtime, 'identical': prices == reference[0]})
+    return records
+
+
+if __name__ == '__main__':
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    records = scaling_report(max_workers)
+    for record in records:
+        status = 'ok' if record['identical'] else 'FAIL (prices differ from 1 worker)'
+        print(f"{record['engine']:<14} {record['executor']:<14} workers={record['workers']:<3} "
+              f"{record['runtime_s']:8.3f} s  speedup={record['speedup']:5.2f}  {status}")
+    sys.exit(0 if all(record['identical'] for record in records) else 1)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Scenario revaluation of a synthetic book against per-object pricing.
+
+A random book of Black-Scholes positions (plus a few binomial, Monte Carlo and LSM positions) on several underlyings
+is revalued over a spot x volatility x rate scenario cube with Portfolio.revalue. The same P&L of a sample of
+positions is recalculated with one model object per position and scenario, and the per-object runtime of the whole
+book is extrapolated from the sample. Runtime of every engine is reported, and peak traced memory of revaluing the
+Black-Scholes positions for two chunk limits. P&L of the LSM positions is revalued with two chunk limits as well,
+which block their regressions differently over the same path sets.
+Fails (exit code 1) when P&L of the sample differs from per-object pricing by more than TOLERANCE, or when LSM P&L
+depends on the chunk limit.
+
+Usage: python benchmarks/portfolio_scenarios.py [number_of_positions]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+import tracemalloc
+
+# Third party imports
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from portfolio import Portfolio, ScenarioGrid
+from BlackScholesModel import BlackScholesModel
+from BinomialTreeModel import BinomialTreeModel
+from base import OPTION_TYPE, EXERCISE_STYLE, PRICING_MODEL
+
+
+SPOT_PRICES = {'AAA': 100.0, 'BBB': 45.0, 'CCC': 250.0, 'DDD': 12.0}
+SIGMAS = {'AAA': 0.2, 'BBB': 0.35, 'CCC': 0.25, 'DDD': 0.5}
+RISK_FREE_RATE = 0.04
+NUMBER_OF_POSITIONS = 5000
+NUMERICAL_POSITIONS = 8                         # per binomial and Monte Carlo model
+LSM_POSITIONS = 4                               # American puts on the first underlying
+SCENARIOS = ScenarioGrid(np.linspace(-0.3, 0.3, 21), np.linspace(-0.1, 0.1, 5), np.linspace(-0.02, 0.02, 5))
+SAMPLE_SIZE = 50
+SEED = 20
+
+TOLERANCE = 1e-9
+
+
+def synthetic_book(number_of_positions, numerical=True, max_chunk_elements=2 ** 22, seed=SEED):
+    """Returns Portfolio of random Black-Scholes positions, plus a few positions of every numerical model if numerical."""
+    rng = np.random.default_rng(seed)
+    book = Portfolio(SPOT_PRICES, SIGMAS, RISK_FREE_RATE, number_of_time_steps=200, number_of_simulations=50000,
+                     lsm_simulations=1000, max_chunk_elements=max_chunk_elements)
+    symbols = np.array(list(SPOT_PRICES))
+
+    def random_positions(size):
+        chosen = rng.choice(symbols, size)
+        spots = np.array([SPOT_PRICES[symbol] for symbol in chosen])
+        return (chosen, rng.integers(-20, 21, size), np.round(spots * rng.uniform(0.7, 1.3, size), 1), rng.integers(7, 730, size),
+                rng.choice([option_type.value for option_type in OPTION_TYPE], size))
+
+    book.add_positions(*random_positions(number_of_positions))
+    if not numerical:
+        return book
+    book.add_positions(*random_positions(NUMERICAL_POSITIONS), EXERCISE_STYLE.AMERICAN.value, PRICING_MODEL.BINOMIAL.value)
+    book.add_positions(*random_positions(NUMERICAL_POSITIONS), EXERCISE_STYLE.EUROPEAN.value, PRICING_MODEL.MONTE_CARLO.value)
+    # Every volatility and rate scenario runs one LSM regression per exercise date over all scaled strikes
+    symbol = symbols[0]
+    book.add_positions(symbol, rng.integers(-20, 21, LSM_POSITIONS), np.round(SPOT_PRICES[symbol] * rng.uniform(0.8, 1.2, LSM_POSITIONS), 1),
+                       rng.choice([91, 182], LSM_POSITIONS), OPTION_TYPE.PUT_OPTION.value, EXERCISE_STYLE.AMERICAN.value,
+                       PRICING_MODEL.LSM.value)
+    return book
+
+
+def per_object_pnl(book, position, scenarios):
+    """P&L of one Black-Scholes or binomial position under every scenario, one model object per scenario."""
+    spot = book.spot_prices[book.underlying[position]]
+    sigma = book.sigmas[book.underlying[position]]
+    option_type = OPTION_TYPE.CALL_OPTION.value if book.call[position] else OPTION_TYPE.PUT_OPTION.value
+
+    def price(spot_shock, volatility_shock, rate_shock):
+        parameters = (spot * (1 + spot_shock), book.strike[position], int(book.days_to_maturity[position]), book.r + rate_shock,
+                      sigma + volatility_shock)
+        if book.model[position] == list(PRICING_MODEL).index(PRICING_MODEL.BINOMIAL):
+            model = BinomialTreeModel(*parameters, book.number_of_time_steps,
+                                      EXERCISE_STYLE.AMERICAN.value if book.american[position] else EXERCISE_STYLE.EUROPEAN.value,
+                                      book.lattice_type)
+        else:
+            model = BlackScholesModel(*parameters)
+        return model._calculate_option_price(option_type)
+
+    base = price(0.0, 0.0, 0.0)
+    return book.quantity[position] * np.array([[[price(i, j, k) - base for k in scenarios.rate_shocks] for j in scenarios.volatility_shocks]
+                                                for i in scenarios.spot_shocks])
+
+
+def lsm_chunking_difference(scenarios, max_chunk_elements=(2 ** 12, 2 ** 22)):
+    """Largest difference of LSM P&L between books of the same positions revalued with two values of max_chunk_elements."""
+    pnl = []
+    for elements in max_chunk_elements:
+        book = synthetic_book(0, True, elements)
+        lsm = book.model == list(PRICING_MODEL).index(PRICING_MODEL.LSM)
+        pnl.append(book.revalue(scenarios, by_position=True)[..., lsm])
+    return np.max(np.abs(pnl[0] - pnl[1]))
+
+
+def peak_memory(book, scenarios):
+    """Returns runtime and peak traced memory in MB of book revaluation."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    book.revalue(scenarios)
+    runtime = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return runtime, peak / 2 ** 20
+
+
+if __name__ == '__main__':
+    number_of_positions = int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER_OF_POSITIONS
+    number_of_scenarios = int(np.prod([np.size(shocks) for shocks in SCENARIOS]))
+
+    book = synthetic_book(number_of_positions)
+    pnl = np.zeros(tuple(np.size(shocks) for shocks in SCENARIOS) + (len(book),))
+    runtimes = dict.fromkeys(PRICING_MODEL, 0.0)
+    start = time.perf_counter()
+    for positions, chunk_pnl in book.revalue_chunks(SCENARIOS):
+        pnl[..., positions] = chunk_pnl
+        runtimes[list(PRICING_MODEL)[book.model[positions[0]]]] += time.perf_counter() - start
+        start = time.perf_counter()
+    print(f'{len(book)} positions x {number_of_scenarios} scenarios: revalued in {sum(runtimes.values()):.3f} s, '
+          f'book P&L range {pnl.sum(axis=-1).min():,.0f} .. {pnl.sum(axis=-1).max():,.0f}')
+    for model, runtime in runtimes.items():
+        print(f'    {model.value:<12} {np.sum(book.model == list(PRICING_MODEL).index(model)):>6} positions  {runtime:7.3f} s')
+
+    black_scholes = np.flatnonzero(book.model == list(PRICING_MODEL).index(PRICING_MODEL.BLACK_SCHOLES))
+    sample = np.random.default_rng(SEED).choice(black_scholes, min(SAMPLE_SIZE, black_scholes.size), replace=False)
+    start = time.perf_counter()
+    difference = max(np.max(np.abs(per_object_pnl(book, position, SCENARIOS) - pnl[..., position])) for position in sample)
+    per_object_runtime = (time.perf_counter() - start) / sample.size * black_scholes.size
+    binomial = np.flatnonzero(book.model == list(PRICING_MODEL).index(PRICING_MODEL.BINOMIAL))[0]
+    small_grid = ScenarioGrid(SCENARIOS.spot_shocks[::5], SCENARIOS.volatility_shocks[::2], SCENARIOS.rate_shocks[::2])
+    binomial_difference = np.max(np.abs(per_object_pnl(book, binomial, small_grid) - book.revalue(small_grid, by_position=True)[..., binomial]))
+    print(f'per-object Black-Scholes pricing of the book (extrapolated from {sample.size} positions): {per_object_runtime:.1f} s')
+    print(f'largest P&L difference against per-object pricing: Black-Scholes {difference:.2e}, binomial {binomial_difference:.2e}')
+    lsm_difference = lsm_chunking_difference(small_grid)
+    print(f'largest LSM P&L difference between chunk limits: {lsm_difference:.2e}')
+
+    for max_chunk_elements in [2 ** 18, 2 ** 22]:
+        chunk_runtime, peak = peak_memory(synthetic_book(number_of_positions, False, max_chunk_elements), SCENARIOS)
+        print(f'max_chunk_elements={max_chunk_elements:>8}: runtime={chunk_runtime:.3f} s  peak memory={peak:8.1f} MB')
+
+    ok = difference <= TOLERANCE and binomial_difference <= TOLERANCE * 1e3 and lsm_difference == 0
+    print('ok' if ok else 'FAIL')
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Speed, memory and accuracy benchmark of every pricing model.
+
+Every model is run over a grid of resolutions (time steps or simulations), maturities and moneyness.
+For each model configuration, resolution and maturity the report holds best runtime of pricing calls and puts
+for all strikes, peak traced memory (numpy allocations are reported to tracemalloc) and the largest absolute
+error. European prices are compared to Black-Scholes closed form, American prices to a Richardson extrapolated
+Leisen-Reimer lattice with REFERENCE_STEPS steps. Finite-difference resolution is the number of space steps
+(with half as many time steps). Transforms of the Fourier engine are not reused between repeats.
+Fails (exit code 1) when estimate entry points of AmericanPricing accept an unknown option type or return no finite
+estimate for a known one.
+
+Usage: python benchmarks/pricing_models.py [--quick] [--json results.json] [--plot error_vs_runtime.png] [--compare baseline.json]
+    --quick     smaller grid for a fast check
+    --json      writes records together with commit and library versions, for comparison across commits
+    --plot      writes error vs runtime chart
+    --compare   prints runtime ratio and error change against records of an earlier run
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import scipy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Local package imports
+from BlackScholesModel import BlackScholesModel
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from MonteCarloSimulation import MonteCarloPricing, SIMULATION_MODE
+from AmericanPricing import AmericanPricing
+from FiniteDifferenceModel import FiniteDifferenceModel
+from FourierPricingModel import FourierPricingModel
+from base import EXERCISE_STYLE, OPTION_TYPE
+
+
+SPOT_PRICE = 100
+RISK_FREE_RATE = 0.05
+SIGMA = 0.2
+SEED = 20
+DAYS_TO_MATURITY = [30, 182, 365]
+MONEYNESS = [0.9, 1.0, 1.1]                     # spot / strike
+REFERENCE_STEPS = 4001
+REPEATS = 3
+
+GRID = {
+    'binomial_steps': [50, 100, 200, 500, 1000, 2000, 5000],
+    'monte_carlo_simulations': [1000, 10000, 100000, 1000000],
+    'full_paths_simulations': [1000, 10000, 100000],
+    'lsm_simulations': [2000, 10000, 50000],
+    'finite_difference_steps': [100, 200, 400, 800, 1600],
+}
+
+QUICK_GRID = {
+    'binomial_steps': [50, 200, 1000],
+    'monte_carlo_simulations': [1000, 100000],
+    'full_paths_simulations': [1000, 10000],
+    'lsm_simulations': [2000, 10000],
+    'finite_difference_steps': [100, 400],
+}
+
+# Columns identifying a record, used to match records of two runs
+KEY_COLUMNS = ['model', 'configuration', 'resolution', 'days_to_maturity']
+
+
+def measure(function, repeats=REPEATS):
+    """Returns result of function, its best runtime out of repeats and peak traced memory in MB of one extra run."""
+    runtimes = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        runtimes.append(time.perf_counter() - start)
+
+    # Memory is measured separately, tracing slows down Python code
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(runtimes), peak_memory / 2 ** 20
+
+
+def reference_prices(days, strikes):
+    """Returns dictionary of (call_prices, put_prices) references by exercise style."""
+    european = BlackScholesModel.calculate_option_prices(SPOT_PRICE, strikes, days, RISK_FREE_RATE, SIGMA)
+    lattice = BinomialTreeModel(SPOT_PRICE, SPOT_PRICE, days, RISK_FREE_RATE, SIGMA, REFERENCE_STEPS, EXERCISE_STYLE.AMERICAN.value,
+                                LATTICE_TYPE.LEISEN_REIMER.value, richardson_extrapolation=True)
+    return {EXERCISE_STYLE.EUROPEAN.value: european, EXERCISE_STYLE.AMERICAN.value: lattice.calculate_option_prices(strikes)}
+
+
+def model_cases(grid):
+    """
+    Yields (model, configuration, exercise_style, resolution, pricer) for every benchmarked setting.
+    pricer(days, strikes) returns tuple (call_prices, put_prices) for all strikes.
+    """
+    def black_scholes(days, strikes):
+        models = [BlackScholesModel(SPOT_PRICE, K, days, RISK_FREE_RATE, SIGMA) for K in strikes]
+        return ([model._calculate_option_price(OPTION_TYPE.CALL_OPTION.value) for model in models],
+                [model._calculate_option_price(OPTION_TYPE.PUT_OPTION.value) for model in models])
+    yield 'BlackScholesModel', 'closed form', EXERCISE_STYLE.EUROPEAN.value, 1, black_scholes
+
+    def fourier(days, strikes):
+        FourierPricingModel.clear_transform_cache()
+        return FourierPricingModel(SPOT_PRICE, strikes[0], days, RISK_FREE_RATE, SIGMA).calculate_option_prices(strikes)
+    yield 'FourierPricingModel', 'Carr-Madan FFT', EXERCISE_STYLE.EUROPEAN.value, 1, fourier
+
+    for exercise_style in EXERCISE_STYLE:
+        for lattice_type in LATTICE_TYPE:
+            for steps in grid['binomial_steps']:
+                def binomial(days, strikes, steps=steps, exercise_style=exercise_style.value, lattice_type=lattice_type.value):
+                    model = BinomialTreeModel(SPOT_PRICE, strikes[0], days, RISK_FREE_RATE, SIGMA, steps, exercise_style, lattice_type)
+                    return model.calculate_option_prices(strikes)
+                yield 'BinomialTreeModel', lattice_type.value, exercise_style.value, steps, binomial
+
+    for simulation_mode, simulations in [(SIMULATION_MODE.FULL_PATHS, grid['full_paths_simulations']),
+                                         (SIMULATION_MODE.TERMINAL, grid['monte_carlo_simulations']),
+                                         (SIMULATION_MODE.STREAMING, grid['monte_carlo_simulations'])]:
+        for number_of_simulations in simulations:
+            def monte_carlo(days, strikes, number_of_simulations=number_of_simulations, simulation_mode=simulation_mode.value):
+                call_prices, put_prices = [], []
+                for K in strikes:
+                    MC = MonteCarloPricing(SPOT_PRICE, K, days, RISK_FREE_RATE, SIGMA, number_of_simulations, simulation_mode, seed=SEED)
+                    MC.simulate_prices()
+                    call_prices.append(MC._calculate_option_price(OPTION_TYPE.CALL_OPTION.value))
+                    put_prices.append(MC._calculate_option_price(OPTION_TYPE.PUT_OPTION.value))
+                return call_prices, put_prices
+            yield 'MonteCarloPricing', simulation_mode.value, EXERCISE_STYLE.EUROPEAN.value, number_of_simulations, monte_carlo
+
+    for number_of_simulations in grid['lsm_simulations']:
+        def least_squares_monte_carlo(days, strikes, number_of_simulations=number_of_simulations):
+            AP = AmericanPricing(SPOT_PRICE, strikes[0], days, RISK_FREE_RATE, SIGMA, number_of_simulations, SEED)
+            ladder = AP.calculate_option_price_ladder(strikes)
+            return ladder['american_call'], ladder['american_put']
+        yield 'AmericanPricing', 'LSM strike ladder', EXERCISE_STYLE.AMERICAN.value, number_of_simulations, least_squares_monte_carlo
+
+    for exercise_style in EXERCISE_STYLE:
+        for space_steps in grid['finite_difference_steps']:
+            def finite_difference(days, strikes, space_steps=space_steps, exercise_style=exercise_style.value):
+                prices = [FiniteDifferenceModel(SPOT_PRICE, K, days, RISK_FREE_RATE, SIGMA, space_steps, space_steps // 2,
+                                                exercise_style).calculate_option_prices() for K in strikes]
+                return [call for call, _ in prices], [put for _, put in prices]
+            yield 'FiniteDifferenceModel', 'Crank-Nicolson', exercise_style.value, space_steps, finite_difference
+
+
+def option_type_failures(number_of_simulations=2000):
+    """
+    Returns list of (entry point, option type) of AmericanPricing estimates which do not raise ValueError for an unknown
+    option type, or do not return a finite price for call and put.
+    """
+    AP = AmericanPricing(SPOT_PRICE, SPOT_PRICE, DAYS_TO_MATURITY[0], RISK_FREE_RATE, SIGMA, number_of_simulations, SEED)
+    entry_points = {
+        'calculate_option_price_estimate': AP.calculate_option_price_estimate,
+        'calculate_option_price_to_tolerance': lambda option_type: AP.calculate_option_price_to_tolerance(
+            option_type, batch_size=number_of_simulations, max_simulations=2 * number_of_simulations),
+    }
+    failures = []
+    for name, estimate in entry_points.items():
+        for option_type in [OPTION_TYPE.CALL_OPTION.value, OPTION_TYPE.PUT_OPTION.value]:
+            if not np.isfinite(estimate(option_type).price):
+                failures.append((name, option_type))
+        try:
+            estimate('Straddle')
+            failures.append((name, 'Straddle'))
+        except ValueError:
+            pass
+    return failures
+
+
+def run_benchmark(grid=GRID, days_to_maturity=DAYS_TO_MATURITY, moneyness=MONEYNESS):
+    """Returns dataframe with one record per model configuration, resolution and maturity."""
+    strikes = SPOT_PRICE / np.asarray(moneyness)
+    references = {days: reference_prices(days, strikes) for days in days_to_maturity}
+
+    rows = []
+    for model, configuration, exercise_style, resolution, pricer in model_cases(grid):
+        for days in days_to_maturity:
+            (call_prices, put_prices), runtime, peak_memory = measure(lambda: pricer(days, strikes))
+            reference_calls, reference_puts = references[days][exercise_style]
+            rows.append({
+                'model': model,
+                'configuration': configuration,
+                'exercise_style': exercise_style,
+                'resolution': resolution,
+                'days_to_maturity': days,
+                'runtime_s': runtime,
+                'peak_memory_mb': peak_memory,
+                'max_call_error': float(np.max(np.abs(np.asarray(call_prices) - reference_calls))),
+                'max_put_error': float(np.max(np.abs(np.asarray(put_prices) - reference_puts))),
+            })
+    report = pd.DataFrame(rows)
+    report['max_error'] = report[['max_call_error', 'max_put_error']].max(axis=1)
+    return report
+
+
+def environment():
+    """Returns commit and library versions the benchmark was run with."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'pandas': pd.__version__, 'machine': platform.machine(), 'processors': os.cpu_count()}
+
+
+def plot_error_vs_runtime(report, path):
+    """Plots largest error against runtime (log-log), one line per model configuration, averaged over maturities."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(12, 8))
+    summary = report.groupby(['model', 'configuration', 'exercise_style', 'resolution'], as_index=False)[['runtime_s', 'max_error']].mean()
+    for (model, configuration, exercise_style), group in summary.groupby(['model', 'configuration', 'exercise_style']):
+        ax.loglog(group['runtime_s'], group['max_error'].clip(lower=1e-16), 'o-', label=f'{model} {configuration} ({exercise_style})')
+    ax.set_xlabel('Runtime (s)')
+    ax.set_ylabel('Largest absolute error')
+    ax.set_title('Error vs runtime')
+    ax.legend(loc='best', fontsize='small')
+    fig.savefig(path, bbox_inches='tight')
+
+
+def compare(report, baseline_path):
+    """Returns records matched with an earlier run, with runtime ratio (current / baseline) and error change."""
+    with open(baseline_path) as baseline_file:
+        baseline = pd.DataFrame(json.load(baseline_file)['records'])
+    merged = report.merge(baseline, on=KEY_COLUMNS + ['exercise_style'], suffixes=('', '_baseline'))
+    merged['runtime_ratio'] = merged['runtime_s'] / merged['runtime_s_baseline']
+    merged['error_change'] = merged['max_error'] - merged['max_error_baseline']
+    return merged[KEY_COLUMNS + ['exercise_style', 'runtime_s_baseline', 'runtime_s', 'runtime_ratio', 'max_error_baseline', 'max_error', 'error_change']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speed, memory and accuracy benchmark of pricing models.')
+    parser.add_argument('--quick', action='store_true', help='smaller grid for a fast check')
+    parser.add_argument('--json', help='path of machine-readable results')
+    parser.add_argument('--plot', help='path of error vs runtime chart')
+    parser.add_argument('--compare', help='results of an earlier run to compare against')
+    arguments = parser.parse_args()
+
+    failures = option_type_failures()
+    for name, option_type in failures:
+        print(f'FAIL AmericanPricing.{name}({option_type!r}): no ValueError for unknown option type or no finite price')
+
+    report = run_benchmark(QUICK_GRID if arguments.quick else GRID)
+    with pd.option_context('display.max_rows', None, 'display.width', 160):
+        print(report.drop(columns=['max_call_error', 'max_put_error']).to_string(index=False, float_format=lambda x: f'{x:.3e}'))
+
+    if arguments.json:
+        with open(arguments.json, 'w') as results_file:
+            json.dump({'environment': environment(), 'grid': QUICK_GRID if arguments.quick else GRID,
+                       'records': report.to_dict(orient='records')}, results_file, indent=2)
+    if arguments.plot:
+        plot_error_vs_runtime(report, arguments.plot)
+    if arguments.compare:
+        with pd.option_context('display.max_rows', None, 'display.width', 160):
+            print(compare(report, arguments.compare).to_string(index=False, float_format=lambda x: f'{x:.3e}'))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Runtime of historical volatility estimators over a synthetic multi-symbol panel.
+
+Compares the cumulative sum implementation in HistoricalVolatility with pandas rolling windows
+evaluated symbol by symbol, and fails (exit code 1) when estimates differ by more than TOLERANCE.
+
+Usage: python benchmarks/volatility_estimators.py [number_of_symbols] [number_of_days]
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local package imports
+from HistoricalVolatility import HistoricalVolatility, VOLATILITY_ESTIMATOR
+
+
+WINDOW = 21
+TOLERANCE = 1e-10
+SEED = 20
+
+
+def synthetic_panel(number_of_symbols, number_of_days, seed=SEED):
+    """Returns panel of daily OHLC bars with (ticker, column) columns, as returned by Ticker.get_bulk_historical_data."""
+    rng = np.random.default_rng(seed)
+    shape = (number_of_days, number_of_symbols)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, shape), axis=0))
+    open_ = close * np.exp(rng.normal(0, 0.005, shape))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.007, shape)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.007, shape)))
+    index = pd.bdate_range('2000-01-03', periods=number_of_days)
+    return pd.concat({f'S{i}': pd.DataFrame({'Open': open_[:, i], 'High': high[:, i], 'Low': low[:, i], 'Close': close[:, i]}, index=index)
+                      for i in range(number_of_symbols)}, axis=1)
+
+
+def pandas_reference(history, window=WINDOW):
+    """Returns latest annualized estimates of one symbol by every estimator, using pandas rolling windows."""
+    log = np.log
+    returns = log(history['Close'] / history['Close'].shift())
+    overnight = log(history['Open'] / history['Close'].shift())
+    c = log(history['Close'] / history['Open'])
+    u = log(history['High'] / history['Open'])
+    d = log(history['Low'] / history['Open'])
+    rogers_satchell = (u * (u - c) + d * (d - c)).rolling(window).mean()
+    k = 0.34 / (1.34 + (window + 1) / (window - 1))
+    variances = {
+        VOLATILITY_ESTIMATOR.CLOSE_TO_CLOSE.value: returns.rolling(window).var(),
+        VOLATILITY_ESTIMATOR.PARKINSON.value: ((u - d) ** 2 / (4 * np.log(2))).rolling(window).mean(),
+        VOLATILITY_ESTIMATOR.GARMAN_KLASS.value: (0.5 * (u - d) ** 2 - (2 * np.log(2) - 1) * c ** 2).rolling(window).mean(),
+        VOLATILITY_ESTIMATOR.ROGERS_SATCHELL.value: rogers_satchell,
+        VOLATILITY_ESTIMATOR.YANG_ZHANG.value: overnight.rolling(window).var() + k * c.rolling(window).var() + (1 - k) * rogers_satchell,
+    }
+    return pd.Series({estimator: np.sqrt(variance.iloc[-1] * HistoricalVolatility.TRADING_DAYS_PER_YEAR) for estimator, variance in variances.items()})
+
+
+if __name__ == '__main__':
+    number_of_symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    number_of_days = int(sys.argv[2]) if len(sys.argv) > 2 else 2520
+    panel = synthetic_panel(number_of_symbols, number_of_days)
+
+    start = time.perf_counter()
+    estimates = HistoricalVolatility(panel).latest_all(WINDOW)
+    vectorized_runtime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = pd.DataFrame({symbol: pandas_reference(panel[symbol]) for symbol in estimates.index}).T
+    reference_runtime = time.perf_counter() - start
+
+    error = float(np.max(np.abs(estimates.to_numpy() - reference[estimates.columns].to_numpy())))
+    print(f'{number_of_symbols} symbols x {number_of_days} days, window {WINDOW}, all {len(VOLATILITY_ESTIMATOR)} estimators')
+    print(f'HistoricalVolatility   {vectorized_runtime:8.3f} s')
+    print(f'pandas per symbol      {reference_runtime:8.3f} s  speedup={reference_runtime / vectorized_runtime:6.1f}')
+    print(f'largest difference     {error:.3e}  {"ok" if error < TOLERANCE else "FAIL"}')
+    sys.exit(0 if error < TOLERANCE else 1)
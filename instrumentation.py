@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of pricing runs: wall time, allocation sizes and iteration counts of named stages.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+# cProfile, pstats and tracemalloc are imported when profiling or memory tracing is requested, every model imports this module
+
+
+logger = logging.getLogger(__name__)
+
+# Totals of one stage within a run. Stage names of nested stages are joined with '/', e.g. 'AmericanPricing/regression'.
+# allocated_bytes: sizes of arrays reported by the stage, traced_peak_bytes: peak of traced memory above its start
+# (None unless memory is traced)
+StageRecord = namedtuple('StageRecord', ['name', 'seconds', 'calls', 'iterations', 'allocated_bytes', 'traced_peak_bytes'])
+
+# One run: outermost stage of a thread with all stages entered inside it, profile is pstats.Stats when profiled
+RunRecord = namedtuple('RunRecord', ['name', 'thread', 'started', 'seconds', 'stages', 'profile'])
+
+
+class Instrumentation:
+    """
+    Recorder of instrumented runs, active once passed to enable().
+    Model code marks its stages with `with stage(name) as s:` and reports iterations and array sizes with s.record().
+    Stage entered on a thread without an open stage starts a run, stages entered inside it are totalled per name and
+    the run is stored as RunRecord in records (bounded, oldest dropped first) and logged to the 'instrumentation' logger.
+    - trace_memory: tracemalloc is started on enable and peak traced memory of every stage is recorded. Traced memory
+      is process wide, so runs overlapping in other threads are included, and tracing slows allocations down.
+    - profile: every run is profiled with cProfile, its pstats.Stats is kept in the run record.
+    Thread safe, every thread has its own stack of open stages.
+    """
+
+    def __init__(self, max_records=1000, trace_memory=False, profile=False, log_level=logging.DEBUG):
+        """
+        max_records: number of latest runs kept in records
+        trace_memory: records peak traced memory of stages with tracemalloc
+        profile: profiles every run with cProfile
+        log_level: level of the log message of every finished run
+        """
+        self.records = deque(maxlen=max_records)
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.log_level = log_level
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracing = False
+
+    def stage(self, name):
+        """Returns context manager timing stage name, see module function stage."""
+        return _Stage(self, name)
+
+    @contextmanager
+    def capture(self):
+        """Context manager collecting records of runs finished on this thread inside the block into the yielded list."""
+        runs = []
+        captures = self._thread_state().captures
+        captures.append(runs)
+        try:
+            yield runs
+        finally:
+            captures.remove(runs)
+
+    def clear(self):
+        """Removes all stored run records."""
+        with self._lock:
+            self.records.clear()
+
+    def _thread_state(self):
+        state = self._local
+        if not hasattr(state, 'stack'):
+            state.stack = []
+            state.captures = []
+        return state
+
+    def _start(self):
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+
+    def _stop(self):
+        if self._started_tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _finish_run(self, run):
+        with self._lock:
+            self.records.append(run)
+        for runs in self._thread_state().captures:
+            runs.append(run)
+        if logger.isEnabledFor(self.log_level):
+            logger.log(self.log_level, '%s: %.3f ms [%s]', run.name, run.seconds * 1e3,
+                       ', '.join(f'{stage.name} {stage.seconds * 1e3:.3f} ms' for stage in run.stages[1:]),
+                       extra={'run_record': run})
+
+
+class _Stage:
+    """
+    Context manager of one entered stage. Totals (seconds, calls, iterations, allocated bytes, traced peak) of every
+    stage name are kept in a dictionary shared by all stages of the run, in order of their first entry.
+    """
+
+    __slots__ = ('instrumentation', 'name', 'run', 'started', 'start', 'iterations', 'allocated_bytes', 'traced_start',
+                 'traced_peak', 'profiler')
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.iterations = 0
+        self.allocated_bytes = 0
+        self.traced_start = None
+        self.profiler = None
+
+    def record(self, iterations=0, nbytes=0):
+        """Adds iterations (loop steps, solver iterations, simulated paths) and sizes of allocated arrays in bytes."""
+        self.iterations += iterations
+        self.allocated_bytes += nbytes
+
+    def __enter__(self):
+        stack = self.instrumentation._thread_state().stack
+        if stack:
+            self.name = f'{stack[-1].name}/{self.name}'
+            self.run = stack[-1].run
+            if self.name not in self.run:
+                self.run[self.name] = [0.0, 0, 0, 0, None]
+        else:
+            self.run = {self.name: [0.0, 0, 0, 0, None]}
+            self.started = time.time()
+            if self.instrumentation.profile:
+                import cProfile
+                self.profiler = cProfile.Profile()
+                try:
+                    self.profiler.enable()
+                except ValueError:
+                    # Another profiler is active (e.g. in Python 3.12+ in another thread)
+                    self.profiler = None
+        tracemalloc = _tracemalloc()
+        if tracemalloc is not None:
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+            self.traced_peak = self.traced_start
+            _update_traced_peaks(stack)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        seconds = time.perf_counter() - self.start
+        stack = self.instrumentation._thread_state().stack
+        if self.traced_start is not None and _tracemalloc() is not None:
+            _update_traced_peaks(stack)
+        stack.pop()
+
+        totals = self.run[self.name]
+        totals[0] += seconds
+        totals[1] += 1
+        totals[2] += self.iterations
+        totals[3] += self.allocated_bytes
+        if self.traced_start is not None:
+            totals[4] = max(totals[4] or 0, self.traced_peak - self.traced_start)
+
+        if not stack:
+            profile = None
+            if self.profiler is not None:
+                import pstats
+                self.profiler.disable()
+                profile = pstats.Stats(self.profiler)
+            stages = tuple(StageRecord(name, *totals) for name, totals in self.run.items())
+            self.instrumentation._finish_run(RunRecord(self.name, threading.current_thread().name, self.started, seconds, stages, profile))
+        return False
+
+
+def _tracemalloc():
+    """Returns tracemalloc module while it traces memory, None otherwise (also when it was never imported)."""
+    tracemalloc = sys.modules.get('tracemalloc')
+    return tracemalloc if tracemalloc is not None and tracemalloc.is_tracing() else None
+
+
+def _update_traced_peaks(stack):
+    """Folds peak of traced memory since the last reset into every open stage and resets the peak."""
+    tracemalloc = sys.modules['tracemalloc']
+    peak = tracemalloc.get_traced_memory()[1]
+    for open_stage in stack:
+        if open_stage.traced_start is not None:
+            open_stage.traced_peak = max(open_stage.traced_peak, peak)
+    tracemalloc.reset_peak()
+
+
+class _DisabledStage:
+    """Shared context manager returned by stage() while instrumentation is disabled, it does nothing."""
+
+    __slots__ = ()
+
+    def record(self, iterations=0, nbytes=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+# Instrumentation receiving stages of all threads, None when disabled
+_active = None
+
+
+def enable(instrumentation=None):
+    """Activates instrumentation (new Instrumentation with default settings if None) for all threads, returns it."""
+    global _active
+    instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+    if _active is not None and _active is not instrumentation:
+        _active._stop()
+    instrumentation._start()
+    _active = instrumentation
+    return instrumentation
+
+
+def disable():
+    """Deactivates instrumentation, stages entered afterwards are not recorded. Returns the previously active instrumentation."""
+    global _active
+    instrumentation, _active = _active, None
+    if instrumentation is not None:
+        instrumentation._stop()
+    return instrumentation
+
+
+def active():
+    """Returns active Instrumentation, None when disabled."""
+    return _active
+
+
+def stage(name):
+    """
+    Returns context manager timing stage name of the current run. While instrumentation is disabled a shared
+    do-nothing context manager is returned, so a disabled stage costs one global lookup.
+    Usage: with stage('regression') as s: ... s.record(iterations=n, nbytes=array.nbytes)
+    """
+    if _active is None:
+        return _DISABLED_STAGE
+    return _Stage(_active, name)
+
+
+def instrumented(function):
+    """Decorator running every call of function as stage named by its qualified name."""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _active is None:
+            return function(*args, **kwargs)
+        with _Stage(_active, name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def capture():
+    """
+    Context manager yielding list of run records finished on this thread inside the block (e.g. one pricing job).
+    The list stays empty while instrumentation is disabled.
+    """
+    if _active is None:
+        yield []
+        return
+    with _active.capture() as runs:
+        yield runs
+
+
+def stage_table(runs):
+    """
+    Returns list of dictionaries (one per stage of every run) for display or pandas.DataFrame: run, thread, stage,
+    seconds, share of the run time, calls, iterations, allocated and traced peak megabytes.
+    """
+    rows = []
+    for run in runs:
+        for record in run.stages:
+            rows.append({'run': run.name, 'thread': run.thread, 'stage': record.name, 'seconds': record.seconds,
+                         'share': record.seconds / run.seconds if run.seconds > 0 else 0.0, 'calls': record.calls,
+                         'iterations': record.iterations, 'allocated_mb': record.allocated_bytes / 2 ** 20,
+                         'traced_peak_mb': record.traced_peak_bytes / 2 ** 20 if record.traced_peak_bytes is not None else None})
+    return rows
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Background execution of long pricing jobs with progress reporting and cancellation.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+# Local package imports
+from instrumentation import capture
+
+
+class JOB_STATUS(Enum):
+    PENDING = 'Pending'
+    RUNNING = 'Running'
+    DONE = 'Done'
+    CANCELLED = 'Cancelled'
+    FAILED = 'Failed'
+
+
+class JobCancelled(Exception):
+    """Raised from PricingJob.report inside the job function once the job was cancelled."""
+
+
+class PricingJob:
+    """
+    State of one job shared between the worker running it and the page displaying it.
+    Job function receives the job as first argument and calls report() with its progress (0 to 1) and optional
+    partial result (e.g. running Monte Carlo estimates). Cancellation is cooperative: report() raises JobCancelled
+    when the job was cancelled, so the function stops at its next progress report.
+    While instrumentation is enabled, records of runs on the job's thread are collected in runs (see instrumentation.py).
+    """
+
+    def __init__(self, name):
+        """name: identifies the request the job computes (e.g. page and its parameters)"""
+        self.name = name
+        self.status = JOB_STATUS.PENDING
+        self.progress = 0.0
+        self.partial_result = None
+        self.result = None
+        self.error = None
+        self.runs = []
+        self._cancel_requested = threading.Event()
+        self._finished = threading.Event()
+        self.future = None
+
+    def report(self, progress, partial_result=None):
+        """Publishes progress and partial result of the job, raises JobCancelled when the job was cancelled."""
+        if self._cancel_requested.is_set():
+            raise JobCancelled(self.name)
+        self.progress = progress
+        if partial_result is not None:
+            self.partial_result = partial_result
+
+    def cancel(self):
+        """Requests cancellation. Pending job is dropped, running job stops at its next progress report."""
+        self._cancel_requested.set()
+        if self.future is not None and self.future.cancel():
+            self._finish(JOB_STATUS.CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancel_requested.is_set()
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """Waits until the job finishes, returns True if it did within timeout seconds."""
+        return self._finished.wait(timeout)
+
+    def _finish(self, status, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.status = status
+        if status == JOB_STATUS.DONE:
+            self.progress = 1.0
+        self._finished.set()
+
+
+class JobExecutor:
+    """
+    Pool of worker threads running pricing jobs. Jobs are submitted in groups (e.g. one group per app session):
+    new job of a group supersedes the previous one, which gets cancelled.
+    """
+
+    def __init__(self, max_workers=2):
+        """max_workers: number of jobs running at the same time"""
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix='pricing-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, group, name, function, *args, **kwargs):
+        """
+        Submits function(job, *args, **kwargs) as new job of the group, cancelling the group's previous job.
+        Returns PricingJob.
+        """
+        job = PricingJob(name)
+        with self._lock:
+            previous = self._jobs.get(group)
+            self._jobs[group] = job
+        if previous is not None and not previous.done:
+            previous.cancel()
+        job.future = self._pool.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def current_job(self, group):
+        """Returns the latest job submitted in the group, or None."""
+        with self._lock:
+            return self._jobs.get(group)
+
+    def shutdown(self):
+        """Cancels all unfinished jobs and stops the workers."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._pool.shutdown(wait=False)
+
+    @staticmethod
+    def _run(job, function, args, kwargs):
+        if job.cancelled:
+            job._finish(JOB_STATUS.CANCELLED)
+            return
+        job.status = JOB_STATUS.RUNNING
+        try:
+            with capture() as job.runs:
+                result = function(job, *args, **kwargs)
+        except JobCancelled:
+            job._finish(JOB_STATUS.CANCELLED)
+        except Exception as e:
+            job._finish(JOB_STATUS.FAILED, error=e)
+        else:
+            job._finish(JOB_STATUS.DONE, result=result)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled kernels of the hot loops of the pricing models, with Numba as optional dependency.
+
+Kernels are plain Python loops over single elements which update arrays in place, so compiled with Numba
+they run without interpreter overhead and without temporary arrays per step. Without Numba the models
+use their NumPy array code (NumPy backend).
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import importlib.util
+import math
+import os
+import threading
+from collections import namedtuple
+from enum import Enum
+
+# Third party imports
+import numpy as np
+
+
+class KERNEL_BACKEND(Enum):
+    NUMPY = 'NumPy'
+    NUMBA = 'Numba'
+    PYTHON = 'Python'       # kernels interpreted without compilation, only for checking kernel logic on small problems
+
+
+Kernels = namedtuple('Kernels', ['american_sweep', 'geometric_brownian_paths', 'lsm_normal_equations', 'lsm_exercise'])
+
+
+def _american_sweep(V, S, strikes, payoff_signs, log_u, log_d, p, discount, half_band):
+    """
+    Backward induction of BinomialTreeModel with early exercise check at every node, V is overwritten.
+    V: option values at the last lattice layer, one column per option
+    log_u, log_d, p: lattice parameters, one value per column
+    half_band: half width of the band of nodes evaluated in each layer, in nodes
+    Returns option values at the root.
+    """
+    last_layer = V.shape[0] - 1
+    columns = V.shape[1]
+    p_min = p.min()
+    p_max = p.max()
+
+    for i in range(last_layer - 1, -1, -1):
+        lo = max(0, int(math.ceil(i * p_min - half_band)))
+        hi = min(i, int(i * p_max + half_band))
+        for j in range(lo, hi + 1):
+            for c in range(columns):
+                continuation = V[j, c] * (discount * (1.0 - p[c])) + V[j + 1, c] * (discount * p[c])
+                exercise = payoff_signs[c] * (S * math.exp(j * log_u[c] + (i - j) * log_d[c]) - strikes[c])
+                V[j, c] = max(continuation, exercise)
+
+    return V[0].copy()
+
+
+def _geometric_brownian_paths(S, drift, volatility, start, stop):
+    """
+    Turns standard normal draws Z stored in rows start to stop - 1 of S into prices in place:
+    S[t] = S[t - 1] * exp(drift + volatility * Z[t])
+    """
+    for t in range(start, stop):
+        for n in range(S.shape[1]):
+            S[t, n] = S[t - 1, n] * math.exp(drift + volatility * S[t, n])
+
+
+def _lsm_normal_equations(S_t, center, scale, strikes, payoff_signs, values, expiring, alive, discount, degree):
+    """
+    One pass of AmericanPricing over all paths on day t:
+    - values of options alive after day t (maturities from alive on) are discounted by one day,
+    - options expiring on day t (maturities expiring to alive - 1) receive their exercise value,
+    - normal equations of in-the-money paths are accumulated, Laguerre basis of (S_t - center) / scale is evaluated on the fly.
+    values: discounted cash flows of shape (paths, maturities, columns), updated in place
+    Returns tuple (exercise_values, itm_counts, gram, projection) with gram of shape (columns, basis, basis)
+    and projection of shape (alive maturities, columns, basis).
+    """
+    paths, maturities, columns = values.shape
+    k = degree + 1
+    exercise_values = np.empty((paths, columns))
+    itm_counts = np.zeros(columns, dtype=np.int64)
+    gram = np.zeros((columns, k, k))
+    projection = np.zeros((maturities - alive, columns, k))
+    basis = np.empty(k)
+
+    for n in range(paths):
+        x = (S_t[n] - center) / scale
+        basis[0] = 1.0
+        if k > 1:
+            basis[1] = 1.0 - x
+        for d in range(2, k):
+            basis[d] = (basis[d - 1] * (2 * d - 1 - x) - basis[d - 2] * (d - 1)) / d
+
+        for c in range(columns):
+            exercise = max(payoff_signs[c] * (S_t[n] - strikes[c]), 0.0)
+            exercise_values[n, c] = exercise
+            for m in range(expiring, alive):
+                values[n, m, c] = exercise
+            for m in range(alive, maturities):
+                values[n, m, c] *= discount
+            if exercise > 0:
+                itm_counts[c] += 1
+                for a in range(k):
+                    for b in range(k):
+                        gram[c, a, b] += basis[a] * basis[b]
+                    for m in range(alive, maturities):
+                        projection[m - alive, c, a] += basis[a] * values[n, m, c]
+
+    return exercise_values, itm_counts, gram, projection
+
+
+def _lsm_exercise(S_t, center, scale, exercise_values, active, coefficients, values, alive):
+    """
+    Exercises in-the-money paths of active columns where exercise value is higher than the regressed continuation value.
+    coefficients: regression coefficients of shape (alive maturities, columns, basis)
+    values: discounted cash flows of shape (paths, maturities, columns), updated in place
+    """
+    paths, maturities, columns = values.shape
+    k = coefficients.shape[2]
+    basis = np.empty(k)
+
+    for n in range(paths):
+        x = (S_t[n] - center) / scale
+        basis[0] = 1.0
+        if k > 1:
+            basis[1] = 1.0 - x
+        for d in range(2, k):
+            basis[d] = (basis[d - 1] * (2 * d - 1 - x) - basis[d - 2] * (d - 1)) / d
+
+        for c in range(columns):
+            exercise = exercise_values[n, c]
+            if exercise <= 0 or not active[c]:
+                continue
+            for m in range(alive, maturities):
+                continuation = 0.0
+                for a in range(k):
+                    continuation += basis[a] * coefficients[m - alive, c, a]
+                if exercise > continuation:
+                    values[n, m, c] = exercise
+
+
+# Backend selected with set_backend or OPTION_PRICING_BACKEND environment variable, None selects automatically
+_backend = os.environ.get('OPTION_PRICING_BACKEND')
+_kernels = {}
+_lock = threading.Lock()
+
+
+def numba_available():
+    """Returns True when Numba is installed."""
+    return importlib.util.find_spec('numba') is not None
+
+
+def set_backend(backend=None):
+    """
+    Selects backend of the hot loops of all models.
+    backend: KERNEL_BACKEND value, None uses Numba when installed and NumPy otherwise
+    """
+    global _backend
+    if backend is not None and backend not in [kernel_backend.value for kernel_backend in KERNEL_BACKEND]:
+        raise ValueError(f'Unknown kernel backend {backend}')
+    if backend == KERNEL_BACKEND.NUMBA.value and not numba_available():
+        raise ImportError('Numba backend requires numba package')
+    _backend = backend
+
+
+def get_backend():
+    """Returns KERNEL_BACKEND value in use. Numba falls back to NumPy when it is not installed."""
+    if _backend is None or _backend == KERNEL_BACKEND.NUMBA.value:
+        return KERNEL_BACKEND.NUMBA.value if numba_available() else KERNEL_BACKEND.NUMPY.value
+    return _backend
+
+
+def get_kernels():
+    """Returns Kernels of the backend in use, None with NumPy backend. Numba kernels are compiled on first use."""
+    backend = get_backend()
+    if backend == KERNEL_BACKEND.NUMPY.value:
+        return None
+    with _lock:
+        if backend not in _kernels:
+            kernels = Kernels(_american_sweep, _geometric_brownian_paths, _lsm_normal_equations, _lsm_exercise)
+            if backend == KERNEL_BACKEND.NUMBA.value:
+                import numba
+                # Compiled kernels release the GIL, so models run them in parallel in thread pools
+                kernels = Kernels(*(numba.njit(cache=True, nogil=True)(kernel) for kernel in kernels))
+            _kernels[backend] = kernels
+        return _kernels[backend]
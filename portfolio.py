@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Portfolio of option positions revalued over grids of spot, volatility and rate scenarios.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+from collections import namedtuple
+
+# Third party imports
+import numpy as np
+
+# Local package imports
+from base import OPTION_TYPE, EXERCISE_STYLE, PRICING_MODEL
+from BlackScholesModel import BlackScholesModel
+from BinomialTreeModel import BinomialTreeModel, LATTICE_TYPE
+from MonteCarloSimulation import MonteCarloPricing, SIMULATION_MODE
+from AmericanPricing import AmericanPricing
+from instrumentation import stage, instrumented
+
+
+# Shocks of the scenario cube: spot shocks are relative (0.1 = +10%), volatility and rate shocks are absolute (0.01 = +1 point)
+ScenarioGrid = namedtuple('ScenarioGrid', ['spot_shocks', 'volatility_shocks', 'rate_shocks'], defaults=[(0.0,), (0.0,)])
+
+# Model of every position is stored as index into MODELS
+MODELS = list(PRICING_MODEL)
+
+
+class Portfolio:
+    """
+    Book of option positions held as arrays (quantity, strike, maturity, type, style, model, underlying), revalued over
+    the cube of spot x volatility x rate scenarios of a ScenarioGrid:
+    - Black-Scholes positions: whole cube for a chunk of positions in one broadcast batch formula call.
+    - Binomial positions: one lattice per underlying, maturity, exercise style and scenario for all strikes.
+    - Monte Carlo positions: one set of terminal normal draws per underlying and maturity shared by every scenario
+      (common random numbers), payoffs of all strikes come from cumulative sums of the sorted terminal prices.
+    - LSM positions: one path set per underlying and scenario (same seed in every scenario) up to the longest LSM maturity
+      of the underlying, only the strike/maturity pairs of the positions are regressed over it.
+    Numerical engines price spot shocks through homogeneity of prices in spot and strike, V(a S, K) = a V(S, K / a),
+    so they are called once per volatility and rate scenario with strikes scaled by every spot shock.
+    Positions are revalued chunk by chunk, so intermediate arrays hold at most max_chunk_elements scenario prices
+    (LSM positions of an underlying form one chunk and their regressions are blocked instead).
+    """
+
+    def __init__(self, spot_prices, sigmas, risk_free_rate=0.05, number_of_time_steps=200, lattice_type=LATTICE_TYPE.LEISEN_REIMER.value,
+                 number_of_simulations=100000, lsm_simulations=10000, seed=20, max_chunk_elements=2 ** 22):
+        """
+        spot_prices: dictionary of current spot prices by underlying symbol
+        sigmas: dictionary of volatilities by underlying symbol
+        risk_free_rate: returns on risk-free assets (assumed to be constant until expiry date)
+        number_of_time_steps: steps of binomial lattices
+        lattice_type: LATTICE_TYPE value of binomial lattices
+        number_of_simulations: simulated terminal prices of Monte Carlo positions
+        lsm_simulations: simulated paths of LSM positions
+        seed: seed of random number generators, shared by all scenarios
+        max_chunk_elements: largest number of scenario prices (positions x scenarios) or LSM cash flows (paths x pairs)
+        calculated at once
+        """
+        self.symbols = list(spot_prices)
+        self.spot_prices = np.array([spot_prices[symbol] for symbol in self.symbols], dtype=float)
+        self.sigmas = np.array([sigmas[symbol] for symbol in self.symbols], dtype=float)
+        self.r = risk_free_rate
+        self.number_of_time_steps = number_of_time_steps
+        self.lattice_type = lattice_type
+        self.number_of_simulations = number_of_simulations
+        self.lsm_simulations = lsm_simulations
+        self.seed = seed
+        self.max_chunk_elements = max_chunk_elements
+
+        # Positions
+        self.underlying = np.empty(0, dtype=np.int32)
+        self.quantity = np.empty(0)
+        self.strike = np.empty(0)
+        self.days_to_maturity = np.empty(0, dtype=np.int32)
+        self.call = np.empty(0, dtype=bool)
+        self.american = np.empty(0, dtype=bool)
+        self.model = np.empty(0, dtype=np.int8)
+
+    def __len__(self):
+        return self.quantity.size
+
+    def add_positions(self, symbols, quantities, strike_prices, days_to_maturity, option_types,
+                      exercise_styles=EXERCISE_STYLE.EUROPEAN.value, models=PRICING_MODEL.BLACK_SCHOLES.value):
+        """
+        Appends positions, every parameter is a scalar or array broadcast against the others.
+        symbols: underlying symbols, given in spot_prices of the constructor
+        quantities: number of contracts, negative for short positions
+        option_types: 'Call Option' or 'Put Option'
+        exercise_styles: 'European' or 'American'
+        models: PRICING_MODEL values
+        """
+        symbols, quantities, strike_prices, days_to_maturity, option_types, exercise_styles, models = np.broadcast_arrays(
+            np.asarray(symbols, dtype=object), quantities, strike_prices, days_to_maturity, np.asarray(option_types, dtype=object),
+            np.asarray(exercise_styles, dtype=object), np.asarray(models, dtype=object))
+
+        unknown = set(symbols.ravel()) - set(self.symbols)
+        if unknown:
+            raise ValueError(f'No spot price and sigma of {sorted(unknown)}')
+        model_values = [model.value for model in MODELS]
+        if not set(models.ravel()) <= set(model_values):
+            raise ValueError(f'Unknown models {sorted(set(models.ravel()) - set(model_values))}')
+        if not set(option_types.ravel()) <= {option_type.value for option_type in OPTION_TYPE}:
+            raise ValueError('Option types have to be Call Option or Put Option')
+        if not set(exercise_styles.ravel()) <= {exercise_style.value for exercise_style in EXERCISE_STYLE}:
+            raise ValueError('Exercise styles have to be European or American')
+        if np.any(np.asarray(days_to_maturity) < 1):
+            raise ValueError('Days to maturity have to be at least 1')
+
+        call = option_types.ravel() == OPTION_TYPE.CALL_OPTION.value
+        american = exercise_styles.ravel() == EXERCISE_STYLE.AMERICAN.value
+        model = np.array([model_values.index(value) for value in models.ravel()], dtype=np.int8)
+        if np.any(american & ~call & (model == MODELS.index(PRICING_MODEL.BLACK_SCHOLES))):
+            raise ValueError('Black-Scholes model has no American put price, use LSM or Binomial model')
+        if np.any(american & (model == MODELS.index(PRICING_MODEL.MONTE_CARLO))):
+            raise ValueError('Monte Carlo model prices European positions only, use LSM or Binomial model')
+
+        self.underlying = np.concatenate([self.underlying, [self.symbols.index(symbol) for symbol in symbols.ravel()]]).astype(np.int32)
+        self.quantity = np.concatenate([self.quantity, np.asarray(quantities, dtype=float).ravel()])
+        self.strike = np.concatenate([self.strike, np.asarray(strike_prices, dtype=float).ravel()])
+        self.days_to_maturity = np.concatenate([self.days_to_maturity, np.asarray(days_to_maturity).ravel()]).astype(np.int32)
+        self.call = np.concatenate([self.call, call])
+        self.american = np.concatenate([self.american, american])
+        self.model = np.concatenate([self.model, model])
+
+    @instrumented
+    def present_values(self):
+        """Returns value (quantity x price) of every position without shocks."""
+        base = ScenarioGrid((0.0,), (0.0,), (0.0,))
+        values = np.empty(len(self))
+        for positions in self._chunks(base):
+            values[positions] = self._prices(base, positions)[0, 0, 0] * self.quantity[positions]
+        return values
+
+    def revalue_chunks(self, scenarios):
+        """
+        Yields (positions, pnl) for chunks of positions: indices of the positions and their P&L under every scenario,
+        array of shape (spot shocks, volatility shocks, rate shocks, positions). Base values are priced with the same
+        lattices and random numbers as the scenarios, so P&L of numerical models contains no sampling noise of zero shocks.
+        """
+        base = ScenarioGrid((0.0,), (0.0,), (0.0,))
+        for positions in self._chunks(scenarios):
+            scenario_prices = self._prices(scenarios, positions)
+            base_prices = self._prices(base, positions)[0, 0, 0]
+            yield positions, (scenario_prices - base_prices) * self.quantity[positions]
+
+    @instrumented
+    def revalue(self, scenarios, by_position=False):
+        """
+        Revalues the book over the scenario cube.
+        scenarios: ScenarioGrid of spot, volatility and rate shocks
+        by_position: if True, P&L of every position is returned, otherwise P&L of the book
+
+        Returns P&L tensor of shape (spot shocks, volatility shocks, rate shocks), with positions as last axis if by_position.
+        """
+        shape = tuple(np.size(shocks) for shocks in scenarios)
+        pnl = np.zeros(shape + (len(self),)) if by_position else np.zeros(shape)
+        for positions, chunk_pnl in self.revalue_chunks(scenarios):
+            if by_position:
+                pnl[..., positions] = chunk_pnl
+            else:
+                pnl += chunk_pnl.sum(axis=-1)
+        return pnl
+
+    def _chunks(self, scenarios):
+        """
+        Yields index arrays of positions priced together: groups sharing an engine call, split so that neither scenario
+        prices nor working arrays of lattices (time steps x strikes) exceed max_chunk_elements.
+        LSM positions of an underlying are not split, so every scenario simulates their path set once; _price_lsm bounds
+        their working arrays by blocking the regressions.
+        """
+        number_of_scenarios = int(np.prod([np.size(shocks) for shocks in scenarios]))
+        working_size = {PRICING_MODEL.BLACK_SCHOLES: 1, PRICING_MODEL.MONTE_CARLO: 1, PRICING_MODEL.LSM: 1,
+                        PRICING_MODEL.BINOMIAL: (self.number_of_time_steps + 1) * np.size(scenarios.spot_shocks)}
+
+        for model in MODELS:
+            positions = np.flatnonzero(self.model == MODELS.index(model))
+            if positions.size == 0:
+                continue
+            chunk_size = max(1, self.max_chunk_elements // max(number_of_scenarios, working_size[model]))
+            if model == PRICING_MODEL.BLACK_SCHOLES:
+                keys = np.zeros((positions.size, 1))
+            elif model == PRICING_MODEL.BINOMIAL:
+                keys = np.column_stack([self.underlying[positions], self.days_to_maturity[positions], self.american[positions]])
+            elif model == PRICING_MODEL.MONTE_CARLO:
+                keys = np.column_stack([self.underlying[positions], self.days_to_maturity[positions]])
+            else:
+                keys = self.underlying[positions][:, None]
+            _, group_index = np.unique(keys, axis=0, return_inverse=True)
+            for group in range(group_index.max() + 1):
+                group_positions = positions[group_index.ravel() == group]
+                group_chunk_size = group_positions.size if model == PRICING_MODEL.LSM else chunk_size
+                for start in range(0, group_positions.size, group_chunk_size):
+                    yield group_positions[start:start + group_chunk_size]
+
+    def _prices(self, scenarios, positions):
+        """
+        Returns option prices of positions (one engine group) under every scenario.
+        Instrumented as stage named by the model, iterations count engine calls.
+        """
+        spot_shocks, volatility_shocks, rate_shocks = (np.atleast_1d(np.asarray(shocks, dtype=float)) for shocks in scenarios)
+        if np.any(self.sigmas[self.underlying[positions]].min() + volatility_shocks <= 0):
+            raise ValueError('Volatility shocks make sigma non-positive')
+
+        model = MODELS[self.model[positions[0]]]
+        with stage(model.value) as instrumented_stage:
+            if model == PRICING_MODEL.BLACK_SCHOLES:
+                prices = self._price_black_scholes(positions, spot_shocks, volatility_shocks, rate_shocks)
+                instrumented_stage.record(iterations=1, nbytes=prices.nbytes)
+                return prices
+
+            # Numerical engines: one engine call per volatility and rate scenario for the whole group, which shares underlying
+            price_group = {PRICING_MODEL.BINOMIAL: self._price_binomial, PRICING_MODEL.MONTE_CARLO: self._price_monte_carlo,
+                           PRICING_MODEL.LSM: self._price_lsm}[model]
+            prices = np.empty((spot_shocks.size, volatility_shocks.size, rate_shocks.size, positions.size))
+            spot = self.spot_prices[self.underlying[positions[0]]]
+            sigma = self.sigmas[self.underlying[positions[0]]]
+            scales = 1 + spot_shocks
+            # Strikes of every spot shock (rows) and position (columns) priced at unshocked spot
+            scaled_strikes = self.strike[positions][None, :] / scales[:, None]
+            for j, volatility_shock in enumerate(volatility_shocks):
+                for k, rate_shock in enumerate(rate_shocks):
+                    call_prices, put_prices = price_group(positions, spot, scaled_strikes, sigma + volatility_shock, self.r + rate_shock)
+                    prices[:, j, k] = scales[:, None] * self._select(positions, call_prices, put_prices)
+            instrumented_stage.record(iterations=volatility_shocks.size * rate_shocks.size, nbytes=prices.nbytes)
+            return prices
+
+    def _select(self, positions, call_prices, put_prices):
+        return np.where(self.call[positions], call_prices, put_prices)
+
+    def _price_black_scholes(self, positions, spot_shocks, volatility_shocks, rate_shocks):
+        """Prices of the cube (spot, volatility, rate, positions) from one broadcast batch formula call."""
+        underlying = self.underlying[positions]
+        S = self.spot_prices[underlying] * (1 + spot_shocks[:, None, None, None])
+        sigma = self.sigmas[underlying] + volatility_shocks[None, :, None, None]
+        r = self.r + rate_shocks[None, None, :, None]
+        call_prices, put_prices = BlackScholesModel.calculate_option_prices(S, self.strike[positions], self.days_to_maturity[positions], r, sigma)
+        return self._select(positions, call_prices, put_prices)
+
+    def _price_binomial(self, positions, spot, strikes, sigma, r):
+        """
+        Call and put prices for strikes of shape (spot shocks, positions), positions with the same underlying, maturity
+        and style, from one lattice over all strikes.
+        """
+        unique_strikes, strike_index = np.unique(strikes, return_inverse=True)
+        BOPM = BinomialTreeModel(spot, unique_strikes[0], int(self.days_to_maturity[positions[0]]), r, sigma, self.number_of_time_steps,
+                                 EXERCISE_STYLE.AMERICAN.value if self.american[positions[0]] else EXERCISE_STYLE.EUROPEAN.value,
+                                 self.lattice_type)
+        call_prices, put_prices = BOPM.calculate_option_prices(unique_strikes)
+        return call_prices[strike_index].reshape(strikes.shape), put_prices[strike_index].reshape(strikes.shape)
+
+    def _price_monte_carlo(self, positions, spot, strikes, sigma, r):
+        """
+        Call and put prices for strikes of shape (spot shocks, positions), positions with the same underlying and maturity.
+        Simulated terminal prices S_T are sorted once, so for every strike K:
+        E[max(S_T - K, 0)] = (sum of S_T above K - K * count above K) / N, and put accordingly below K.
+        """
+        days = int(self.days_to_maturity[positions[0]])
+        MC = MonteCarloPricing(spot, self.strike[positions[0]], days, r, sigma, self.number_of_simulations, SIMULATION_MODE.TERMINAL.value)
+        S_T = np.sort(MC._terminal_prices(np.random.default_rng(self.seed).standard_normal(self.number_of_simulations)))
+        cumulative = np.concatenate([[0.0], np.cumsum(S_T)])
+
+        below = np.searchsorted(S_T, strikes)
+        discount = np.exp(-r * MC.T) / S_T.size
+        call_prices = discount * (cumulative[-1] - cumulative[below] - strikes * (S_T.size - below))
+        put_prices = discount * (strikes * below - cumulative[below])
+        return call_prices, put_prices
+
+    def _price_lsm(self, positions, spot, strikes, sigma, r):
+        """
+        Call and put prices for strikes of shape (spot shocks, positions), positions with the same underlying.
+        Path set is simulated up to the longest maturity of all LSM positions of the underlying in the book, so prices do
+        not depend on which positions are priced together. Only (strike, maturity) pairs of the positions are priced,
+        sorted by maturity in blocks whose LSM cash flows (paths x pairs) stay below max_chunk_elements.
+        """
+        lsm_positions = (self.underlying == self.underlying[positions[0]]) & (self.model == MODELS.index(PRICING_MODEL.LSM))
+        AP = AmericanPricing(spot, strikes.flat[0], int(self.days_to_maturity[lsm_positions].max()), r, sigma, self.lsm_simulations, self.seed)
+
+        maturities = np.broadcast_to(self.days_to_maturity[positions], strikes.shape)
+        pairs, pair_index = np.unique(np.column_stack([maturities.ravel(), strikes.ravel()]), axis=0, return_inverse=True)
+        pair_index = pair_index.reshape(strikes.shape)
+        keys = ['american_call', 'american_put', 'european_call', 'european_put']
+        prices = {key: np.empty(pairs.shape[0]) for key in keys}
+        # Every pair has a call and a put column
+        block_size = max(1, self.max_chunk_elements // (2 * self.lsm_simulations))
+        for start in range(0, pairs.shape[0], block_size):
+            block = pairs[start:start + block_size]
+            block_prices = AP.calculate_option_price_pairs(block[:, 1], block[:, 0].astype(int))
+            for key in keys:
+                prices[key][start:start + block_size] = block_prices[key]
+
+        american = self.american[positions]
+        call_prices = np.where(american, prices['american_call'][pair_index], prices['european_call'][pair_index])
+        put_prices = np.where(american, prices['american_put'][pair_index], prices['european_put'][pair_index])
+        return call_prices, put_prices
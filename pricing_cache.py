@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Memoization of option prices shared by all pricing models.
+
+@author: Gilberto
+"""
+
+# Standard library imports
+import hashlib
+import json
+import math
+import numbers
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import closing
+
+
+CacheStatistics = namedtuple('CacheStatistics', ['hits', 'misses', 'disk_hits', 'evictions', 'size', 'hit_rate'])
+
+
+class PricingCache:
+    """
+    Cache of option prices keyed by canonical model parameters, used by OptionPricingModel._calculate_option_price
+    and the estimate and ladder methods of the models once assigned to OptionPricingModel.pricing_cache (or to
+    pricing_cache of a single model class or instance). Results other than single prices (estimates, tuples and
+    dictionaries of price arrays) are kept in plain form of lists, dictionaries and numbers.
+    - In-memory entries are evicted in least recently used order above max_size and after ttl seconds.
+    - With directory, entries are also stored in a SQLite database shared by all processes using the same directory,
+      so workers of the app benefit from prices calculated by each other.
+    Thread safe.
+    """
+
+    # File name of the shared on-disk store
+    DATABASE_NAME = 'pricing_cache.sqlite'
+    # Version of the on-disk table, stores of older versions are emptied and recreated when opened
+    SCHEMA_VERSION = 2
+
+    def __init__(self, max_size=10000, ttl=3600, directory=None):
+        """
+        max_size: maximum number of entries kept in memory
+        ttl: age in seconds after which entry is no longer used, None keeps entries until evicted by size
+        directory: directory of the shared on-disk store, None keeps prices only in memory
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            with closing(self._connect()) as connection, connection:
+                # Version is checked inside a write transaction, so only one process recreates an outdated table
+                connection.execute('BEGIN IMMEDIATE')
+                if connection.execute('PRAGMA user_version').fetchone()[0] < self.SCHEMA_VERSION:
+                    # Version 1 stored prices in a REAL column, which turned JSON scalars of plain results into numbers
+                    connection.execute('DROP TABLE IF EXISTS prices')
+                    connection.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+                connection.execute('CREATE TABLE IF NOT EXISTS prices (key TEXT PRIMARY KEY, value TEXT, created REAL)')
+
+    @staticmethod
+    def canonical_key(*parts):
+        """
+        Builds canonical key from parts (class name, option type, parameters...). Floats are rounded to 12 significant
+        digits, so prices of numerically identical inputs share one entry. Returns hex digest of the key.
+        """
+        def canonical(value):
+            if isinstance(value, bool) or value is None or isinstance(value, str):
+                return value
+            if hasattr(value, 'tolist'):
+                # numpy arrays and scalars
+                return canonical(value.tolist())
+            if isinstance(value, (tuple, list)):
+                return [canonical(item) for item in value]
+            if not math.isfinite(value):
+                return str(float(value))
+            rounded = float(f'{float(value):.12g}')
+            return int(rounded) if rounded.is_integer() and abs(rounded) < 2 ** 53 else rounded
+
+        return hashlib.sha256(json.dumps(canonical(parts), separators=(',', ':')).encode()).hexdigest()
+
+    def get_or_calculate(self, key, calculate, decode=None):
+        """
+        Returns cached price of key, or calculates it with calculate() and stores it. Negative prices (errors) and None are not stored.
+        Other results are stored in plain form (see _plain), decode(plain) rebuilds the result when it is served from the cache.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._decode(entry[0], decode)
+
+        row = self._read_disk(key, now)
+        if row is not None:
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+            self._store(key, row[0], row[1], write_disk=False)
+            return self._decode(row[0], decode)
+
+        with self._lock:
+            self.misses += 1
+        value = calculate()
+        if isinstance(value, numbers.Real):
+            if value >= 0:
+                self._store(key, value, time.time())
+        elif value is not None:
+            self._store(key, self._plain(value), time.time())
+        return value
+
+    def statistics(self):
+        """Returns CacheStatistics with hit/miss counts, number of evictions and current number of entries in memory."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return CacheStatistics(self.hits, self.misses, self.disk_hits, self.evictions, len(self._entries),
+                                   self.hits / requests if requests else 0.0)
+
+    def clear(self):
+        """Removes all entries (including the on-disk store) and resets statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.disk_hits = self.evictions = 0
+        if self.directory is not None:
+            with closing(self._connect()) as connection, connection:
+                connection.execute('DELETE FROM prices')
+
+    @staticmethod
+    def _plain(value):
+        """Plain form of result: numpy arrays and scalars as lists and numbers, tuples (also named) as lists."""
+        if hasattr(value, 'tolist'):
+            value = value.tolist()
+        if isinstance(value, dict):
+            return {str(name): PricingCache._plain(item) for name, item in value.items()}
+        if isinstance(value, (tuple, list)):
+            return [PricingCache._plain(item) for item in value]
+        return value
+
+    @staticmethod
+    def _decode(value, decode):
+        return decode(value) if decode is not None and not isinstance(value, numbers.Real) else value
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _store(self, key, value, created, write_disk=True):
+        with self._lock:
+            self._entries[key] = (value, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if write_disk and self.directory is not None:
+            with closing(self._connect()) as connection, connection:
+                # Prices and plain results are stored as JSON text
+                stored = json.dumps(float(value) if isinstance(value, numbers.Real) else value)
+                connection.execute('INSERT OR REPLACE INTO prices VALUES (?, ?, ?)', (key, stored, created))
+
+    def _read_disk(self, key, now):
+        if self.directory is None:
+            return None
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute('SELECT value, created FROM prices WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[1], now):
+                connection.execute('DELETE FROM prices WHERE key = ?', (key,))
+                return None
+        return json.loads(row[0]), row[1]
+
+    def _connect(self):
+        # Connection per operation: SQLite connections cannot be shared between threads, and file locking
+        # of the database serializes writers from different processes
+        return sqlite3.connect(os.path.join(self.directory, self.DATABASE_NAME), timeout=10)
@@ -1,22 +1,276 @@
 # Standard library imports
 import datetime
-import yfinance as yf
-# Third party imports
-import requests_cache
-import matplotlib.pyplot as plt
-from pandas_datareader import data as wb
+import io
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+# Third party imports (yfinance, requests, pandas, pyarrow and matplotlib) are deferred to first use to keep module import cheap
+
+# Local package imports
+from instrumentation import stage, instrumented
+
+
+# Cache directory used when none is given, can be overridden with MARKET_DATA_CACHE environment variable
+DEFAULT_CACHE_DIRECTORY = os.environ.get('MARKET_DATA_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'option_pricing'))
+
+
+class DataProvider(ABC):
+    """Interface of historical market data sources used by MarketDataCache."""
+
+    @abstractmethod
+    def fetch_history(self, ticker, start=None):
+        """
+        Fetches daily bars of specified ticker as dataframe indexed by date.
+        
+        Params:
+        ticker: symbol of the stock
+        start: first date to fetch (inclusive), None fetches the whole available history
+        """
+
+
+def create_session(pool_size=10):
+    """Creates requests session whose connection pool keeps pool_size connections per host alive for reuse."""
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class YahooProvider(DataProvider):
+    """
+    Historical data from yahoo finance.
+    
+    Params:
+    session: requests session shared by all requests, so connections are reused
+    timeout: timeout of a single request in seconds
+    """
+
+    def __init__(self, session=None, timeout=10):
+        self.session = session
+        self.timeout = timeout
+
+    def fetch_history(self, ticker, start=None):
+        import yfinance as yf
+        company = yf.Ticker(ticker, session=self.session)
+        if start is None:
+            return company.history(period="max", timeout=self.timeout)
+        return company.history(start=start.strftime('%Y-%m-%d'), timeout=self.timeout)
+
+
+class HttpCsvProvider(DataProvider):
+    """
+    Historical data served as CSV files over HTTP: GET <base_url>/<ticker>.csv[?start=YYYY-MM-DD].
+    First column of the file holds dates.
+    
+    Params:
+    base_url: address of the data server
+    session: requests session shared by all requests, so connections are reused
+    timeout: timeout of a single request in seconds
+    """
+
+    def __init__(self, base_url, session=None, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.session = session if session is not None else create_session()
+        self.timeout = timeout
+
+    def fetch_history(self, ticker, start=None):
+        import pandas as pd
+        params = {} if start is None else {'start': start.strftime('%Y-%m-%d')}
+        response = self.session.get(f'{self.base_url}/{ticker}.csv', params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return pd.read_csv(io.StringIO(response.text), index_col=0, parse_dates=True)
+
+
+class FixtureProvider(DataProvider):
+    """
+    Historical data from local fixtures, stands in for yahoo finance in tests and offline runs.
+    
+    Params:
+    source: dictionary of dataframes by ticker, or directory with <ticker>.csv files (first column holds dates)
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.requests = []
+
+    def fetch_history(self, ticker, start=None):
+        import pandas as pd
+        # Every request is recorded, so callers can check what would have been downloaded
+        self.requests.append((ticker, start))
+        if isinstance(self.source, dict):
+            data = self.source[ticker]
+        else:
+            data = pd.read_csv(os.path.join(self.source, f'{ticker}.csv'), index_col=0, parse_dates=True)
+        if start is not None:
+            data = data[data.index >= start]
+        return data.copy()
+
+
+class MarketDataCache:
+    """
+    On-disk columnar cache of daily bars, one file per ticker.
+    Files are uncompressed Feather (Arrow IPC) by default, which is read by memory mapping the file;
+    Parquet can be selected as well. When cached data is older than max_age, only bars from the last cached
+    date onwards are fetched from the provider and merged in (the last cached bar may have been incomplete),
+    so whole history is downloaded only once per ticker.
+    
+    Params:
+    cache_directory: directory of the cache files
+    provider: DataProvider used to fetch missing bars, defaults to yahoo finance
+    file_format: 'feather' or 'parquet'
+    max_age: seconds after which cached file is refreshed from the provider
+    """
+
+    def __init__(self, cache_directory=DEFAULT_CACHE_DIRECTORY, provider=None, file_format='feather', max_age=3600):
+        self.cache_directory = cache_directory
+        self.provider = provider if provider is not None else YahooProvider()
+        self.file_format = file_format
+        self.max_age = max_age
+
+    def path(self, ticker):
+        """Returns path of the cache file of specified ticker."""
+        return os.path.join(self.cache_directory, f'{ticker.upper()}.{self.file_format}')
+
+    @instrumented
+    def get_history(self, ticker, refresh=True):
+        """
+        Returns daily bars of specified ticker, fetching from provider only what is missing in the cache.
+        
+        Params:
+        ticker: symbol of the stock
+        refresh: if False, cached data is returned without contacting the provider
+        """
+        import pandas as pd
+
+        with stage('read cache'):
+            cached = self.read(ticker)
+        if cached is None:
+            with stage('data fetch') as instrumented_stage:
+                data = self.provider.fetch_history(ticker)
+                instrumented_stage.record(iterations=len(data))
+        elif not refresh or len(cached) == 0 or time.time() - os.path.getmtime(self.path(ticker)) < self.max_age:
+            return cached
+        else:
+            with stage('data fetch') as instrumented_stage:
+                new_bars = self.provider.fetch_history(ticker, start=cached.index[-1])
+                instrumented_stage.record(iterations=len(new_bars))
+            if len(new_bars) == 0:
+                # Nothing new, only the freshness of the file is updated
+                os.utime(self.path(ticker))
+                return cached
+            data = pd.concat([cached[cached.index < new_bars.index[0]], new_bars])
+
+        data = data[~data.index.duplicated(keep='last')].sort_index()
+        with stage('write cache'):
+            self.write(ticker, data)
+        return data
+
+    def read(self, ticker):
+        """Reads cached bars of specified ticker, returns None when ticker is not cached."""
+        path = self.path(ticker)
+        if not os.path.exists(path):
+            return None
+        if self.file_format == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(path, memory_map=True)
+        else:
+            import pyarrow.feather as feather
+            table = feather.read_table(path, memory_map=True)
+        data = table.to_pandas()
+        return data.set_index(data.columns[0])
+
+    def write(self, ticker, data):
+        """Writes bars of specified ticker to the cache, replacing the file atomically."""
+        import pyarrow as pa
+        os.makedirs(self.cache_directory, exist_ok=True)
+        table = pa.Table.from_pandas(data.rename_axis(data.index.name or 'Date').reset_index(), preserve_index=False)
+        temporary_path = f'{self.path(ticker)}.tmp'
+        if self.file_format == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, temporary_path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, temporary_path, compression='uncompressed')
+        os.replace(temporary_path, self.path(ticker))
 
 
 class Ticker:
     """Class for fetcing data from yahoo finance."""
-    def get_historical_data(ticker):
+    @instrumented
+    def get_historical_data(ticker, cache=None):
+        """
+        Fetches whole daily history of specified ticker.
+        
+        Params:
+        ticker: symbol of the stock
+        cache: MarketDataCache serving the data, None fetches directly from yahoo finance
+        """
+        if cache is not None:
+            return cache.get_history(ticker)
+        import yfinance as yf
         company= yf.Ticker(ticker)
        
 
     # get historical market data
-        data = company.history(period="max")
+        with stage('data fetch'):
+            data = company.history(period="max")
         return data   
 
+    @staticmethod
+    def get_bulk_historical_data(tickers, source=None, max_workers=8, retries=2, retry_delay=1.0):
+        """
+        Fetches histories of many tickers concurrently and aligns them into one panel.
+        
+        Params:
+        tickers: list of symbols
+        source: MarketDataCache or DataProvider, defaults to yahoo finance with one session shared by all workers
+        max_workers: maximum number of concurrent downloads
+        retries: number of additional attempts for a ticker whose download failed (timeouts included)
+        retry_delay: delay before first retry in seconds, doubled with every further attempt
+        
+        Returns tuple (panel, errors): panel is dataframe indexed by date with (ticker, column) MultiIndex columns,
+        errors maps tickers which could not be fetched to the last exception.
+        """
+        import pandas as pd
+
+        if source is None:
+            source = YahooProvider(create_session(max_workers))
+        fetch = source.get_history if isinstance(source, MarketDataCache) else source.fetch_history
+
+        def fetch_with_retries(ticker):
+            for attempt in range(retries + 1):
+                try:
+                    data = fetch(ticker)
+                    if len(data) == 0:
+                        return ValueError(f'No data found for {ticker}')
+                    return data
+                except Exception as e:
+                    error = e
+                    if attempt < retries:
+                        time.sleep(retry_delay * 2 ** attempt)
+            return error
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            results = dict(zip(tickers, pool.map(fetch_with_retries, tickers)))
+
+        histories, errors = {}, {}
+        for ticker, result in results.items():
+            if isinstance(result, Exception):
+                errors[ticker] = result
+                continue
+            # Exchanges have different time zones, bars are aligned on local dates
+            if getattr(result.index, 'tz', None) is not None:
+                result = result.tz_localize(None)
+            histories[ticker] = result
+
+        if not histories:
+            return pd.DataFrame(columns=pd.MultiIndex.from_tuples([], names=['Ticker', None])), errors
+        panel = pd.concat(histories, axis=1, names=['Ticker']).sort_index()
+        return panel, errors
+
     @staticmethod
     def get_columns(data):
         """
@@ -57,6 +311,7 @@ class Ticker:
         try:
             if data is None:
                 return
+            import matplotlib.pyplot as plt
             data[column_name].plot()
             plt.ylabel(f'{column_name}')
             plt.xlabel('Date')